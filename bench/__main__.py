@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+from . import bench_load, bench_micro
+
+# Runs the microbenchmarks and the load harness with fixed seeds and sizes,
+# writes the results as JSON and, given a baseline from an earlier run,
+# exits non-zero when anything got slower by more than --max-regression.
+#
+#   python -m bench --output before.json
+#   python -m bench --baseline before.json --output after.json
+
+# Metric name -> True when larger is better.
+COMPARED = {
+    "seconds": False,
+    "p50_seconds": False,
+    "p99_seconds": False,
+    "throughput_rps": True,
+}
+
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "commit": commit,
+        "started_at": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def _key(result: dict) -> str:
+    # Identifies the same measurement across runs.
+    params = {k: v for k, v in result.items() if k in ("vehicles", "clients", "upstream_latency_ms")}
+    return f"{result['benchmark']}:{result['name']}:" + ",".join(f"{k}={v}" for k, v in sorted(params.items()))
+
+
+def compare(baseline: list[dict], current: list[dict], max_regression: float) -> list[str]:
+    before = {_key(r): r for r in baseline}
+    regressions = []
+    for result in current:
+        old = before.get(_key(result))
+        if old is None:
+            continue
+        for metric, larger_is_better in COMPARED.items():
+            if not old.get(metric) or metric not in result:
+                continue
+            change = result[metric] / old[metric] - 1
+            worse = -change if larger_is_better else change
+            marker = "REGRESSED" if worse > max_regression else ""
+            print(
+                f"{_key(result):<60} {metric:<15} {old[metric]:>12.6g} -> {result[metric]:>12.6g} {change:+8.1%} {marker}",
+                file=sys.stderr,
+            )
+            if marker:
+                regressions.append(f"{_key(result)} {metric} {change:+.1%}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Run the benchmark suite")
+    parser.add_argument("--sizes", default="1000,10000,50000", help="SIRI-VM vehicle counts for microbenchmarks")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--vehicles", type=int, default=10000, help="vehicles behind the stub BODS")
+    parser.add_argument("--latency-ms", type=float, default=50, help="simulated BODS latency")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--skip-micro", action="store_true")
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="results JSON from an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10, help="allowed slowdown, as a fraction")
+    args = parser.parse_args()
+
+    results: list[dict] = []
+    if not args.skip_micro:
+        print("Running microbenchmarks...", file=sys.stderr)
+        results.extend(bench_micro.run([int(s) for s in args.sizes.split(",")], args.repeat))
+    if not args.skip_load:
+        print("Running load test...", file=sys.stderr)
+        results.append(bench_load.run(
+            args.clients, args.duration, vehicles=args.vehicles, latency_ms=args.latency_ms
+        ))
+
+    report = {"environment": _environment(), "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["environment"].get("machine") != report["environment"]["machine"]:
+            print("Warning: baseline was recorded on a different machine", file=sys.stderr)
+        regressions = compare(baseline["results"], results, args.max_regression)
+        if regressions:
+            print(f"{len(regressions)} regressions over {args.max_regression:.0%}:", file=sys.stderr)
+            for line in regressions:
+                print(f"  {line}", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
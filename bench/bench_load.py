@@ -0,0 +1,213 @@
+from __future__ import annotations
+
+import argparse
+import logging
+import math
+import random
+import threading
+import time
+from typing import Callable
+
+import requests
+from werkzeug.serving import make_server
+
+from src.app import create_app
+from src.config import Config
+from src.tracker import BusTracker
+
+from .siri_gen import DEFAULT_REGION
+from .stub_server import StubUpstream
+
+# Drives /api/buses the way the map does: each client holds a viewport,
+# mostly pans it a fraction of its width, sometimes zooms, and otherwise
+# refreshes in place with the ETag it was last given.
+VIEWPORT_SIZES = (  # degrees of longitude, latitude; roughly zoom 17 down to 14
+    (0.01, 0.006),
+    (0.02, 0.012),
+    (0.04, 0.024),
+    (0.08, 0.048),
+)
+PAN_PROBABILITY = 0.6
+ZOOM_PROBABILITY = 0.1
+
+
+class Viewport:
+    def __init__(self, rng: random.Random, region: tuple[float, float, float, float] = DEFAULT_REGION):
+        self.rng = rng
+        self.region = region
+        west, south, east, north = region
+        self.lon = rng.uniform(west, east)
+        self.lat = rng.uniform(south, north)
+        self.zoom = rng.randrange(len(VIEWPORT_SIZES))
+        self.heading = rng.uniform(0, 2 * math.pi)
+
+    def bounds(self) -> tuple[float, float, float, float]:
+        width, height = VIEWPORT_SIZES[self.zoom]
+        return (
+            round(self.lon - width / 2, 6), round(self.lat - height / 2, 6),
+            round(self.lon + width / 2, 6), round(self.lat + height / 2, 6),
+        )
+
+    def step(self) -> bool:
+        # True when the view changed, False for an in-place refresh.
+        roll = self.rng.random()
+        if roll < ZOOM_PROBABILITY:
+            self.zoom = max(0, min(len(VIEWPORT_SIZES) - 1, self.zoom + self.rng.choice((-1, 1))))
+            return True
+        if roll < ZOOM_PROBABILITY + PAN_PROBABILITY:
+            # Drift in a mostly consistent direction, as someone following a route would.
+            self.heading += self.rng.gauss(0, 0.5)
+            width, height = VIEWPORT_SIZES[self.zoom]
+            distance = self.rng.uniform(0.1, 0.5)
+            west, south, east, north = self.region
+            self.lon = min(east, max(west, self.lon + math.cos(self.heading) * width * distance))
+            self.lat = min(north, max(south, self.lat + math.sin(self.heading) * height * distance))
+            return True
+        return False
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _client(base_url: str, seed: int, stop: threading.Event, record: Callable) -> None:
+    rng = random.Random(seed)
+    viewport = Viewport(rng)
+    session = requests.Session()
+    etag = None
+    while not stop.is_set():
+        if viewport.step():
+            etag = None
+        west, south, east, north = viewport.bounds()
+        headers = {"Accept-Encoding": "gzip", **({"If-None-Match": etag} if etag else {})}
+        started = time.perf_counter()
+        try:
+            resp = session.get(
+                f"{base_url}/api/buses",
+                params={"west": west, "south": south, "east": east, "north": north},
+                headers=headers,
+                timeout=30,
+            )
+            status = resp.status_code
+            etag = resp.headers.get("ETag", etag)
+        except requests.RequestException:
+            status = 0
+        record(time.perf_counter() - started, status)
+
+
+def run(
+    clients: int = 16,
+    duration: float = 20,
+    warmup: float = 3,
+    vehicles: int = 10000,
+    latency_ms: float = 50,
+    seed: int = 0,
+    url: str | None = None,
+) -> dict:
+    stub = None
+    server = None
+    if url is None:
+        # Everything in this process: the stub upstreams plus the app on
+        # werkzeug's threaded server, configured so only the code under
+        # test - not quotas or optional features - shapes the numbers.
+        stub = StubUpstream(vehicles, seed, latency_ms).start()
+        config = Config(
+            api_base=stub.url,
+            poll_region=None,
+            snapshot_path="",
+            history_path="",
+            state_backend="memory",
+            cap_key_id="",
+            osrm_url="",
+            aircraft_url="",
+            aircraft_route_url="",
+            max_requests_per_hour=10**9,
+            client_max_requests_per_minute=0,
+            session_max_requests_per_minute=0,
+        )
+        app = create_app(BusTracker("bench", config), config)
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        server = make_server("127.0.0.1", 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="bench-app", daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+
+    lock = threading.Lock()
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    measuring = threading.Event()
+
+    def record(seconds: float, status: int) -> None:
+        if not measuring.is_set():
+            return
+        with lock:
+            latencies.append(seconds)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=_client, args=(url, seed * 1000 + i, stop, record), daemon=True)
+        for i in range(clients)
+    ]
+    try:
+        for t in threads:
+            t.start()
+        time.sleep(warmup)
+        upstream_before = dict(stub.requests) if stub else {}
+        measuring.set()
+        started = time.perf_counter()
+        time.sleep(duration)
+        measuring.clear()
+        elapsed = time.perf_counter() - started
+        stop.set()
+        for t in threads:
+            t.join(timeout=30)
+    finally:
+        if server is not None:
+            server.shutdown()
+        if stub is not None:
+            stub.stop()
+
+    ordered = sorted(latencies)
+    ok = sum(n for status, n in statuses.items() if status in (200, 304))
+    return {
+        "benchmark": "load",
+        "name": "buses_pan",
+        "clients": clients,
+        "vehicles": vehicles,
+        "upstream_latency_ms": latency_ms,
+        "requests": len(ordered),
+        "throughput_rps": len(ordered) / elapsed if elapsed else 0.0,
+        "error_rate": 1 - ok / len(ordered) if ordered else 0.0,
+        "p50_seconds": _percentile(ordered, 0.50),
+        "p90_seconds": _percentile(ordered, 0.90),
+        "p99_seconds": _percentile(ordered, 0.99),
+        "max_seconds": ordered[-1] if ordered else 0.0,
+        "statuses": {str(k): v for k, v in sorted(statuses.items())},
+        "upstream_requests": stub.requests.get("bods", 0) - upstream_before.get("bods", 0) if stub else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load /api/buses with panning viewports")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--warmup", type=float, default=3)
+    parser.add_argument("--vehicles", type=int, default=10000)
+    parser.add_argument("--latency-ms", type=float, default=50, help="simulated BODS latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="target a running server instead of an in-process one")
+    args = parser.parse_args()
+
+    r = run(args.clients, args.duration, args.warmup, args.vehicles, args.latency_ms, args.seed, args.url)
+    print(f"{r['requests']} requests, {r['throughput_rps']:.1f} req/s, errors {r['error_rate']:.2%}")
+    print(
+        f"p50 {r['p50_seconds'] * 1000:.1f} ms  p90 {r['p90_seconds'] * 1000:.1f} ms  "
+        f"p99 {r['p99_seconds'] * 1000:.1f} ms  max {r['max_seconds'] * 1000:.1f} ms"
+    )
+    print(f"statuses {r['statuses']}, upstream requests {r['upstream_requests']}")
+
+
+if __name__ == "__main__":
+    main()
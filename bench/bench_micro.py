@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import io
+import statistics
+import time
+from typing import Callable
+
+from src.config import Config
+from src.encoding import COLUMNS_MIMETYPE, ResponseCache, encode_json, vehicle_columns
+from src.lines import LineIndex
+from src.registry import VehicleRegistry
+from src.siri import parse_siri_vm
+from src.state import decode_vehicles, encode_vehicles
+from src.tracker import BusTracker
+
+from .siri_gen import DEFAULT_REGION, generate_siri_vm
+from .stub_server import StubUpstream
+
+# Per-operation timings for the hot paths behind /api/buses. Each benchmark
+# runs `number` calls per sample and reports the median and best sample,
+# so one noisy sample doesn't move the number that gets compared.
+
+
+def _time(fn: Callable[[], object], number: int, repeat: int) -> tuple[float, float]:
+    samples = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - started) / number)
+    return statistics.median(samples), min(samples)
+
+
+def _result(name: str, params: dict, fn: Callable[[], object], number: int, repeat: int) -> dict:
+    median, best = _time(fn, number, repeat)
+    return {"benchmark": "micro", "name": name, **params, "seconds": median, "best_seconds": best}
+
+
+def bench_parse(sizes: list[int], repeat: int) -> list[dict]:
+    results = []
+    for size in sizes:
+        body = generate_siri_vm(size)
+        results.append(_result("parse", {"vehicles": size}, lambda: parse_siri_vm(io.BytesIO(body)), 1, repeat))
+    return results
+
+
+def bench_serialize(sizes: list[int], repeat: int) -> list[dict]:
+    results = []
+    for size in sizes:
+        vehicles = parse_siri_vm(generate_siri_vm(size))
+        number = max(1, 10000 // size)
+        results.append(_result(
+            "serialize_json", {"vehicles": size},
+            lambda: encode_json({"version": 1, "vehicles": [v.to_dict() for v in vehicles]}),
+            number, repeat,
+        ))
+        results.append(_result(
+            "serialize_columns", {"vehicles": size},
+            lambda: encode_json({"version": 1, "vehicles": vehicle_columns(vehicles)}, COLUMNS_MIMETYPE),
+            number, repeat,
+        ))
+        blob = encode_vehicles(vehicles[0].timestamp, vehicles)
+        results.append(_result(
+            "state_encode", {"vehicles": size},
+            lambda: encode_vehicles(vehicles[0].timestamp, vehicles), number, repeat,
+        ))
+        results.append(_result("state_decode", {"vehicles": size}, lambda: decode_vehicles(blob), number, repeat))
+    return results
+
+
+def bench_registry(sizes: list[int], repeat: int) -> list[dict]:
+    results = []
+    for size in sizes:
+        vehicles = parse_siri_vm(generate_siri_vm(size))
+        registry = VehicleRegistry(0.1, 600, 100000)
+        registry.ingest(DEFAULT_REGION, list(vehicles))
+        # Steady state: the same vehicles again, so this is the unchanged path.
+        results.append(_result(
+            "registry_ingest", {"vehicles": size},
+            lambda: registry.ingest(DEFAULT_REGION, list(vehicles)), 1, repeat,
+        ))
+
+        lines = LineIndex()
+        registry.add_listener(lines)
+        filters = {"line": [vehicles[0].line]}
+        results.append(_result(
+            "line_filter_index", {"vehicles": size}, lambda: lines.find(filters, DEFAULT_REGION), 1000, repeat,
+        ))
+        results.append(_result(
+            "line_filter_scan", {"vehicles": size},
+            lambda: [v for v in vehicles if v.line == vehicles[0].line], max(1, 10000 // size), repeat,
+        ))
+    return results
+
+
+def bench_cache(vehicles: int, repeat: int) -> list[dict]:
+    results = []
+    with StubUpstream(vehicles) as stub:
+        config = Config(
+            api_base=stub.url,
+            poll_region=None,
+            snapshot_path="",
+            history_path="",
+            state_backend="memory",
+            cache_ttl_seconds=3600,
+        )
+        tracker = BusTracker("bench", config)
+        west, south, east, north = DEFAULT_REGION
+        # About a zoom-15 viewport in the middle of the region.
+        lon, lat = (west + east) / 2, (south + north) / 2
+        bounds = (lon - 0.02, lat - 0.012, lon + 0.02, lat + 0.012)
+        tracker.get_view(bounds)
+        results.append(_result("tile_cache_hit", {"vehicles": vehicles}, lambda: tracker.get_view(bounds), 1000, repeat))
+
+        view = tracker.get_view(bounds)
+        responses = ResponseCache(256)
+        build = lambda: encode_json({"version": view.version, "vehicles": [v.to_dict() for v in view.vehicles]})
+        responses.get_or_encode(("buses", view.key), build)
+        results.append(_result(
+            "response_cache_hit", {"vehicles": vehicles},
+            lambda: responses.get_or_encode(("buses", view.key), build), 10000, repeat,
+        ))
+    return results
+
+
+def run(sizes: list[int], repeat: int) -> list[dict]:
+    return [
+        *bench_parse(sizes, repeat),
+        *bench_serialize(sizes, repeat),
+        *bench_registry(sizes, repeat),
+        *bench_cache(max(sizes), repeat),
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Microbenchmarks for parsing, caching and serialization")
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'name':<20} {'vehicles':>8} {'median ms':>10} {'best ms':>10}")
+    for r in run([int(s) for s in args.sizes.split(",")], args.repeat):
+        print(f"{r['name']:<20} {r['vehicles']:>8} {r['seconds'] * 1000:>10.3f} {r['best_seconds'] * 1000:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
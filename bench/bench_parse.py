@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import argparse
+import gc
+import io
+import time
+import tracemalloc
+
+import defusedxml.ElementTree as ET
+
+from src.models import Vehicle
+from src.siri import parse_siri_vm
+
+from .siri_gen import generate_siri_vm
+
+LEGACY_NS = {"siri": "http://www.siri.org.uk/siri"}
+
+
+def legacy_parse_siri_vm(xml_content: str) -> list[Vehicle]:
+    # The tree-building parser this replaced, kept as the baseline.
+    root = ET.fromstring(xml_content)
+    vehicles = []
+    for activity in root.findall(".//siri:VehicleActivity", LEGACY_NS):
+        vehicle_ref = activity.find(".//siri:VehicleRef", LEGACY_NS)
+        location = activity.find(".//siri:VehicleLocation", LEGACY_NS)
+        if vehicle_ref is None or location is None:
+            continue
+        lat = location.find("siri:Latitude", LEGACY_NS)
+        lon = location.find("siri:Longitude", LEGACY_NS)
+
+        def get_text(xpath: str) -> str:
+            elem = activity.find(xpath, LEGACY_NS)
+            return elem.text if elem is not None and elem.text else "Unknown"
+
+        vehicles.append(Vehicle(
+            vehicle_id=vehicle_ref.text or "Unknown",
+            latitude=float(lat.text),
+            longitude=float(lon.text),
+            line=get_text(".//siri:LineRef"),
+            operator=get_text(".//siri:OperatorRef"),
+            destination=get_text(".//siri:DestinationName"),
+        ))
+    return vehicles
+
+
+def _measure(fn, payload, repeat: int) -> tuple[float, int, int]:
+    best = float("inf")
+    count = 0
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        count = len(fn(payload()))
+        best = min(best, time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    fn(payload())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, count
+
+
+def run(sizes: list[int], repeat: int) -> list[dict]:
+    results = []
+    for size in sizes:
+        body = generate_siri_vm(size)
+        # The legacy path decoded response.text; the streaming path reads bytes.
+        legacy = _measure(legacy_parse_siri_vm, lambda: body.decode("utf-8"), repeat)
+        streaming = _measure(parse_siri_vm, lambda: io.BytesIO(body), repeat)
+        for name, (seconds, peak, count) in (("legacy", legacy), ("streaming", streaming)):
+            results.append({
+                "benchmark": "parse",
+                "parser": name,
+                "vehicles": size,
+                "parsed": count,
+                "seconds": round(seconds, 4),
+                "peak_mib": round(peak / 2**20, 2),
+            })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare SIRI-VM parsers")
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    print(f"{'parser':<10} {'vehicles':>8} {'seconds':>8} {'peak MiB':>9}")
+    for r in run(sizes, args.repeat):
+        print(f"{r['parser']:<10} {r['vehicles']:>8} {r['seconds']:>8.4f} {r['peak_mib']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
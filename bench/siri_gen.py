@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+from src.siri import SIRI_NS
+
+# Roughly Greater London; wide enough that tile and bbox benchmarks
+# see realistic spreads of vehicles.
+DEFAULT_REGION = (-0.51, 51.28, 0.33, 51.69)
+EPOCH = datetime(2025, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+
+@dataclass
+class FleetVehicle:
+    ref: int
+    line: int
+    operator: int
+    direction: str
+    destination: int
+    block: int
+    origin_ref: int
+    destination_ref: int
+    longitude: float
+    latitude: float
+    bearing: float
+    age_seconds: int
+
+
+def generate_fleet(
+    count: int,
+    seed: int = 0,
+    region: tuple[float, float, float, float] = DEFAULT_REGION,
+    lines: int = 400,
+    operators: int = 40,
+) -> list[FleetVehicle]:
+    rng = random.Random(seed)
+    west, south, east, north = region
+    return [
+        FleetVehicle(
+            ref=i,
+            line=rng.randint(1, lines),
+            operator=rng.randint(1, operators),
+            direction=rng.choice(("inbound", "outbound")),
+            destination=rng.randint(1, 2),
+            block=rng.randint(1, 500),
+            origin_ref=rng.randint(1, 9999),
+            destination_ref=rng.randint(1, 9999),
+            longitude=rng.uniform(west, east),
+            latitude=rng.uniform(south, north),
+            bearing=rng.uniform(0, 360),
+            age_seconds=rng.randint(0, 120),
+        )
+        for i in range(count)
+    ]
+
+
+def render_siri_vm(fleet: list[FleetVehicle], now: datetime = EPOCH) -> bytes:
+    parts = [
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        f'<Siri xmlns="{SIRI_NS}" version="2.0"><ServiceDelivery>'
+        f"<ResponseTimestamp>{now.isoformat()}</ResponseTimestamp>"
+        "<ProducerRef>DepartmentForTransport</ProducerRef>"
+        "<VehicleMonitoringDelivery>"
+        f"<ResponseTimestamp>{now.isoformat()}</ResponseTimestamp>"
+    ]
+    valid_until = (now + timedelta(minutes=5)).isoformat()
+    for v in fleet:
+        recorded = now - timedelta(seconds=v.age_seconds)
+        parts.append(
+            "<VehicleActivity>"
+            f"<RecordedAtTime>{recorded.isoformat()}</RecordedAtTime>"
+            f"<ItemIdentifier>{v.ref:08x}-bench</ItemIdentifier>"
+            f"<ValidUntilTime>{valid_until}</ValidUntilTime>"
+            "<MonitoredVehicleJourney>"
+            f"<LineRef>{v.line}</LineRef>"
+            f"<DirectionRef>{v.direction}</DirectionRef>"
+            f"<PublishedLineName>{v.line}</PublishedLineName>"
+            f"<OperatorRef>OP{v.operator:02d}</OperatorRef>"
+            f"<OriginRef>{v.origin_ref:04d}</OriginRef>"
+            f"<OriginName>Origin_{v.line}</OriginName>"
+            f"<DestinationRef>{v.destination_ref:04d}</DestinationRef>"
+            f"<DestinationName>Destination_{v.line}_{v.destination}</DestinationName>"
+            "<VehicleLocation>"
+            f"<Longitude>{v.longitude:.6f}</Longitude>"
+            f"<Latitude>{v.latitude:.6f}</Latitude>"
+            "</VehicleLocation>"
+            f"<Bearing>{v.bearing:.1f}</Bearing>"
+            f"<BlockRef>{v.block}</BlockRef>"
+            f"<VehicleRef>{v.ref}</VehicleRef>"
+            "</MonitoredVehicleJourney>"
+            "</VehicleActivity>"
+        )
+    parts.append("</VehicleMonitoringDelivery></ServiceDelivery></Siri>")
+    return "".join(parts).encode("utf-8")
+
+
+def generate_siri_vm(
+    count: int,
+    seed: int = 0,
+    region: tuple[float, float, float, float] = DEFAULT_REGION,
+    lines: int = 400,
+    operators: int = 40,
+) -> bytes:
+    return render_siri_vm(generate_fleet(count, seed, region, lines, operators))
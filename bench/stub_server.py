@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import argparse
+import bisect
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .siri_gen import DEFAULT_REGION, FleetVehicle, generate_fleet, render_siri_vm
+
+# One local server standing in for every upstream the app talks to:
+#   GET  /datafeed?boundingBox=w,s,e,n        BODS SIRI-VM
+#   GET  /route/v1/driving/x0,y0;x1,y1        OSRM, a straight two-point route
+#   GET  /aircraft.json                       tar1090
+#   POST /routes                              aircraft route lookup
+#   POST /<key id>/siteverify                 Cap
+# Everything is generated from a seed, so two runs see the same data.
+
+
+class StubUpstream:
+    def __init__(self, vehicles: int = 10000, seed: int = 0, latency_ms: float = 0, aircraft: int = 200):
+        self.fleet = sorted(generate_fleet(vehicles, seed), key=lambda v: v.longitude)
+        self._longitudes = [v.longitude for v in self.fleet]
+        self.latency_ms = latency_ms
+        # Set to make BODS answer 503, to rehearse an upstream incident.
+        self.failing = False
+        self.aircraft = _generate_aircraft(aircraft, seed)
+        self.requests: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def within(self, west: float, south: float, east: float, north: float) -> list[FleetVehicle]:
+        lo = bisect.bisect_left(self._longitudes, west)
+        hi = bisect.bisect_right(self._longitudes, east)
+        return [v for v in self.fleet[lo:hi] if south <= v.latitude <= north]
+
+    def count(self, name: str) -> None:
+        with self._lock:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> StubUpstream:
+        self._server = ThreadingHTTPServer((host, port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name="stub-upstream", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> StubUpstream:
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+def _generate_aircraft(count: int, seed: int) -> list[dict]:
+    rng = random.Random(seed)
+    west, south, east, north = DEFAULT_REGION
+    return [
+        {
+            "hex": f"{0x400000 + i:06x}",
+            "flight": f"BAW{i:04d}",
+            "lat": rng.uniform(south, north),
+            "lon": rng.uniform(west, east),
+            "alt_baro": rng.randint(1000, 38000),
+            "gs": rng.uniform(150, 480),
+            "track": rng.uniform(0, 360),
+        }
+        for i in range(count)
+    ]
+
+
+def _handler(stub: StubUpstream) -> type[BaseHTTPRequestHandler]:
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            url = urlsplit(self.path)
+            self._delay()
+            if url.path == "/datafeed":
+                stub.count("bods")
+                if stub.failing:
+                    return self._send(503, b"service unavailable", "text/plain")
+                try:
+                    west, south, east, north = (float(x) for x in parse_qs(url.query)["boundingBox"][0].split(","))
+                except (KeyError, ValueError):
+                    return self._send(400, b"bad boundingBox", "text/plain")
+                return self._send(200, render_siri_vm(stub.within(west, south, east, north)), "application/xml")
+            if url.path.startswith("/route/v1/driving/"):
+                stub.count("osrm")
+                try:
+                    coords = [
+                        [float(x) for x in point.split(",")]
+                        for point in url.path.rsplit("/", 1)[1].split(";")
+                    ]
+                except ValueError:
+                    return self._json(400, {"code": "InvalidQuery"})
+                return self._json(200, {
+                    "code": "Ok",
+                    "routes": [{"geometry": {"type": "LineString", "coordinates": coords}, "duration": 60.0}],
+                })
+            if url.path == "/aircraft.json":
+                stub.count("aircraft")
+                return self._json(200, {"now": time.time(), "aircraft": stub.aircraft})
+            self._send(404, b"not found", "text/plain")
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self._delay()
+            if self.path == "/routes":
+                stub.count("aircraft_routes")
+                planes = json.loads(body or b"{}").get("planes", [])
+                return self._json(200, [
+                    {"callsign": p["callsign"], "_airport_codes_iata": "LHR-JFK"} for p in planes
+                ])
+            if self.path.endswith("/siteverify"):
+                stub.count("cap")
+                return self._json(200, {"success": True})
+            self._send(404, b"not found", "text/plain")
+
+        def _delay(self):
+            if stub.latency_ms:
+                time.sleep(stub.latency_ms / 1000)
+
+        def _json(self, status: int, payload) -> None:
+            self._send(status, json.dumps(payload).encode(), "application/json")
+
+        def _send(self, status: int, body: bytes, content_type: str) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Serve stub BODS, OSRM, aircraft and Cap upstreams")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--vehicles", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    stub = StubUpstream(args.vehicles, args.seed, args.latency_ms).start(args.host, args.port)
+    print(f"Stub upstream on {stub.url} ({args.vehicles} vehicles); API_BASE={stub.url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        stub.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,8 @@ try:
 except ImportError:
     pass
 
+from flask import Flask
+
 from .app import create_app
 from .config import DEFAULT_HOST, DEFAULT_PORT, Config
 from .tracker import BusTracker
@@ -25,6 +27,46 @@ def _env_int(key: str, default: int) -> int:
     return int(os.environ.get(key, default))
 
 
+def build_app(api_key: str, config: Config) -> Flask:
+    tracker = BusTracker(api_key, config)
+    return create_app(tracker, config)
+
+
+def serve_gunicorn(api_key: str, config: Config) -> None:
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        logger.error("SERVER=gunicorn but gunicorn is not installed (pip install gunicorn)")
+        sys.exit(1)
+
+    class BusTrackerApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{config.host}:{config.port}")
+            self.cfg.set("workers", config.server_workers)
+            # Threaded workers: upstream calls and event streams block a
+            # thread, not the whole process.
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("threads", config.server_threads)
+            self.cfg.set("accesslog", None)
+
+        def load(self):
+            # Called in each worker after the fork, so the tracker's
+            # background threads start where they will actually run.
+            return build_app(api_key, config)
+
+    BusTrackerApplication().run()
+
+
+def serve_waitress(api_key: str, config: Config) -> None:
+    try:
+        from waitress import serve
+    except ImportError:
+        logger.error("SERVER=waitress but waitress is not installed (pip install waitress)")
+        sys.exit(1)
+
+    serve(build_app(api_key, config), host=config.host, port=config.port, threads=config.server_threads)
+
+
 def main() -> None:
     api_key = os.environ.get("BUS_API_KEY")
     if not api_key:
@@ -35,8 +77,26 @@ def main() -> None:
         sys.exit(1)
 
     config = Config()
-    tracker = BusTracker(api_key, config)
-    app = create_app(tracker, config)
+
+    if config.server == "gunicorn":
+        logger.info(
+            f"Starting Bus Tracker (gunicorn, {config.server_workers} workers x "
+            f"{config.server_threads} threads) on http://{config.host}:{config.port}"
+        )
+        if config.server_workers > 1 and config.state_backend == "memory":
+            logger.warning("Each worker keeps its own cache and rate limit state; set STATE_BACKEND=redis to share them")
+        serve_gunicorn(api_key, config)
+        return
+
+    if config.server == "waitress":
+        logger.info(
+            f"Starting Bus Tracker (waitress, {config.server_threads} threads) "
+            f"on http://{config.host}:{config.port}"
+        )
+        serve_waitress(api_key, config)
+        return
+
+    app = build_app(api_key, config)
 
     debug = os.environ.get("FLASK_DEBUG", "").lower() in ("1", "true")
     host = os.environ.get("HOST", DEFAULT_HOST)
@@ -0,0 +1,226 @@
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import requests
+
+from .metrics import CACHE_EVICTIONS, CACHE_LOOKUPS, UPSTREAM_BYTES, UPSTREAM_ERRORS, UPSTREAM_SECONDS
+from .poller import Poller
+from .tiles import BoundingBox
+
+logger = logging.getLogger(__name__)
+
+# Long enough to collect the lookups of clients refreshing at the same time,
+# short against the feed interval.
+BATCH_WINDOW_SECONDS = 0.05
+MAX_BATCH_PLANES = 100
+UNKNOWN_TTL_SECONDS = 300
+
+
+@dataclass(frozen=True)
+class AircraftSnapshot:
+    fetched_at: float
+    # aircraft.json as tar1090 sent it, passed through whole when unfiltered.
+    data: dict
+    # Only positioned aircraft can be filtered by bbox.
+    positioned: tuple[dict, ...]
+    version: int
+
+    def within(self, bounding_box: BoundingBox) -> list[dict]:
+        west, south, east, north = bounding_box
+        return [
+            ac for ac in self.positioned
+            if west <= ac["lon"] <= east and south <= ac["lat"] <= north
+        ]
+
+
+class AircraftFeed(Poller):
+    # One upstream fetch per interval however many browsers are watching;
+    # requests are answered from the latest snapshot.
+    def __init__(self, url: str, session: requests.Session, interval_seconds: float, timeout: int = 10):
+        super().__init__("aircraft-poller", interval_seconds)
+        self.url = url
+        self.timeout = timeout
+        self._session = session
+        self._validators: dict[str, str] = {}
+        self.snapshot: AircraftSnapshot | None = None
+        # When the feed last confirmed the snapshot, with new data or a 304.
+        self.checked_at: float | None = None
+
+    def age_seconds(self) -> float | None:
+        return time.time() - self.checked_at if self.checked_at is not None else None
+
+    def poll_once(self) -> None:
+        try:
+            with UPSTREAM_SECONDS.time("aircraft"):
+                resp = self._session.get(self.url, headers=self._validators, timeout=self.timeout)
+            UPSTREAM_BYTES.inc("aircraft", amount=len(resp.content))
+            if resp.status_code == 304 and self.snapshot is not None:
+                self.checked_at = time.time()
+                return
+            resp.raise_for_status()
+            data = resp.json()
+            if not isinstance(data, dict):
+                raise ValueError(f"expected an object, got {type(data).__name__}")
+        except (requests.RequestException, ValueError) as e:
+            UPSTREAM_ERRORS.inc("aircraft")
+            logger.warning(f"Aircraft feed fetch failed: {e}")
+            return
+
+        # Conditional GET where the feed supports it (tar1090 behind nginx
+        # does), so an unchanged aircraft.json costs a 304 and no parsing.
+        self._validators = {}
+        if etag := resp.headers.get("ETag"):
+            self._validators["If-None-Match"] = etag
+        if modified := resp.headers.get("Last-Modified"):
+            self._validators["If-Modified-Since"] = modified
+
+        positioned = tuple(
+            ac for ac in data.get("aircraft", ())
+            if isinstance(ac, dict)
+            and isinstance(ac.get("lat"), (int, float)) and isinstance(ac.get("lon"), (int, float))
+        )
+        version = self.snapshot.version + 1 if self.snapshot is not None else 1
+        now = time.time()
+        self.snapshot = AircraftSnapshot(now, data, positioned, version)
+        self.checked_at = now
+
+
+class _RouteFlight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.route: dict | None = None
+
+
+class AircraftRouteCache:
+    # Callsign -> route, shared by every client. Callsigns nobody has looked
+    # up yet are queued; the first request to find the queue idle waits one
+    # batch window, then sends everything queued by then - its own planes
+    # and those of any concurrent clients - in a single upstream call.
+    def __init__(
+        self,
+        url: str,
+        session: requests.Session,
+        ttl_seconds: int,
+        max_entries: int,
+        batch_window_seconds: float = BATCH_WINDOW_SECONDS,
+        timeout: int = 10,
+    ):
+        self.url = url
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.batch_window_seconds = batch_window_seconds
+        self.timeout = timeout
+        self._session = session
+        self._entries: OrderedDict[str, tuple[float, dict | None]] = OrderedDict()
+        self._inflight: dict[str, _RouteFlight] = {}
+        self._queue: dict[str, dict] = {}
+        self._batch_pending = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_routes(self, planes: list[dict]) -> list[dict]:
+        now = time.time()
+        routes: list[dict] = []
+        waiting: list[_RouteFlight] = []
+        leader = False
+
+        with self._lock:
+            for plane in planes:
+                callsign = plane["callsign"]
+                entry = self._entries.get(callsign)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(callsign)
+                    self.hits += 1
+                    CACHE_LOOKUPS.inc("aircraft_routes", "hit")
+                    if entry[1] is not None:
+                        routes.append(entry[1])
+                    continue
+
+                self.misses += 1
+                flight = self._inflight.get(callsign)
+                if flight is None:
+                    flight = self._inflight[callsign] = _RouteFlight()
+                    self._queue[callsign] = plane
+                    CACHE_LOOKUPS.inc("aircraft_routes", "miss")
+                else:
+                    CACHE_LOOKUPS.inc("aircraft_routes", "wait")
+                waiting.append(flight)
+
+            if self._queue and not self._batch_pending:
+                self._batch_pending = leader = True
+
+        if leader:
+            time.sleep(self.batch_window_seconds)
+            with self._lock:
+                batch, self._queue = self._queue, {}
+                self._batch_pending = False
+            self._resolve(batch)
+
+        for flight in waiting:
+            if flight.done.wait(self.timeout * 2) and flight.route is not None:
+                routes.append(flight.route)
+        return routes
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "aircraft_route_cache_entries": len(self._entries),
+                "aircraft_route_cache_hits": self.hits,
+                "aircraft_route_cache_misses": self.misses,
+            }
+
+    def _resolve(self, batch: dict[str, dict]) -> None:
+        planes = list(batch.values())
+        found: dict[str, dict] = {}
+        failed = False
+        try:
+            for i in range(0, len(planes), MAX_BATCH_PLANES):
+                try:
+                    with UPSTREAM_SECONDS.time("aircraft_routes"):
+                        resp = self._session.post(
+                            self.url, json={"planes": planes[i:i + MAX_BATCH_PLANES]}, timeout=self.timeout
+                        )
+                    UPSTREAM_BYTES.inc("aircraft_routes", amount=len(resp.content))
+                    resp.raise_for_status()
+                    data = resp.json()
+                    if not isinstance(data, list):
+                        raise ValueError(f"expected a list of routes, got {type(data).__name__}")
+                    found.update(
+                        (route["callsign"], route) for route in data
+                        if isinstance(route, dict) and route.get("callsign") in batch
+                    )
+                except (requests.RequestException, ValueError) as e:
+                    UPSTREAM_ERRORS.inc("aircraft_routes")
+                    logger.warning(f"Aircraft route lookup failed: {e}")
+                    failed = True
+        except BaseException:
+            # Something we didn't expect; still release everyone waiting.
+            failed = True
+            raise
+        finally:
+            self._settle(batch, found, failed)
+
+    def _settle(self, batch: dict[str, dict], found: dict[str, dict], failed: bool) -> None:
+        now = time.time()
+        with self._lock:
+            for callsign in batch:
+                route = found.get(callsign)
+                # Unknown callsigns are remembered briefly so they are not
+                # re-asked every refresh; failed lookups not at all.
+                if route is not None or not failed:
+                    ttl = self.ttl_seconds if route is not None else UNKNOWN_TTL_SECONDS
+                    self._entries[callsign] = (now + ttl, route)
+                    self._entries.move_to_end(callsign)
+                flight = self._inflight.pop(callsign, None)
+                if flight is not None:
+                    flight.route = route
+                    flight.done.set()
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                CACHE_EVICTIONS.inc("aircraft_routes")
@@ -1,14 +1,25 @@
 from __future__ import annotations
 
+import atexit
+import logging
 import os
+import threading
 from pathlib import Path
 
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 
+from .aircraft import AircraftFeed, AircraftRouteCache
 from .captcha import CaptchaManager, RateLimiter
-from .config import Config
+from .config import STREAM_THREAD_HEADROOM, Config
+from .encoding import ResponseCache
+from .osrm import RouteCache
 from .routes import bp
+from .state import make_backend
 from .tracker import BusTracker
+from .upstream import make_session
+
+logger = logging.getLogger(__name__)
 
 
 def create_app(tracker: BusTracker | None = None, config: Config | None = None) -> Flask:
@@ -20,12 +31,76 @@ def create_app(tracker: BusTracker | None = None, config: Config | None = None)
         static_folder=Path(__file__).parent / "static",
     )
 
-    captcha = CaptchaManager(config)
-    rate_limiter = RateLimiter(config.max_requests_per_hour)
+    http = make_session(config.upstream_pool_size)
+    state = tracker.state if tracker is not None else make_backend(config)
+    captcha = CaptchaManager(config, http, state)
+    rate_limiter = RateLimiter(config.max_requests_per_hour, state=state)
+    app.config["client_quota"] = RateLimiter(
+        config.client_max_requests_per_minute, 60, state, name="client"
+    ) if config.client_max_requests_per_minute else None
+    app.config["session_quota"] = RateLimiter(
+        config.session_max_requests_per_minute, 60, state, name="session"
+    ) if config.session_max_requests_per_minute else None
     app.config["app_config"] = config
+    app.config["http"] = http
+    app.config["state"] = state
     app.config["captcha"] = captcha
     app.config["rate_limiter"] = rate_limiter
     app.config["tracker"] = tracker
+    app.config["responses"] = ResponseCache(config.response_cache_max_entries)
+    app.config["cluster_responses"] = ResponseCache(config.cluster_response_cache_max_entries, "cluster_responses")
+    app.config["aircraft_responses"] = ResponseCache(
+        config.aircraft_response_cache_max_entries, "aircraft_responses"
+    )
+    # Streams never take the threads that plain requests and /health need.
+    app.config["stream_slots"] = threading.BoundedSemaphore(
+        max(0, min(config.stream_max_clients, config.server_threads - STREAM_THREAD_HEADROOM))
+    )
+    app.config["routes"] = RouteCache(
+        config.osrm_url,
+        http,
+        config.route_cache_precision,
+        config.route_cache_ttl_seconds,
+        config.route_cache_max_entries,
+        config.route_concurrency,
+        config.route_batch_timeout_seconds,
+    ) if config.osrm_url else None
+    app.config["aircraft"] = AircraftFeed(
+        config.aircraft_url, http, config.aircraft_refresh_ms / 1000
+    ) if config.aircraft_url else None
+    app.config["aircraft_routes"] = AircraftRouteCache(
+        config.aircraft_route_url,
+        http,
+        config.aircraft_route_ttl_seconds,
+        config.aircraft_route_cache_max_entries,
+    ) if config.aircraft_route_url else None
     app.register_blueprint(bp)
 
+    if config.trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=config.trusted_proxies)
+    elif config.client_max_requests_per_minute:
+        logger.warning(
+            "CLIENT_MAX_REQUESTS_PER_MINUTE is set without TRUSTED_PROXIES; "
+            "behind a reverse proxy every client shares one quota"
+        )
+
+    if app.config["aircraft"] is not None:
+        app.config["aircraft"].start()
+
+    if tracker is not None and config.snapshot_path:
+        tracker.start_snapshots()
+
+    if tracker is not None and tracker.history is not None:
+        tracker.history.start()
+        atexit.register(tracker.history.stop)
+
+    if tracker is not None and config.poll_region is not None:
+        tracker.start_poller(rate_limiter)
+
+    if tracker is not None and config.prefetch_budget > 0:
+        tracker.start_prefetch(
+            RateLimiter(int(config.max_requests_per_hour * config.prefetch_budget), state=state, name="prefetch"),
+            rate_limiter,
+        )
+
     return app
@@ -1,16 +1,16 @@
 from __future__ import annotations
 
 import logging
-import threading
 
 import requests
 import time
 
 import secrets
 import hashlib
-from datetime import datetime, timezone
 
 from .config import Config
+from .metrics import RATE_LIMITED, UPSTREAM_BYTES, UPSTREAM_ERRORS, UPSTREAM_SECONDS
+from .state import MemoryBackend, StateBackend
 
 logger = logging.getLogger(__name__)
 
@@ -18,41 +18,31 @@ class RateLimitExceeded(Exception):
     pass
 
 class CaptchaManager:
-    def __init__(self, config: Config):
+    def __init__(
+        self,
+        config: Config,
+        session: requests.Session | None = None,
+        state: StateBackend | None = None,
+    ):
         self.config = config
-        self._vehicle_count = 0
-        self._lock = threading.Lock()
-        self._tokens: dict[str, datetime] = {}
+        self._session = session or requests.Session()
+        # Tokens and the vehicle count live in the state backend so every
+        # worker honours the same sessions and the same usage total.
+        self._state = state or MemoryBackend()
         self._token_ttl = 3600  # 1 hour
-        self._secret = secrets.token_hex(32)
 
     def generate_token(self) -> str:
         token = secrets.token_urlsafe(32)
-        with self._lock:
-            self._tokens[token] = datetime.now(timezone.utc)
-            self._cleanup_tokens()
+        self._state.set(f"cap:token:{token}", b"1", self._token_ttl)
         return token
 
     def validate_token(self, token: str) -> bool:
         if not token:
             return False
-        with self._lock:
-            issued = self._tokens.get(token)
-            if not issued:
-                return False
-            age = (datetime.now(timezone.utc) - issued).total_seconds()
-            return age < self._token_ttl
+        return self._state.get(f"cap:token:{token}") is not None
 
     def invalidate_token(self, token: str) -> None:
-        with self._lock:
-           self._tokens.pop(token, None)
-
-    def _cleanup_tokens(self) -> None:
-        now = datetime.now(timezone.utc)
-        expired = [t for t, issued in self._tokens.items() 
-                   if (now - issued).total_seconds() >= self._token_ttl]
-        for t in expired:
-            del self._tokens[t]
+        self._state.delete(f"cap:token:{token}")
 
     @property
     def enabled(self) -> bool:
@@ -63,24 +53,19 @@ class CaptchaManager:
         return self.config.cap_challenge_interval
 
     def get_vehicle_count(self) -> int:
-        with self._lock:
-            return self._vehicle_count
+        return int(self._state.get("cap:vehicles") or 0)
 
     def add_vehicles(self, count: int) -> int:
-        with self._lock:
-            self._vehicle_count += count
-            return self._vehicle_count
+        return self._state.incr("cap:vehicles", count)
 
     def check_required(self) -> bool:
         if not self.enabled:
             return False
-        with self._lock:
-            return self._vehicle_count >= self.threshold
+        return self.get_vehicle_count() >= self.threshold
 
     def reset_count(self) -> None:
-        with self._lock:
-            self._vehicle_count = 0
-            logger.info("Cap verified, counter reset")
+        self._state.set("cap:vehicles", b"0")
+        logger.info("Cap verified, counter reset")
 
     def verify_token(self, token: str) -> dict:
         if not self.enabled:
@@ -88,38 +73,60 @@ class CaptchaManager:
 
         try:
             verify_url = f"{self.config.cap_url}/{self.config.cap_key_id}/siteverify"
-            resp = requests.post(
-                verify_url,
-                json={"secret": self.config.cap_key_secret, "response": token},
-                timeout=10,
-            )
+            with UPSTREAM_SECONDS.time("cap"):
+                resp = self._session.post(
+                    verify_url,
+                    json={"secret": self.config.cap_key_secret, "response": token},
+                    timeout=10,
+                )
+            UPSTREAM_BYTES.inc("cap", amount=len(resp.content))
             result = resp.json()
             if result.get("success"):
                 self.reset_count()
             return result
         except Exception as e:
+            UPSTREAM_ERRORS.inc("cap")
             logger.error(f"Cap verification failed: {e}")
             return {"success": False, "error": str(e)}
 
 class RateLimiter:
-    def __init__(self, max_requests: int, window_seconds: int = 3600):
+    # Sliding window approximated from two fixed-window counters: the
+    # previous window's count is weighted by how much of it still overlaps
+    # the sliding window. Constant work and two counters per key, which
+    # expire on their own once the key goes quiet.
+    def __init__(
+        self,
+        max_requests: int,
+        window_seconds: int = 3600,
+        state: StateBackend | None = None,
+        name: str = "upstream",
+    ):
         self.max_requests = max_requests
         self.window_seconds = window_seconds
-        self._requests: list[float] = []
-        self._lock = threading.Lock()
-
-    def check(self) -> bool:
-        now = time.time()
-        with self._lock:
-            self._requests = [t for t in self._requests if now - t < self.window_seconds]
-            if len(self._requests) >= self.max_requests:
-                return False
-            self._requests.append(now)
-            return True
-
-    def remaining(self) -> int:
-        now = time.time()
-        with self._lock:
-            self._requests = [t for t in self._requests if now - t < self.window_seconds]
-            return max(0, self.max_requests - len(self._requests))
+        self.name = name
+        self._state = state or MemoryBackend()
+
+    def check(self, key: str = "") -> bool:
+        current, previous, weight = self._window(key)
+        count = self._state.incr(current, 1, self.window_seconds * 2)
+        if self._estimate(count, previous, weight) > self.max_requests:
+            self._state.incr(current, -1)
+            RATE_LIMITED.inc(self.name)
+            return False
+        return True
+
+    def remaining(self, key: str = "") -> int:
+        current, previous, weight = self._window(key)
+        count = int(self._state.get(current) or 0)
+        return max(0, self.max_requests - int(self._estimate(count, previous, weight)))
+
+    def retry_after(self) -> int:
+        return int(self.window_seconds - time.time() % self.window_seconds) + 1
+
+    def _window(self, key: str) -> tuple[str, str, float]:
+        index, offset = divmod(time.time(), self.window_seconds)
+        prefix = f"ratelimit:{self.name}:{key}:"
+        return f"{prefix}{int(index)}", f"{prefix}{int(index) - 1}", 1 - offset / self.window_seconds
 
+    def _estimate(self, count: int, previous_key: str, weight: float) -> float:
+        return count + int(self._state.get(previous_key) or 0) * weight
@@ -0,0 +1,100 @@
+from __future__ import annotations
+
+import math
+import threading
+from collections import Counter
+
+from .models import Vehicle
+from .tiles import BoundingBox
+
+# Leaflet tiles are 256px wide and span 360 / 2**zoom degrees of longitude.
+TILE_PIXELS = 256
+TOP_N = 3
+
+
+class _Cell:
+    __slots__ = ("count", "sum_lat", "sum_lon", "lines", "operators")
+
+    def __init__(self):
+        self.count = 0
+        self.sum_lat = 0.0
+        self.sum_lon = 0.0
+        self.lines: Counter[str] = Counter()
+        self.operators: Counter[str] = Counter()
+
+    def to_dict(self) -> dict:
+        return {
+            "latitude": round(self.sum_lat / self.count, 6),
+            "longitude": round(self.sum_lon / self.count, 6),
+            "count": self.count,
+            "lines": self.lines.most_common(TOP_N),
+            "operators": self.operators.most_common(TOP_N),
+        }
+
+
+def cell_size_degrees(zoom: int, radius_pixels: int) -> float:
+    return 360 / 2**zoom * (2 * radius_pixels / TILE_PIXELS)
+
+
+class ClusterIndex:
+    # Grid aggregates for every zoom level in [min_zoom, max_zoom], updated
+    # per vehicle as the registry changes so queries never walk vehicles.
+    def __init__(self, min_zoom: int, max_zoom: int, radius_pixels: int):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self._sizes = {z: cell_size_degrees(z, radius_pixels) for z in range(min_zoom, max_zoom + 1)}
+        self._grids: dict[int, dict[tuple[int, int], _Cell]] = {z: {} for z in self._sizes}
+        self._lock = threading.Lock()
+
+    def clamp_zoom(self, zoom: int) -> int:
+        return min(self.max_zoom, max(self.min_zoom, zoom))
+
+    def on_upsert(self, old: Vehicle | None, new: Vehicle) -> None:
+        with self._lock:
+            if old is not None:
+                self._apply(old, -1)
+            self._apply(new, 1)
+
+    def on_remove(self, old: Vehicle) -> None:
+        with self._lock:
+            self._apply(old, -1)
+
+    def cells(self, zoom: int, bounding_box: BoundingBox) -> tuple[int, int, int, int]:
+        # The grid cells covering a bbox; any bbox with the same cells gets
+        # the same clusters.
+        size = self._sizes[self.clamp_zoom(zoom)]
+        west, south, east, north = bounding_box
+        return math.floor(west / size), math.floor(south / size), math.floor(east / size), math.floor(north / size)
+
+    def query(self, zoom: int, bounding_box: BoundingBox) -> list[dict]:
+        zoom = self.clamp_zoom(zoom)
+        x0, y0, x1, y1 = self.cells(zoom, bounding_box)
+        with self._lock:
+            return [
+                cell.to_dict()
+                for (x, y), cell in self._grids[zoom].items()
+                if x0 <= x <= x1 and y0 <= y <= y1
+            ]
+
+    def _apply(self, v: Vehicle, sign: int) -> None:
+        for zoom, size in self._sizes.items():
+            key = (math.floor(v.longitude / size), math.floor(v.latitude / size))
+            grid = self._grids[zoom]
+            cell = grid.get(key)
+            if cell is None:
+                if sign < 0:
+                    continue
+                cell = grid[key] = _Cell()
+
+            cell.count += sign
+            if cell.count <= 0:
+                del grid[key]
+                continue
+            cell.sum_lat += sign * v.latitude
+            cell.sum_lon += sign * v.longitude
+            cell.lines[v.line] += sign
+            cell.operators[v.operator] += sign
+            if cell.lines[v.line] <= 0:
+                del cell.lines[v.line]
+            if cell.operators[v.operator] <= 0:
+                del cell.operators[v.operator]
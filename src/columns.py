@@ -0,0 +1,52 @@
+from __future__ import annotations
+
+from array import array
+from typing import Iterable, Iterator
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .models import Vehicle
+from .tiles import BoundingBox
+
+# Below this many rows the numpy call overhead outweighs the loop it replaces.
+NUMPY_MIN_ROWS = 256
+
+
+class VehicleColumns:
+    # Contiguous coordinate columns over an immutable set of vehicles, so a
+    # bbox query is one vectorized mask rather than attribute lookups per object.
+    # A speed index, not a compact store: the rows are the registry's own
+    # Vehicle objects, and the columns add 16 bytes a row on top of them. Only
+    # the POLL_REGION snapshot uses it; a tile entry holds far fewer than
+    # NUMPY_MIN_ROWS vehicles, so a plain list scans it just as fast.
+    __slots__ = ("rows", "latitudes", "longitudes")
+
+    def __init__(self, vehicles: Iterable[Vehicle] = ()):
+        self.rows: tuple[Vehicle, ...] = tuple(vehicles)
+        self.latitudes = array("d", [v.latitude for v in self.rows])
+        self.longitudes = array("d", [v.longitude for v in self.rows])
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def __iter__(self) -> Iterator[Vehicle]:
+        return iter(self.rows)
+
+    def select(self, bounding_box: BoundingBox) -> list[int]:
+        west, south, east, north = bounding_box
+        if np is not None and len(self.rows) >= NUMPY_MIN_ROWS:
+            lat = np.frombuffer(self.latitudes, dtype=np.float64)
+            lon = np.frombuffer(self.longitudes, dtype=np.float64)
+            mask = (lon >= west) & (lon <= east) & (lat >= south) & (lat <= north)
+            return np.flatnonzero(mask).tolist()
+        return [
+            i for i, (lon, lat) in enumerate(zip(self.longitudes, self.latitudes))
+            if west <= lon <= east and south <= lat <= north
+        ]
+
+    def within(self, bounding_box: BoundingBox) -> list[Vehicle]:
+        rows = self.rows
+        return [rows[i] for i in self.select(bounding_box)]
@@ -12,14 +12,73 @@ DEFAULT_INITIAL_ZOOM = 16
 # Server
 DEFAULT_HOST = "0.0.0.0"
 DEFAULT_PORT = 5000
+# "dev" (Flask's own server), "gunicorn" or "waitress"
+DEFAULT_SERVER = "dev"
+DEFAULT_SERVER_WORKERS = 1
+DEFAULT_SERVER_THREADS = 64
+DEFAULT_UPSTREAM_POOL_SIZE = 64
+# Consecutive BODS failures before requests stop going upstream, and the
+# first and longest wait before trying again.
+DEFAULT_UPSTREAM_FAILURE_THRESHOLD = 3
+DEFAULT_UPSTREAM_BACKOFF_SECONDS = 2
+DEFAULT_UPSTREAM_BACKOFF_MAX_SECONDS = 120
+# memory (per process) or redis (shared by every worker and node)
+DEFAULT_STATE_BACKEND = "memory"
 DEFAULT_REQUEST_TIMEOUT_SECONDS = 15
 DEFAULT_CACHE_TTL_SECONDS = 300
-DEFAULT_CACHE_MAX_ENTRIES = 500
-BBOX_CACHE_KEY_PRECISION = 2
+DEFAULT_CACHE_MAX_TILES = 500
+DEFAULT_CACHE_STALE_GRACE_SECONDS = 120
+DEFAULT_CACHE_MAX_TILES_PER_REQUEST = 256
+# Refresh-ahead: tiles served at least PREFETCH_MIN_HITS times are refetched
+# in the last PREFETCH_LEAD share of their TTL, using at most PREFETCH_BUDGET
+# of MAX_REQUESTS_PER_HOUR.
+DEFAULT_PREFETCH_BUDGET = 0.25
+DEFAULT_PREFETCH_LEAD = 0.25
+DEFAULT_PREFETCH_MIN_HITS = 3
+DEFAULT_RESPONSE_CACHE_MAX_ENTRIES = 256
+# Cluster bodies are cached apart, so panning zoomed-out maps can't push
+# /api/buses bodies out of the main response cache.
+DEFAULT_CLUSTER_RESPONSE_CACHE_MAX_ENTRIES = 64
+# Likewise for aircraft bodies, which are per client viewport.
+DEFAULT_AIRCRAFT_RESPONSE_CACHE_MAX_ENTRIES = 64
+DEFAULT_REGISTRY_MAX_AGE_SECONDS = 600
+DEFAULT_DELTA_LOG_MAX_ENTRIES = 100000
+
+# Server-Sent Events
+# Each open stream holds a server thread, so at most THREADS less
+# STREAM_THREAD_HEADROOM are handed to streams whatever STREAM_MAX_CLIENTS says.
+DEFAULT_STREAM_MAX_CLIENTS = 48
+STREAM_THREAD_HEADROOM = 16
+DEFAULT_STREAM_MAX_SECONDS = 900
+
+# Region Poller
+# west, south, east, north
+UK_BOUNDING_BOX = (-8.65, 49.8, 1.77, 60.9)
+DEFAULT_POLL_REGION = ""
+DEFAULT_POLL_INTERVAL_SECONDS = 15
+
+# Warm restart
+DEFAULT_SNAPSHOT_PATH = ""
+DEFAULT_SNAPSHOT_INTERVAL_SECONDS = 30
+
+# Position history
+DEFAULT_HISTORY_PATH = ""
+DEFAULT_HISTORY_PARTITION_SECONDS = 3600
+DEFAULT_HISTORY_RETENTION_SECONDS = 7 * 24 * 3600
+DEFAULT_HISTORY_MAX_QUERY_SECONDS = 6 * 3600
 
 # OSRM
 DEFAULT_OSRM_URL = ""
 DEFAULT_ROUTING_ZOOM_THRESHOLD = 17
+# 4 decimal places is ~11 m, inside GPS jitter at a stop
+DEFAULT_ROUTE_CACHE_PRECISION = 4
+DEFAULT_ROUTE_CACHE_TTL_SECONDS = 3600
+DEFAULT_ROUTE_CACHE_MAX_ENTRIES = 20000
+DEFAULT_ROUTE_BATCH_MAX_LEGS = 200
+DEFAULT_ROUTE_CONCURRENCY = 8
+# Longest a /api/routes request waits for its legs; the rest come back as
+# errors and are cached for the next request once they land.
+DEFAULT_ROUTE_BATCH_TIMEOUT_SECONDS = 10
 
 # Client
 DEFAULT_REFRESH_INTERVAL_MS = 30000
@@ -31,9 +90,19 @@ DEFAULT_TILE_SIZE_DEGREES = 0.1
 # Clustering
 DEFAULT_CLUSTER_RADIUS = 40
 DEFAULT_CLUSTER_DISABLE_ZOOM = 17
+# Server-side grid clusters for views too wide to fetch vehicles for
+DEFAULT_CLUSTER_INDEX_MIN_ZOOM = 5
+DEFAULT_CLUSTER_INDEX_MAX_ZOOM = 13
 
 # Rate Limiting & CAPTCHA
 DEFAULT_MAX_REQUESTS_PER_HOUR = 300
+# Per-client (IP) and per-session quotas on the vehicle endpoints; 0 disables.
+# The per-IP one is off by default: behind a proxy every client shares its IP
+# until TRUSTED_PROXIES is set.
+DEFAULT_CLIENT_MAX_REQUESTS_PER_MINUTE = 0
+DEFAULT_SESSION_MAX_REQUESTS_PER_MINUTE = 120
+# Reverse proxies in front of the app whose X-Forwarded-For can be trusted
+DEFAULT_TRUSTED_PROXIES = 0
 DEFAULT_CAP_CHALLENGE_INTERVAL = 5000
 DEFAULT_CAP_FRONTEND_INTERVAL_MS = 600000
 
@@ -41,6 +110,8 @@ DEFAULT_CAP_FRONTEND_INTERVAL_MS = 600000
 DEFAULT_AIRCRAFT_URL = ""
 DEFAULT_AIRCRAFT_ROUTE_URL= ""
 DEFAULT_AIRCRAFT_REFRESH_MS = 5000
+DEFAULT_AIRCRAFT_ROUTE_TTL_SECONDS = 3600
+DEFAULT_AIRCRAFT_ROUTE_CACHE_MAX_ENTRIES = 5000
 
 def _env_int(key: str, default: int) -> int:
     val = os.environ.get(key)
@@ -52,6 +123,16 @@ def _env_float(key: str, default: float) -> float:
     return float(val) if val else default
 
 
+def _env_bbox(key: str, default: str) -> tuple[float, float, float, float] | None:
+    val = os.environ.get(key, default).strip()
+    if not val:
+        return None
+    if val.lower() == "uk":
+        return UK_BOUNDING_BOX
+    west, south, east, north = (float(x) for x in val.split(","))
+    return (west, south, east, north)
+
+
 @dataclass
 class Config:
     # Map Display
@@ -72,6 +153,33 @@ class Config:
     port: int = field(
         default_factory=lambda: _env_int("PORT", DEFAULT_PORT)
     )
+    server: str = field(
+        default_factory=lambda: os.environ.get("SERVER", DEFAULT_SERVER).lower()
+    )
+    server_workers: int = field(
+        default_factory=lambda: _env_int("WORKERS", DEFAULT_SERVER_WORKERS)
+    )
+    server_threads: int = field(
+        default_factory=lambda: _env_int("THREADS", DEFAULT_SERVER_THREADS)
+    )
+    upstream_pool_size: int = field(
+        default_factory=lambda: _env_int("UPSTREAM_POOL_SIZE", DEFAULT_UPSTREAM_POOL_SIZE)
+    )
+    upstream_failure_threshold: int = field(
+        default_factory=lambda: _env_int("UPSTREAM_FAILURE_THRESHOLD", DEFAULT_UPSTREAM_FAILURE_THRESHOLD)
+    )
+    upstream_backoff_seconds: float = field(
+        default_factory=lambda: _env_float("UPSTREAM_BACKOFF", DEFAULT_UPSTREAM_BACKOFF_SECONDS)
+    )
+    upstream_backoff_max_seconds: float = field(
+        default_factory=lambda: _env_float("UPSTREAM_BACKOFF_MAX", DEFAULT_UPSTREAM_BACKOFF_MAX_SECONDS)
+    )
+    state_backend: str = field(
+        default_factory=lambda: os.environ.get("STATE_BACKEND", DEFAULT_STATE_BACKEND).lower()
+    )
+    redis_url: str = field(
+        default_factory=lambda: os.environ.get("REDIS_URL", "")
+    )
     api_base: str = field(
         default_factory=lambda: os.environ.get(
             "BUS_API_BASE", "https://data.bus-data.dft.gov.uk/api/v1"
@@ -83,8 +191,88 @@ class Config:
     cache_ttl_seconds: int = field(
         default_factory=lambda: _env_int("CACHE_TTL", DEFAULT_CACHE_TTL_SECONDS)
     )
-    cache_max_entries: int = field(
-        default_factory=lambda: _env_int("CACHE_MAX", DEFAULT_CACHE_MAX_ENTRIES)
+    # Counts tiles, not viewports
+    cache_max_tiles: int = field(
+        default_factory=lambda: _env_int("CACHE_MAX_TILES", DEFAULT_CACHE_MAX_TILES)
+    )
+    cache_max_tiles_per_request: int = field(
+        default_factory=lambda: _env_int("CACHE_MAX_TILES_PER_REQUEST", DEFAULT_CACHE_MAX_TILES_PER_REQUEST)
+    )
+    cache_stale_grace_seconds: int = field(
+        default_factory=lambda: _env_int("CACHE_STALE_GRACE", DEFAULT_CACHE_STALE_GRACE_SECONDS)
+    )
+    prefetch_budget: float = field(
+        default_factory=lambda: _env_float("PREFETCH_BUDGET", DEFAULT_PREFETCH_BUDGET)
+    )
+    prefetch_lead: float = field(
+        default_factory=lambda: _env_float("PREFETCH_LEAD", DEFAULT_PREFETCH_LEAD)
+    )
+    prefetch_min_hits: int = field(
+        default_factory=lambda: _env_int("PREFETCH_MIN_HITS", DEFAULT_PREFETCH_MIN_HITS)
+    )
+    response_cache_max_entries: int = field(
+        default_factory=lambda: _env_int("RESPONSE_CACHE_MAX", DEFAULT_RESPONSE_CACHE_MAX_ENTRIES)
+    )
+    cluster_response_cache_max_entries: int = field(
+        default_factory=lambda: _env_int("CLUSTER_RESPONSE_CACHE_MAX", DEFAULT_CLUSTER_RESPONSE_CACHE_MAX_ENTRIES)
+    )
+    aircraft_response_cache_max_entries: int = field(
+        default_factory=lambda: _env_int("AIRCRAFT_RESPONSE_CACHE_MAX", DEFAULT_AIRCRAFT_RESPONSE_CACHE_MAX_ENTRIES)
+    )
+    registry_max_age_seconds: int = field(
+        default_factory=lambda: _env_int("REGISTRY_MAX_AGE", DEFAULT_REGISTRY_MAX_AGE_SECONDS)
+    )
+    delta_log_max_entries: int = field(
+        default_factory=lambda: _env_int("DELTA_LOG_MAX", DEFAULT_DELTA_LOG_MAX_ENTRIES)
+    )
+
+    # Region Poller
+    poll_region: tuple[float, float, float, float] | None = field(
+        default_factory=lambda: _env_bbox("POLL_REGION", DEFAULT_POLL_REGION)
+    )
+    poll_interval_seconds: int = field(
+        default_factory=lambda: _env_int("POLL_INTERVAL", DEFAULT_POLL_INTERVAL_SECONDS)
+    )
+
+    # Warm restart
+    snapshot_path: str = field(
+        default_factory=lambda: os.environ.get("SNAPSHOT_PATH", DEFAULT_SNAPSHOT_PATH)
+    )
+    snapshot_interval_seconds: int = field(
+        default_factory=lambda: _env_int("SNAPSHOT_INTERVAL", DEFAULT_SNAPSHOT_INTERVAL_SECONDS)
+    )
+
+    # Position history
+    history_path: str = field(
+        default_factory=lambda: os.environ.get("HISTORY_PATH", DEFAULT_HISTORY_PATH)
+    )
+    history_partition_seconds: int = field(
+        default_factory=lambda: _env_int("HISTORY_PARTITION", DEFAULT_HISTORY_PARTITION_SECONDS)
+    )
+    history_retention_seconds: int = field(
+        default_factory=lambda: _env_int("HISTORY_RETENTION", DEFAULT_HISTORY_RETENTION_SECONDS)
+    )
+    history_max_query_seconds: int = field(
+        default_factory=lambda: _env_int("HISTORY_MAX_QUERY", DEFAULT_HISTORY_MAX_QUERY_SECONDS)
+    )
+
+    # Prometheus text format at /metrics, optionally behind a bearer token
+    metrics_enabled: bool = field(
+        default_factory=lambda: os.environ.get("METRICS_ENABLED", "").lower() in ("1", "true")
+    )
+    metrics_token: str = field(
+        default_factory=lambda: os.environ.get("METRICS_TOKEN", "")
+    )
+
+    # Server-Sent Events
+    stream_enabled: bool = field(
+        default_factory=lambda: os.environ.get("STREAM_ENABLED", "true").lower() in ("1", "true")
+    )
+    stream_max_clients: int = field(
+        default_factory=lambda: _env_int("STREAM_MAX_CLIENTS", DEFAULT_STREAM_MAX_CLIENTS)
+    )
+    stream_max_seconds: int = field(
+        default_factory=lambda: _env_int("STREAM_MAX_SECONDS", DEFAULT_STREAM_MAX_SECONDS)
     )
 
     # OSRM
@@ -94,6 +282,24 @@ class Config:
     routing_zoom_threshold: int = field(
         default_factory=lambda: _env_int("ROUTING_ZOOM_THRESHOLD", DEFAULT_ROUTING_ZOOM_THRESHOLD)
     )
+    route_cache_precision: int = field(
+        default_factory=lambda: _env_int("ROUTE_CACHE_PRECISION", DEFAULT_ROUTE_CACHE_PRECISION)
+    )
+    route_cache_ttl_seconds: int = field(
+        default_factory=lambda: _env_int("ROUTE_CACHE_TTL", DEFAULT_ROUTE_CACHE_TTL_SECONDS)
+    )
+    route_cache_max_entries: int = field(
+        default_factory=lambda: _env_int("ROUTE_CACHE_MAX", DEFAULT_ROUTE_CACHE_MAX_ENTRIES)
+    )
+    route_batch_max_legs: int = field(
+        default_factory=lambda: _env_int("ROUTE_BATCH_MAX_LEGS", DEFAULT_ROUTE_BATCH_MAX_LEGS)
+    )
+    route_concurrency: int = field(
+        default_factory=lambda: _env_int("ROUTE_CONCURRENCY", DEFAULT_ROUTE_CONCURRENCY)
+    )
+    route_batch_timeout_seconds: float = field(
+        default_factory=lambda: _env_float("ROUTE_BATCH_TIMEOUT", DEFAULT_ROUTE_BATCH_TIMEOUT_SECONDS)
+    )
 
     # Client
     refresh_interval_ms: int = field(
@@ -122,11 +328,26 @@ class Config:
     cluster_disable_at_zoom: int = field(
         default_factory=lambda: _env_int("CLUSTER_DISABLE_ZOOM", DEFAULT_CLUSTER_DISABLE_ZOOM)
     )
+    cluster_index_min_zoom: int = field(
+        default_factory=lambda: _env_int("CLUSTER_INDEX_MIN_ZOOM", DEFAULT_CLUSTER_INDEX_MIN_ZOOM)
+    )
+    cluster_index_max_zoom: int = field(
+        default_factory=lambda: _env_int("CLUSTER_INDEX_MAX_ZOOM", DEFAULT_CLUSTER_INDEX_MAX_ZOOM)
+    )
 
     # Rate Limiting & CAPTCHA
     max_requests_per_hour: int = field(
         default_factory=lambda: _env_int("MAX_REQUESTS_PER_HOUR", DEFAULT_MAX_REQUESTS_PER_HOUR)
     )
+    client_max_requests_per_minute: int = field(
+        default_factory=lambda: _env_int("CLIENT_MAX_REQUESTS_PER_MINUTE", DEFAULT_CLIENT_MAX_REQUESTS_PER_MINUTE)
+    )
+    session_max_requests_per_minute: int = field(
+        default_factory=lambda: _env_int("SESSION_MAX_REQUESTS_PER_MINUTE", DEFAULT_SESSION_MAX_REQUESTS_PER_MINUTE)
+    )
+    trusted_proxies: int = field(
+        default_factory=lambda: _env_int("TRUSTED_PROXIES", DEFAULT_TRUSTED_PROXIES)
+    )
     cap_url: str = field(
         default_factory=lambda: os.environ.get("CAP_URL", "")
     )
@@ -156,3 +377,9 @@ class Config:
     aircraft_refresh_ms: int = field(
         default_factory=lambda: _env_int("AIRCRAFT_REFRESH_MS", DEFAULT_AIRCRAFT_REFRESH_MS)
     )
+    aircraft_route_ttl_seconds: int = field(
+        default_factory=lambda: _env_int("AIRCRAFT_ROUTE_TTL", DEFAULT_AIRCRAFT_ROUTE_TTL_SECONDS)
+    )
+    aircraft_route_cache_max_entries: int = field(
+        default_factory=lambda: _env_int("AIRCRAFT_ROUTE_CACHE_MAX", DEFAULT_AIRCRAFT_ROUTE_CACHE_MAX_ENTRIES)
+    )
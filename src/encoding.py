@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Hashable, Iterable
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from .metrics import CACHE_EVICTIONS, CACHE_LOOKUPS, ENCODE_SECONDS
+
+if TYPE_CHECKING:
+    from .models import Vehicle
+
+# Below this, compression costs more than it saves on the wire.
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+# Each content coding is its own representation, so its own ETag (RFC 9110).
+ETAG_SUFFIXES = {"br": "-br", "gzip": "-gz"}
+
+# Opt-in compact vehicle lists, chosen by the Accept header.
+COLUMNS_MIMETYPE = "application/vnd.busmap.columns+json"
+# Fixed-point coordinates in millionths of a degree, SIRI's own precision.
+COORDINATE_SCALE = 1_000_000
+
+
+@dataclass(frozen=True)
+class EncodedBody:
+    body: bytes
+    etag: str
+    mimetype: str = "application/json"
+    gzip: bytes | None = None
+    br: bytes | None = None
+
+    def select(self, accept_encodings) -> tuple[bytes, str | None]:
+        # accept_encodings is werkzeug's MIMEAccept-style quality list.
+        if self.br is not None and accept_encodings["br"]:
+            return self.br, "br"
+        if self.gzip is not None and accept_encodings["gzip"]:
+            return self.gzip, "gzip"
+        return self.body, None
+
+    def etag_for(self, content_encoding: str | None) -> str:
+        return self.etag + ETAG_SUFFIXES.get(content_encoding, "")
+
+
+def encode_body(body: bytes, mimetype: str = "application/json") -> EncodedBody:
+    etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return EncodedBody(body, etag, mimetype)
+    return EncodedBody(
+        body,
+        etag,
+        mimetype,
+        gzip=gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0),
+        br=brotli.compress(body, quality=BROTLI_QUALITY) if brotli else None,
+    )
+
+
+def encode_json(payload: object, mimetype: str = "application/json") -> EncodedBody:
+    return encode_body(json.dumps(payload, separators=(",", ":")).encode("utf-8"), mimetype)
+
+
+def vehicle_columns(vehicles: Iterable[Vehicle]) -> dict:
+    # One array per field instead of an object per vehicle. Line, operator
+    # and destination are indexes into `strings`; coordinates are integer
+    # deltas from the previous vehicle, sorted by longitude so those stay
+    # short; times are whole seconds from `time_base`.
+    rows = sorted(vehicles, key=lambda v: v.longitude)
+    strings: dict[str, int] = {}
+
+    def index(value: str) -> int:
+        i = strings.get(value)
+        if i is None:
+            i = strings[value] = len(strings)
+        return i
+
+    base = int(min((v.timestamp.timestamp() for v in rows), default=0))
+    lats, lons = [], []
+    last_lat = last_lon = 0
+    for v in rows:
+        lat = round(v.latitude * COORDINATE_SCALE)
+        lon = round(v.longitude * COORDINATE_SCALE)
+        lats.append(lat - last_lat)
+        lons.append(lon - last_lon)
+        last_lat, last_lon = lat, lon
+
+    return {
+        "count": len(rows),
+        "scale": COORDINATE_SCALE,
+        "time_base": base,
+        "vehicle_id": [v.vehicle_id for v in rows],
+        "latitude": lats,
+        "longitude": lons,
+        "line": [index(v.line) for v in rows],
+        "operator": [index(v.operator) for v in rows],
+        "destination": [index(v.destination) for v in rows],
+        "timestamp": [round(v.timestamp.timestamp()) - base for v in rows],
+        "recorded_at": [round(v.recorded_at.timestamp()) - base if v.recorded_at else None for v in rows],
+        # Decimetres per second.
+        "speed": [round(v.speed * 10) if v.speed is not None else None for v in rows],
+        "heading": [round(v.heading) if v.heading is not None else None for v in rows],
+        "strings": list(strings),
+    }
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, name: str = "responses"):
+        # `name` labels this cache's metrics.
+        self.max_entries = max_entries
+        self.name = name
+        self._entries: OrderedDict[Hashable, EncodedBody] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_encode(self, key: Hashable | None, build: Callable[[], EncodedBody]) -> EncodedBody:
+        if key is None:
+            with ENCODE_SECONDS.time():
+                return build()
+
+        with self._lock:
+            encoded = self._entries.get(key)
+            if encoded is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc(self.name, "hit")
+                return encoded
+            self.misses += 1
+        CACHE_LOOKUPS.inc(self.name, "miss")
+
+        # Encoding happens outside the lock; two threads racing on the same
+        # key produce identical bytes, so the second store is harmless.
+        with ENCODE_SECONDS.time():
+            encoded = build()
+        with self._lock:
+            self._entries[key] = encoded
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                CACHE_EVICTIONS.inc(self.name)
+        return encoded
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "response_cache_entries": len(self._entries),
+                "response_cache_hits": self.hits,
+                "response_cache_misses": self.misses,
+            }
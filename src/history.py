@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import struct
+from collections import deque
+from datetime import datetime, timezone
+from typing import Iterator
+
+from .models import Vehicle
+from .poller import Poller
+from .tiles import BoundingBox
+
+logger = logging.getLogger(__name__)
+
+# Each partition covers `partition_seconds` and is, per writing process,
+# three append-only files:
+#   <start>-<pid>.rows  fixed-size position rows, in arrival order
+#   <start>-<pid>.idx   one zone-map entry (time range and bbox) per BLOCK_ROWS rows
+#   <start>-<pid>.str   that writer's string table, one JSON string per line
+# Under several workers each keeps its own string indices, so they must
+# never share files.
+# A query opens only partitions overlapping its time window and reads only
+# the blocks whose zone map overlaps both its window and its bbox. Positions
+# arrive a tile at a time, so blocks stay spatially tight.
+_ROW = struct.Struct("<dffIIII")  # recorded_at, lat, lon, vehicle_id, line, operator, destination
+_BLOCK = struct.Struct("<ddffff")  # first, last, south, west, north, east
+BLOCK_ROWS = 1024
+# Positions waiting for the writer; beyond this the oldest are dropped rather
+# than letting a stalled disk grow memory without bound.
+MAX_PENDING = 1_000_000
+
+
+class _PartitionWriter:
+    def __init__(self, directory: str, start: int):
+        base = os.path.join(directory, f"{start}-{os.getpid()}")
+        self.strings: dict[str, int] = {}
+        if os.path.exists(f"{base}.str"):
+            with open(f"{base}.str", "rb+") as f:
+                data = f.read()
+                # A torn last line from a crash was never used by a row.
+                complete = data.rfind(b"\n") + 1
+                if complete < len(data):
+                    f.truncate(complete)
+            for line in data[:complete].decode("utf-8").splitlines():
+                self.strings[json.loads(line)] = len(self.strings)
+
+        self._str = open(f"{base}.str", "a", encoding="utf-8")
+        self._rows = open(f"{base}.rows", "ab")
+        self._idx = open(f"{base}.idx", "ab")
+
+        # Drop a torn trailing row or index entry left by a crash.
+        self.count = self._rows.tell() // _ROW.size
+        self._rows.truncate(self.count * _ROW.size)
+        blocks = min(self._idx.tell() // _BLOCK.size, self.count // BLOCK_ROWS)
+        self._idx.truncate(blocks * _BLOCK.size)
+
+        self._block: list[tuple] = []
+        if self.count > blocks * BLOCK_ROWS:
+            with open(f"{base}.rows", "rb") as f:
+                f.seek(blocks * BLOCK_ROWS * _ROW.size)
+                self._block = list(_ROW.iter_unpack(f.read()))
+
+    def append(self, vehicles: list[Vehicle]) -> None:
+        rows = bytearray()
+        for v in vehicles:
+            row = (
+                (v.recorded_at or v.timestamp).timestamp(), v.latitude, v.longitude,
+                self._intern(v.vehicle_id), self._intern(v.line),
+                self._intern(v.operator), self._intern(v.destination),
+            )
+            rows += _ROW.pack(*row)
+            self._block.append(row)
+            if len(self._block) == BLOCK_ROWS:
+                self._idx.write(_zone(self._block))
+                self._block = []
+        self.count += len(vehicles)
+
+        # Strings before rows before index: a reader that sees a row can
+        # always resolve its strings.
+        self._str.flush()
+        self._rows.write(rows)
+        self._rows.flush()
+        self._idx.flush()
+
+    def close(self) -> None:
+        for f in (self._str, self._rows, self._idx):
+            f.close()
+
+    def _intern(self, value: str) -> int:
+        i = self.strings.get(value)
+        if i is None:
+            i = self.strings[value] = len(self.strings)
+            self._str.write(json.dumps(value) + "\n")
+        return i
+
+
+def _zone(rows: list[tuple]) -> bytes:
+    times = [r[0] for r in rows]
+    lats = [r[1] for r in rows]
+    lons = [r[2] for r in rows]
+    return _BLOCK.pack(min(times), max(times), min(lats), min(lons), max(lats), max(lons))
+
+
+class HistoryStore(Poller):
+    # Registry listener: every position change is queued here and written
+    # by the background thread, so ingest only pays for a deque append.
+    def __init__(self, directory: str, partition_seconds: int, retention_seconds: int, flush_seconds: float = 5):
+        super().__init__("history-writer", flush_seconds)
+        self.directory = directory
+        self.partition_seconds = partition_seconds
+        self.retention_seconds = retention_seconds
+        self._pending: deque[Vehicle] = deque(maxlen=MAX_PENDING)
+        self._writers: dict[int, _PartitionWriter] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def on_upsert(self, old: Vehicle | None, new: Vehicle) -> None:
+        if old is None or old.latitude != new.latitude or old.longitude != new.longitude:
+            self._pending.append(new)
+
+    def on_remove(self, old: Vehicle) -> None:
+        pass
+
+    def stop(self, timeout: float | None = None) -> None:
+        super().stop(timeout)
+        self.poll_once()
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+
+    def poll_once(self) -> None:
+        batch: dict[int, list[Vehicle]] = {}
+        pending = self._pending
+        while pending:
+            v = pending.popleft()
+            batch.setdefault(self._partition_of((v.recorded_at or v.timestamp).timestamp()), []).append(v)
+
+        for start, vehicles in sorted(batch.items()):
+            writer = self._writers.get(start)
+            if writer is None:
+                writer = self._writers[start] = _PartitionWriter(self.directory, start)
+            writer.append(vehicles)
+
+        self._expire()
+
+    def query(
+        self,
+        bounding_box: BoundingBox,
+        start: float,
+        end: float,
+        vehicle_id: str | None = None,
+        line: str | None = None,
+    ) -> Iterator[dict]:
+        west, south, east, north = bounding_box
+        for partition, name in self._files():
+            if partition + self.partition_seconds <= start or partition > end:
+                continue
+            base = os.path.join(self.directory, name)
+            try:
+                yield from self._query_partition(base, west, south, east, north, start, end, vehicle_id, line)
+            except FileNotFoundError:
+                # Expired while we were reading.
+                continue
+
+    def _query_partition(self, base, west, south, east, north, start, end, vehicle_id, line) -> Iterator[dict]:
+        with open(f"{base}.idx", "rb") as f:
+            zones = list(_BLOCK.iter_unpack(f.read()))
+        with open(f"{base}.rows", "rb") as rows:
+            count = os.fstat(rows.fileno()).st_size // _ROW.size
+            # Read after the rows were sized, so every string they use is present.
+            # A line still being written has no newline yet; no row uses it.
+            with open(f"{base}.str", encoding="utf-8") as f:
+                strings = [json.loads(s) for s in f if s.endswith("\n")]
+
+            # Restrict to one vehicle or line by string index, not by text.
+            index = {s: i for i, s in enumerate(strings)}
+            want_vehicle = index.get(vehicle_id, -1) if vehicle_id else None
+            want_line = index.get(line, -1) if line else None
+            if want_vehicle == -1 or want_line == -1:
+                return
+
+            zones = zones[:count // BLOCK_ROWS]
+            ranges = [
+                (b * BLOCK_ROWS, (b + 1) * BLOCK_ROWS)
+                for b, (first, last, s, w, n, e) in enumerate(zones)
+                if first <= end and last >= start and s <= north and n >= south and w <= east and e >= west
+            ]
+            # The tail block has no zone map yet; it is always scanned.
+            tail = len(zones) * BLOCK_ROWS
+            if tail < count:
+                ranges.append((tail, count))
+
+            for lo, hi in ranges:
+                rows.seek(lo * _ROW.size)
+                for t, lat, lon, vid, ln, op, dest in _ROW.iter_unpack(rows.read((hi - lo) * _ROW.size)):
+                    if not (start <= t <= end and south <= lat <= north and west <= lon <= east):
+                        continue
+                    if want_vehicle is not None and vid != want_vehicle:
+                        continue
+                    if want_line is not None and ln != want_line:
+                        continue
+                    yield {
+                        "vehicle_id": strings[vid],
+                        "latitude": round(lat, 6),
+                        "longitude": round(lon, 6),
+                        "line": strings[ln],
+                        "operator": strings[op],
+                        "destination": strings[dest],
+                        "timestamp": datetime.fromtimestamp(t, timezone.utc).isoformat(),
+                    }
+
+    def _partition_of(self, ts: float) -> int:
+        return int(ts // self.partition_seconds) * self.partition_seconds
+
+    def _files(self) -> list[tuple[int, str]]:
+        # (partition start, file name without extension) for every writer's files.
+        files = []
+        for name in os.listdir(self.directory):
+            stem = name[:-5]
+            start, _, writer = stem.partition("-")
+            if name.endswith(".rows") and start.isdigit() and writer.isdigit():
+                files.append((int(start), stem))
+        return sorted(files)
+
+    def _expire(self) -> None:
+        cutoff = datetime.now(timezone.utc).timestamp() - self.retention_seconds
+        current = self._partition_of(datetime.now(timezone.utc).timestamp())
+        for partition, name in self._files():
+            if partition + self.partition_seconds > cutoff:
+                break
+            writer = self._writers.pop(partition, None)
+            if writer is not None:
+                writer.close()
+            for ext in (".rows", ".idx", ".str"):
+                try:
+                    os.remove(os.path.join(self.directory, f"{name}{ext}"))
+                except FileNotFoundError:
+                    pass
+        # Late positions for the previous partition can still arrive; older
+        # writers are done and can let go of their files.
+        for partition in [p for p in self._writers if p < current - self.partition_seconds]:
+            self._writers.pop(partition).close()
@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import threading
+from collections import Counter
+from typing import Callable
+
+from .models import Vehicle
+from .tiles import BoundingBox, contains
+
+# Fields /api/buses can be filtered on. Values match case-insensitively.
+FILTER_FIELDS = ("line", "operator", "destination")
+
+Filters = dict[str, list[str]]
+
+
+class _Line:
+    __slots__ = ("count", "operators", "destinations")
+
+    def __init__(self):
+        self.count = 0
+        self.operators: Counter[str] = Counter()
+        self.destinations: Counter[str] = Counter()
+
+    def to_dict(self, line: str) -> dict:
+        return {
+            "line": line,
+            "vehicles": self.count,
+            "operators": sorted(self.operators),
+            "destinations": sorted(self.destinations),
+        }
+
+
+def _key(value: str) -> str:
+    return value.strip().casefold()
+
+
+def matcher(filters: Filters) -> Callable[[Vehicle], bool]:
+    # Any of the values given for a field, and every field given.
+    wanted = [(field, {_key(value) for value in values}) for field, values in filters.items()]
+    return lambda v: all(_key(getattr(v, field)) in keys for field, keys in wanted)
+
+
+class LineIndex:
+    # Inverted indexes from line, operator and destination to the vehicles
+    # currently carrying them, kept up to date as the registry changes so a
+    # filtered query touches only the vehicles it returns.
+    def __init__(self):
+        self._vehicles: dict[str, Vehicle] = {}
+        self._postings: dict[str, dict[str, set[str]]] = {field: {} for field in FILTER_FIELDS}
+        self._lines: dict[str, _Line] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._lines)
+
+    def on_upsert(self, old: Vehicle | None, new: Vehicle) -> None:
+        with self._lock:
+            if old is not None:
+                self._apply(old, -1)
+            self._apply(new, 1)
+            self._vehicles[new.vehicle_id] = new
+
+    def on_remove(self, old: Vehicle) -> None:
+        with self._lock:
+            self._apply(old, -1)
+            self._vehicles.pop(old.vehicle_id, None)
+
+    def find(self, filters: Filters, bounding_box: BoundingBox | None = None) -> list[Vehicle]:
+        with self._lock:
+            matched: set[str] | None = None
+            # Smallest field first, so the intersections only shrink it.
+            for ids in sorted((self._union(field, values) for field, values in filters.items()), key=len):
+                matched = ids if matched is None else matched & ids
+                if not matched:
+                    return []
+            if matched is None:
+                return []
+            vehicles = [self._vehicles[vehicle_id] for vehicle_id in matched]
+        if bounding_box is None:
+            return vehicles
+        return [v for v in vehicles if contains(bounding_box, v.longitude, v.latitude)]
+
+    def lines(self, operator: str | None = None) -> list[dict]:
+        with self._lock:
+            found = [
+                line.to_dict(name)
+                for name, line in self._lines.items()
+                if operator is None or any(_key(op) == _key(operator) for op in line.operators)
+            ]
+        return sorted(found, key=lambda line: (len(line["line"]), line["line"]))
+
+    def _union(self, field: str, values: list[str]) -> set[str]:
+        postings = self._postings[field]
+        ids: set[str] = set()
+        for value in values:
+            ids |= postings.get(_key(value), set())
+        return ids
+
+    def _apply(self, v: Vehicle, sign: int) -> None:
+        for field, postings in self._postings.items():
+            key = _key(getattr(v, field))
+            if sign > 0:
+                postings.setdefault(key, set()).add(v.vehicle_id)
+                continue
+            ids = postings.get(key)
+            if ids is not None:
+                ids.discard(v.vehicle_id)
+                if not ids:
+                    del postings[key]
+
+        line = self._lines.get(v.line)
+        if line is None:
+            if sign < 0:
+                return
+            line = self._lines[v.line] = _Line()
+        line.count += sign
+        if line.count <= 0:
+            del self._lines[v.line]
+            return
+        line.operators[v.operator] += sign
+        line.destinations[v.destination] += sign
+        if line.operators[v.operator] <= 0:
+            del line.operators[v.operator]
+        if line.destinations[v.destination] <= 0:
+            del line.destinations[v.destination]
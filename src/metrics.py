@@ -0,0 +1,173 @@
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+# Prometheus text exposition without the client library: counters and
+# histograms keyed by label values, each behind its own lock. Values are
+# per process, so under several workers each scrape sees one worker.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics: list[_Metric] = []
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self._values: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted((key, self._snapshot(value)) for key, value in self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(dict(zip(self.labels, key)), value))
+        return lines
+
+    def _snapshot(self, value):
+        return value
+
+    def _samples(self, labels: dict[str, str], value) -> list[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def _samples(self, labels: dict[str, str], value) -> list[str]:
+        return [f"{self.name}{_labels(labels)} {_number(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        description: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str) -> None:
+        # Counts per bucket, not cumulative; summed up when rendered.
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                counts = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[i] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def _snapshot(self, value):
+        return list(value)
+
+    def _samples(self, labels: dict[str, str], value) -> list[str]:
+        lines = []
+        total = 0
+        for bound, count in zip((*self.buckets, "+Inf"), value[:-1]):
+            total += count
+            le = bound if bound == "+Inf" else _number(bound)
+            lines.append(f"{self.name}_bucket{_labels({**labels, 'le': le})} {total}")
+        lines.append(f"{self.name}_sum{_labels(labels)} {_number(value[-1])}")
+        lines.append(f"{self.name}_count{_labels(labels)} {total}")
+        return lines
+
+
+def _labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def render() -> str:
+    return "\n".join(line for metric in _metrics for line in metric.render()) + "\n"
+
+
+# Upstreams are bods, osrm, aircraft, aircraft_routes and cap.
+UPSTREAM_SECONDS = Histogram(
+    "busmap_upstream_request_seconds",
+    "Upstream request latency, including reading the body.",
+    ("upstream",),
+)
+UPSTREAM_BYTES = Counter(
+    "busmap_upstream_received_bytes_total",
+    "Response body bytes received from upstreams.",
+    ("upstream",),
+)
+UPSTREAM_ERRORS = Counter(
+    "busmap_upstream_errors_total",
+    "Upstream requests that failed or timed out.",
+    ("upstream",),
+)
+PARSE_SECONDS = Histogram(
+    "busmap_siri_parse_seconds",
+    "Time parsing SIRI-VM bodies, excluding waiting on the network.",
+)
+ENCODE_SECONDS = Histogram(
+    "busmap_encode_seconds",
+    "Time serialising and compressing a response body.",
+)
+# Results are hit, miss, stale (served past TTL while a refresh runs) and
+# wait (joined a fetch already in flight).
+CACHE_LOOKUPS = Counter(
+    "busmap_cache_lookups_total",
+    "Cache lookups by cache and result.",
+    ("cache", "result"),
+)
+CACHE_EVICTIONS = Counter(
+    "busmap_cache_evictions_total",
+    "Entries evicted to stay within a cache's size limit.",
+    ("cache",),
+)
+# Results are refreshed, or over_budget when the prefetch share of the
+# upstream budget was used up.
+PREFETCHED_TILES = Counter(
+    "busmap_prefetched_tiles_total",
+    "Tiles in demand considered for refresh ahead of expiry, by result.",
+    ("result",),
+)
+RATE_LIMITED = Counter(
+    "busmap_rate_limit_rejections_total",
+    "Requests refused by a rate limiter.",
+    ("limiter",),
+)
+REQUEST_SECONDS = Histogram(
+    "busmap_http_request_seconds",
+    "Time to produce a response, by route. Streams count until the response starts.",
+    ("route", "method", "status"),
+)
@@ -2,9 +2,16 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from functools import cached_property
+from typing import TYPE_CHECKING, Hashable, Iterable
 
+from .tiles import BoundingBox, contains
 
-@dataclass(frozen=True)
+if TYPE_CHECKING:
+    from .columns import VehicleColumns
+
+
+@dataclass(frozen=True, slots=True)
 class Vehicle:
     vehicle_id: str
     latitude: float
@@ -13,6 +20,12 @@ class Vehicle:
     operator: str
     destination: str
     timestamp: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    # When the vehicle itself reported this position (SIRI RecordedAtTime).
+    recorded_at: datetime | None = None
+    # Metres per second and degrees clockwise from north, derived by the
+    # registry from recent positions; heading may come from SIRI Bearing.
+    speed: float | None = None
+    heading: float | None = None
 
     def to_dict(self) -> dict:
         return {
@@ -23,6 +36,9 @@ class Vehicle:
             "operator": self.operator,
             "destination": self.destination,
             "timestamp": self.timestamp.isoformat(),
+            "recorded_at": self.recorded_at.isoformat() if self.recorded_at else None,
+            "speed": round(self.speed, 1) if self.speed is not None else None,
+            "heading": round(self.heading) if self.heading is not None else None,
         }
 
 
@@ -30,7 +46,66 @@ class Vehicle:
 class CacheEntry:
     timestamp: datetime
     vehicles: list[Vehicle]
+    # Registry version the vehicles were ingested at.
+    version: int = 0
+    # Requests served from this entry, which decide whether it is worth
+    # refreshing before it expires.
+    hits: int = 0
 
     def is_fresh(self, ttl_seconds: int) -> bool:
         age = (datetime.now(timezone.utc) - self.timestamp).total_seconds()
         return age < ttl_seconds
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    timestamp: datetime
+    vehicles: VehicleColumns
+    version: int = 0
+
+    def age_seconds(self) -> float:
+        return (datetime.now(timezone.utc) - self.timestamp).total_seconds()
+
+
+@dataclass
+class VehicleView:
+    bounding_box: BoundingBox
+    # Identifies the data behind this view; equal keys mean equal vehicles.
+    # None when the view came from an uncached fetch.
+    key: Hashable | None
+    sources: list[Iterable[Vehicle]]
+    # Registry version no newer than any vehicle in the view, so deltas
+    # requested since it can never miss a change (at worst they repeat one).
+    version: int = 0
+    # When the oldest data in the view was fetched from upstream.
+    fetched_at: datetime | None = None
+
+    def age_seconds(self) -> float | None:
+        if self.fetched_at is None:
+            return None
+        return (datetime.now(timezone.utc) - self.fetched_at).total_seconds()
+
+    @cached_property
+    def vehicles(self) -> list[Vehicle]:
+        from .columns import VehicleColumns
+
+        if len(self.sources) == 1 and isinstance(self.sources[0], VehicleColumns):
+            return self.sources[0].within(self.bounding_box)
+        if len(self.sources) == 1:
+            return [
+                v for v in self.sources[0]
+                if contains(self.bounding_box, v.longitude, v.latitude)
+            ]
+
+        # A bus that crossed a tile boundary between fetches can sit in two
+        # sources; keep the most recent sighting.
+        latest: dict[str, Vehicle] = {}
+        for source in self.sources:
+            for v in source:
+                seen = latest.get(v.vehicle_id)
+                if seen is None or v.timestamp > seen.timestamp:
+                    latest[v.vehicle_id] = v
+        return [
+            v for v in latest.values()
+            if contains(self.bounding_box, v.longitude, v.latitude)
+        ]
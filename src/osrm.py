@@ -0,0 +1,151 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+import requests
+
+from .metrics import CACHE_EVICTIONS, CACHE_LOOKUPS, UPSTREAM_BYTES, UPSTREAM_ERRORS, UPSTREAM_SECONDS
+
+Point = tuple[float, float]
+RouteKey = tuple[Point, Point]
+
+
+def parse_point(value: str) -> Point:
+    lon, lat = (float(x) for x in value.split(","))
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise ValueError(f"Coordinate out of range: {value}")
+    return (lon, lat)
+
+
+class RouteCache:
+    # Legs between consecutive bus positions repeat constantly (same stops,
+    # same line), so routes are keyed on coordinates rounded to `precision`
+    # decimal places and OSRM is asked for the rounded points. That way a
+    # cached body is exactly what a fresh request would have returned.
+    def __init__(
+        self,
+        base_url: str,
+        session: requests.Session,
+        precision: int,
+        ttl_seconds: int,
+        max_entries: int,
+        concurrency: int,
+        batch_timeout: float = 10,
+        timeout: int = 5,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.precision = precision
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.batch_timeout = batch_timeout
+        self.timeout = timeout
+        self._session = session
+        self._entries: OrderedDict[RouteKey, tuple[float, dict]] = OrderedDict()
+        # One fetch per leg however many requests want it at once.
+        self._inflight: dict[RouteKey, Future] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="osrm")
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, start: Point, end: Point) -> RouteKey:
+        p = self.precision
+        return (
+            (round(start[0], p), round(start[1], p)),
+            (round(end[0], p), round(end[1], p)),
+        )
+
+    def get_route(self, start: Point, end: Point) -> dict:
+        key = self.key(start, end)
+        route = self._lookup(key)
+        if route is None:
+            route = self._submit(key).result(self.batch_timeout)
+        return route
+
+    def get_routes(self, legs: list[tuple[Point, Point]]) -> list[dict]:
+        # Misses are fetched on the shared pool, so however many batches
+        # arrive at once, OSRM sees at most `concurrency` of their requests.
+        # The request waits at most `batch_timeout` for them; fetches still
+        # running carry on and land in the cache for next time.
+        keys = [self.key(start, end) for start, end in legs]
+        results: dict[RouteKey, dict] = {}
+        pending: dict[RouteKey, Future] = {}
+        for key in dict.fromkeys(keys):
+            route = self._lookup(key)
+            if route is not None:
+                results[key] = route
+            else:
+                pending[key] = self._submit(key)
+
+        done, _ = wait(pending.values(), self.batch_timeout)
+        for key, future in pending.items():
+            if future not in done:
+                results[key] = {"error": "Timed out"}
+                continue
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                results[key] = {"error": str(e)}
+        return [results[key] for key in keys]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "route_cache_entries": len(self._entries),
+                "route_cache_hits": self.hits,
+                "route_cache_misses": self.misses,
+            }
+
+    def _lookup(self, key: RouteKey) -> dict | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.inc("routes", "hit")
+                return entry[1]
+            self.misses += 1
+        CACHE_LOOKUPS.inc("routes", "miss")
+        return None
+
+    def _submit(self, key: RouteKey) -> Future:
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self._inflight[key] = self._pool.submit(self._fetch, key)
+        # Outside the lock: an already finished future calls back right here.
+        future.add_done_callback(lambda f: self._settle(key, f))
+        return future
+
+    def _settle(self, key: RouteKey, future: Future) -> None:
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def _fetch(self, key: RouteKey) -> dict:
+        (x0, y0), (x1, y1) = key
+        url = f"{self.base_url}/route/v1/driving/{x0},{y0};{x1},{y1}"
+        try:
+            with UPSTREAM_SECONDS.time("osrm"):
+                resp = self._session.get(url, params={"geometries": "geojson"}, timeout=self.timeout)
+            UPSTREAM_BYTES.inc("osrm", amount=len(resp.content))
+            route = resp.json()
+        except (requests.RequestException, ValueError):
+            UPSTREAM_ERRORS.inc("osrm")
+            raise
+
+        # Only definitive answers are worth keeping: "Ok" and "NoRoute" depend
+        # on the road graph alone, anything else may succeed on a retry.
+        if route.get("code") in ("Ok", "NoRoute"):
+            with self._lock:
+                self._entries[key] = (time.time(), route)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+                    CACHE_EVICTIONS.inc("routes")
+        return route
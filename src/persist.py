@@ -0,0 +1,205 @@
+from __future__ import annotations
+
+import logging
+import math
+import os
+import re
+import struct
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from .models import Vehicle
+from .poller import Poller
+from .tiles import BoundingBox, Tile
+
+if TYPE_CHECKING:
+    from .tracker import BusTracker
+
+logger = logging.getLogger(__name__)
+
+# Layout, all little-endian:
+#   header   magic, format, saved_at, tile_size, string/group/vehicle counts
+#   strings  length-prefixed UTF-8; vehicles refer to them by index
+#   groups   one per cached tile plus, when polling, one for the region
+#   vehicles fixed-size rows, each group's rows contiguous
+# Fixed-size rows mean a vehicle is a single unpack at a computed offset, so
+# groups too old to restore are skipped without decoding their rows.
+# Each worker writes its own <path>.<pid>, so several workers never
+# overwrite each other's caches; a restart merges them all.
+MAGIC = b"BUSSNAP\0"
+FORMAT = 2
+_HEADER = struct.Struct("<8sIddIII")
+_LENGTH = struct.Struct("<I")
+# kind, x, y, west, south, east, north, fetched_at, first row, row count
+_GROUP = struct.Struct("<BqqdddddII")
+# latitude, longitude, timestamp, recorded_at, speed, heading, vehicle_id,
+# line, operator, destination; NaN stands in for a missing optional value
+_VEHICLE = struct.Struct("<ddddddIIII")
+
+GROUP_TILE = 0
+GROUP_REGION = 1
+
+
+@dataclass
+class SavedGroup:
+    tile: Tile | None
+    area: BoundingBox | None
+    fetched_at: datetime
+    vehicles: list[Vehicle]
+
+
+def worker_path(path: str) -> str:
+    return f"{path}.{os.getpid()}"
+
+
+def snapshot_files(path: str) -> list[str]:
+    # Every worker's file for this SNAPSHOT_PATH, not their temporaries.
+    directory, name = os.path.split(os.path.abspath(path))
+    pattern = re.compile(re.escape(name) + r"\.\d+")
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(os.path.join(directory, n) for n in names if pattern.fullmatch(n))
+
+
+def write_snapshot(path: str, tile_size: float, groups: list[SavedGroup]) -> int:
+    strings: dict[str, int] = {}
+
+    def index(value: str) -> int:
+        i = strings.get(value)
+        if i is None:
+            i = strings[value] = len(strings)
+        return i
+
+    group_rows = bytearray()
+    vehicle_rows = bytearray()
+    count = 0
+    for group in groups:
+        kind = GROUP_TILE if group.tile is not None else GROUP_REGION
+        x, y = group.tile or (0, 0)
+        west, south, east, north = group.area or (0.0, 0.0, 0.0, 0.0)
+        group_rows += _GROUP.pack(
+            kind, x, y, west, south, east, north,
+            group.fetched_at.timestamp(), count, len(group.vehicles),
+        )
+        for v in group.vehicles:
+            vehicle_rows += _VEHICLE.pack(
+                v.latitude, v.longitude, v.timestamp.timestamp(),
+                v.recorded_at.timestamp() if v.recorded_at else math.nan,
+                v.speed if v.speed is not None else math.nan,
+                v.heading if v.heading is not None else math.nan,
+                index(v.vehicle_id), index(v.line), index(v.operator), index(v.destination),
+            )
+        count += len(group.vehicles)
+
+    string_rows = bytearray()
+    for value in strings:
+        encoded = value.encode()
+        string_rows += _LENGTH.pack(len(encoded)) + encoded
+
+    header = _HEADER.pack(
+        MAGIC, FORMAT, datetime.now(timezone.utc).timestamp(), tile_size,
+        len(strings), len(groups), count,
+    )
+
+    # Write beside the target and rename over it, so a crash mid-write
+    # never leaves a torn file for the next start to read.
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(header)
+        f.write(string_rows)
+        f.write(group_rows)
+        f.write(vehicle_rows)
+    os.replace(tmp, path)
+    return count
+
+
+def read_snapshot(path: str, tile_size: float, newer_than: datetime) -> list[SavedGroup]:
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+
+    magic, fmt, _, saved_tile_size, string_count, group_count, _ = _HEADER.unpack_from(data, 0)
+    if magic != MAGIC or fmt != FORMAT:
+        logger.warning(f"Ignoring snapshot {path}: unrecognised format")
+        return []
+
+    offset = _HEADER.size
+    strings: list[str] = []
+    for _ in range(string_count):
+        (length,) = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        strings.append(sys.intern(data[offset:offset + length].decode()))
+        offset += length
+
+    vehicles_at = offset + group_count * _GROUP.size
+    cutoff = newer_than.timestamp()
+    groups: list[SavedGroup] = []
+    for g in range(group_count):
+        kind, x, y, west, south, east, north, fetched_at, first, rows = _GROUP.unpack_from(
+            data, offset + g * _GROUP.size
+        )
+        # Tiles cut at another size don't line up with ours; skip them.
+        if kind == GROUP_TILE and saved_tile_size != tile_size:
+            continue
+        if fetched_at <= cutoff:
+            continue
+        vehicles = []
+        for r in range(first, first + rows):
+            lat, lon, ts, recorded, speed, heading, vid, line, op, dest = _VEHICLE.unpack_from(
+                data, vehicles_at + r * _VEHICLE.size
+            )
+            # Corruption surfaces as ValueError, like a bad header or row does.
+            try:
+                vehicles.append(Vehicle(
+                    strings[vid], lat, lon, strings[line], strings[op], strings[dest],
+                    datetime.fromtimestamp(ts, timezone.utc),
+                    None if math.isnan(recorded) else datetime.fromtimestamp(recorded, timezone.utc),
+                    None if math.isnan(speed) else speed,
+                    None if math.isnan(heading) else heading,
+                ))
+            except (IndexError, OverflowError) as e:
+                raise ValueError(f"Corrupt vehicle row {r} in {path}: {e}") from e
+        groups.append(SavedGroup(
+            (x, y) if kind == GROUP_TILE else None,
+            (west, south, east, north) if kind == GROUP_REGION else None,
+            datetime.fromtimestamp(fetched_at, timezone.utc),
+            vehicles,
+        ))
+    return groups
+
+
+def read_snapshots(path: str, tile_size: float, newer_than: datetime) -> list[SavedGroup]:
+    # Merges every worker's file, keeping the newest copy of each tile and
+    # region. Files too old to hold anything worth restoring are removed.
+    latest: dict[tuple, SavedGroup] = {}
+    for name in snapshot_files(path):
+        try:
+            if os.path.getmtime(name) <= newer_than.timestamp():
+                os.remove(name)
+                continue
+            groups = read_snapshot(name, tile_size, newer_than)
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f"Could not read snapshot {name}: {e}")
+            continue
+        for group in groups:
+            key = (group.tile, group.area)
+            seen = latest.get(key)
+            if seen is None or group.fetched_at > seen.fetched_at:
+                latest[key] = group
+    return list(latest.values())
+
+
+class SnapshotWriter(Poller):
+    def __init__(self, tracker: BusTracker, path: str, interval_seconds: float):
+        super().__init__("snapshot-writer", interval_seconds)
+        self.tracker = tracker
+        self.path = path
+
+    def poll_once(self) -> None:
+        self.tracker.save_state(self.path)
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+import logging
+import secrets
+import threading
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from .state import decode_vehicles, encode_vehicles
+
+if TYPE_CHECKING:
+    from .captcha import RateLimiter
+    from .tracker import BusTracker
+
+logger = logging.getLogger(__name__)
+
+
+class Poller:
+    def __init__(self, name: str, interval_seconds: float):
+        self.name = name
+        self.interval_seconds = interval_seconds
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, initial_delay: float = 0.0) -> None:
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(initial_delay,), name=self.name, daemon=True)
+        self._thread.start()
+        logger.info(f"{self.name} started ({self.interval_seconds}s interval)")
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def poll_once(self) -> None:
+        raise NotImplementedError
+
+    def _run(self, initial_delay: float) -> None:
+        self._stop.wait(initial_delay)
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.poll_once()
+            except Exception:
+                logger.exception(f"{self.name} poll failed")
+            elapsed = time.monotonic() - started
+            self._stop.wait(max(0.0, self.interval_seconds - elapsed))
+
+
+class RegionPoller(Poller):
+    def __init__(
+        self,
+        tracker: BusTracker,
+        region: tuple[float, float, float, float],
+        interval_seconds: float,
+        rate_limiter: RateLimiter | None = None,
+    ):
+        super().__init__("region-poller", interval_seconds)
+        self.tracker = tracker
+        self.region = region
+        self.rate_limiter = rate_limiter
+        # With a shared state backend one poller, whichever holds the lease,
+        # fetches for everyone; the others pick its snapshot up.
+        self._owner = secrets.token_hex(8)
+        self._followed: bytes | None = None
+
+    def poll_once(self) -> None:
+        from .captcha import RateLimitExceeded
+        from .upstream import UpstreamUnavailable
+
+        state = self.tracker.state
+        if state.shared and not state.acquire_lease("poller:lease", self._owner, self.interval_seconds * 3):
+            self._follow()
+            return
+
+        try:
+            vehicles = self.tracker._fetch_vehicles(self.region, self.rate_limiter)
+        except RateLimitExceeded:
+            logger.warning("Rate limit exceeded, keeping previous snapshot")
+            return
+        except UpstreamUnavailable as e:
+            logger.warning(f"{e}, keeping previous snapshot")
+            return
+
+        self.tracker.publish_snapshot(self.region, vehicles)
+        if state.shared:
+            state.set("poller:snapshot", encode_vehicles(datetime.now(timezone.utc), vehicles), self.interval_seconds * 3)
+
+    def _follow(self) -> None:
+        blob = self.tracker.state.get("poller:snapshot")
+        if blob is None or blob == self._followed:
+            return
+        self._followed = blob
+        _, vehicles = decode_vehicles(blob)
+        self.tracker.publish_snapshot(self.region, vehicles)
+
+
+class TilePrefetcher(Poller):
+    # Refreshes tiles in demand shortly before they expire, so the requests
+    # that keep coming for them find a fresh entry instead of waiting on BODS.
+    def __init__(
+        self,
+        tracker: BusTracker,
+        interval_seconds: float,
+        budget: RateLimiter,
+        rate_limiter: RateLimiter | None = None,
+    ):
+        super().__init__("tile-prefetcher", interval_seconds)
+        self.tracker = tracker
+        # Prefetch's own share of the hourly budget; requests still count
+        # against the shared upstream limiter too.
+        self.budget = budget
+        self.rate_limiter = rate_limiter
+
+    def poll_once(self) -> None:
+        if self.tracker.breaker.open:
+            return
+        for tiles in self.tracker.due_for_prefetch():
+            if not self.tracker.prefetch_tiles(tiles, self.budget, self.rate_limiter):
+                return
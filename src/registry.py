@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Protocol
+
+from .models import Vehicle
+from .tiles import (
+    BoundingBox, Tile, bearing_degrees, contains, distance_metres, tile_count, tile_of, tile_range, tiles_for,
+)
+
+PRUNE_INTERVAL_SECONDS = 30
+# Recent sightings kept per vehicle for speed and heading. Speed is taken
+# over the oldest sighting still inside the window, which smooths GPS jitter
+# without lagging far behind a bus that has just pulled away.
+MOTION_SAMPLES = 4
+MOTION_WINDOW_SECONDS = 180
+# Below this the bearing between two fixes is mostly noise.
+MOTION_MIN_METRES = 10
+
+
+@dataclass
+class Delta:
+    version: int
+    vehicles: list[Vehicle]
+    removed: list[str]
+
+
+class RegistryListener(Protocol):
+    # Called with the registry lock held, so keep these cheap.
+    def on_upsert(self, old: Vehicle | None, new: Vehicle) -> None: ...
+
+    def on_remove(self, old: Vehicle) -> None: ...
+
+
+class _Tracked:
+    __slots__ = ("vehicle", "tile", "samples")
+
+    def __init__(self, vehicle: Vehicle, tile: Tile):
+        self.vehicle = vehicle
+        self.tile = tile
+        # (reported at, latitude, longitude), oldest first
+        self.samples: deque[tuple[float, float, float]] = deque(maxlen=MOTION_SAMPLES)
+
+
+def _reported_at(v: Vehicle) -> float:
+    return (v.recorded_at or v.timestamp).timestamp()
+
+
+def _with_motion(tracked: _Tracked, v: Vehicle) -> Vehicle:
+    samples = tracked.samples
+    t = _reported_at(v)
+    if samples and t <= samples[-1][0]:
+        # Same report as last time; keep what we derived from it.
+        previous = tracked.vehicle
+        return replace(v, speed=previous.speed, heading=v.heading if v.heading is not None else previous.heading)
+
+    samples.append((t, v.latitude, v.longitude))
+    base = next((s for s in samples if t - s[0] <= MOTION_WINDOW_SECONDS and s[0] < t), None)
+    if base is None:
+        return v
+
+    t0, lat0, lon0 = base
+    distance = distance_metres(lat0, lon0, v.latitude, v.longitude)
+    heading = v.heading
+    if heading is None:
+        heading = (
+            bearing_degrees(lat0, lon0, v.latitude, v.longitude)
+            if distance >= MOTION_MIN_METRES else tracked.vehicle.heading
+        )
+    return replace(v, speed=distance / (t - t0), heading=heading)
+
+
+def _state(v: Vehicle) -> tuple:
+    return (v.latitude, v.longitude, v.line, v.operator, v.destination)
+
+
+class VehicleRegistry:
+    def __init__(self, tile_size: float, max_age_seconds: int, log_max_entries: int):
+        self.tile_size = tile_size
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._version = 0
+        self._vehicles: dict[str, _Tracked] = {}
+        self._by_tile: dict[Tile, set[str]] = {}
+        # (version, vehicle_id, vehicle before the change or None if it was
+        # new) for every add, move and removal, oldest first.
+        self._log: deque[tuple[int, str, Vehicle | None]] = deque(maxlen=log_max_entries)
+        # Highest version that may have fallen off the front of the log.
+        self._floor = 0
+        self._last_prune = time.monotonic()
+        self._listeners: list[RegistryListener] = []
+
+    def add_listener(self, listener: RegistryListener) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+            for tracked in self._vehicles.values():
+                listener.on_upsert(None, tracked.vehicle)
+
+    @property
+    def version(self) -> int:
+        with self._lock:
+            return self._version
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._vehicles)
+
+    def ingest(self, area: BoundingBox | list[BoundingBox], vehicles: list[Vehicle]) -> int:
+        # `area` is what the vehicles were fetched for, or a list of such
+        # areas fetched separately.
+        areas = area if isinstance(area, list) else [area]
+        with self._lock:
+            self._version += 1
+            version = self._version
+
+            # Entries are swapped for copies carrying speed and heading, so
+            # callers cache and serve the same objects the registry holds.
+            seen = set()
+            for i, v in enumerate(vehicles):
+                seen.add(v.vehicle_id)
+                vehicles[i] = self._upsert(v, version)
+
+            # Anything we were tracking inside the fetched area that upstream
+            # no longer reports has gone out of service. Only inside the area
+            # itself: an edge tile it cuts through was not fetched in full.
+            for vehicle_id in {vehicle_id for a in areas for vehicle_id in self._ids_in(a)}:
+                if vehicle_id not in seen:
+                    self._remove(vehicle_id, version)
+
+            now = time.monotonic()
+            if now - self._last_prune >= PRUNE_INTERVAL_SECONDS:
+                self._last_prune = now
+                self._prune(version)
+
+            self._changed.notify_all()
+            return version
+
+    def wait_for_change(self, after: int, timeout: float) -> int:
+        with self._changed:
+            self._changed.wait_for(lambda: self._version > after, timeout)
+            return self._version
+
+    def changes_since(
+        self, since: int, bounding_box: BoundingBox, match: Callable[[Vehicle], bool] | None = None
+    ) -> Delta | None:
+        # A vehicle is in the view when it is inside the bbox and, given a
+        # filter, matches it.
+        def in_view(v: Vehicle) -> bool:
+            return contains(bounding_box, v.longitude, v.latitude) and (match is None or match(v))
+
+        with self._lock:
+            version = self._version
+            # Older than the log reaches, or from before a restart.
+            if since < self._floor or since > version:
+                return None
+
+            # Walking back, the last entry seen per id is its first change
+            # after `since`, so its previous vehicle is what the client had.
+            before: dict[str, Vehicle | None] = {}
+            for entry_version, vehicle_id, previous in reversed(self._log):
+                if entry_version <= since:
+                    break
+                before[vehicle_id] = previous
+
+            vehicles = []
+            removed = []
+            for vehicle_id, previous in before.items():
+                tracked = self._vehicles.get(vehicle_id)
+                if tracked and in_view(tracked.vehicle):
+                    vehicles.append(tracked.vehicle)
+                elif previous is not None and in_view(previous):
+                    # Gone, moved out of this view or stopped matching; either
+                    # way the client drops it.
+                    removed.append(vehicle_id)
+            return Delta(version, vehicles, removed)
+
+    def _ids_in(self, area: BoundingBox) -> list[str]:
+        if tile_count(area, self.tile_size) <= len(self._by_tile):
+            tiles = [t for t in tiles_for(area, self.tile_size) if t in self._by_tile]
+        else:
+            x0, y0, x1, y1 = tile_range(area, self.tile_size)
+            tiles = [(x, y) for x, y in self._by_tile if x0 <= x <= x1 and y0 <= y <= y1]
+        vehicles = self._vehicles
+        return [
+            vehicle_id for tile in tiles for vehicle_id in self._by_tile[tile]
+            if contains(area, vehicles[vehicle_id].vehicle.longitude, vehicles[vehicle_id].vehicle.latitude)
+        ]
+
+    def _upsert(self, v: Vehicle, version: int) -> Vehicle:
+        tile = tile_of(v.longitude, v.latitude, self.tile_size)
+        tracked = self._vehicles.get(v.vehicle_id)
+
+        if tracked is None:
+            tracked = self._vehicles[v.vehicle_id] = _Tracked(v, tile)
+            tracked.samples.append((_reported_at(v), v.latitude, v.longitude))
+            self._by_tile.setdefault(tile, set()).add(v.vehicle_id)
+            self._record(version, v.vehicle_id, None)
+            for listener in self._listeners:
+                listener.on_upsert(None, v)
+            return v
+
+        v = _with_motion(tracked, v)
+        old = tracked.vehicle
+        changed = _state(old) != _state(v)
+        tracked.vehicle = v
+        if tile != tracked.tile:
+            self._discard_from_tile(tracked.tile, v.vehicle_id)
+            self._by_tile.setdefault(tile, set()).add(v.vehicle_id)
+            tracked.tile = tile
+        if changed:
+            self._record(version, v.vehicle_id, old)
+            for listener in self._listeners:
+                listener.on_upsert(old, v)
+        return v
+
+    def _remove(self, vehicle_id: str, version: int) -> None:
+        tracked = self._vehicles.pop(vehicle_id, None)
+        if tracked is None:
+            return
+        self._discard_from_tile(tracked.tile, vehicle_id)
+        self._record(version, vehicle_id, tracked.vehicle)
+        for listener in self._listeners:
+            listener.on_remove(tracked.vehicle)
+
+    def _discard_from_tile(self, tile: Tile, vehicle_id: str) -> None:
+        ids = self._by_tile.get(tile)
+        if ids is not None:
+            ids.discard(vehicle_id)
+            if not ids:
+                del self._by_tile[tile]
+
+    def _record(self, version: int, vehicle_id: str, previous: Vehicle | None) -> None:
+        if len(self._log) == self._log.maxlen:
+            self._floor = self._log[0][0]
+        self._log.append((version, vehicle_id, previous))
+
+    def _prune(self, version: int) -> None:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.max_age_seconds)
+        stale = [vid for vid, t in self._vehicles.items() if t.vehicle.timestamp < cutoff]
+        for vehicle_id in stale:
+            self._remove(vehicle_id, version)
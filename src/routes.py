@@ -1,18 +1,34 @@
 from __future__ import annotations
 
+import hmac
+import json
+import math
 import os
-import requests
+import time
 from datetime import datetime, timezone
 from typing import TYPE_CHECKING
-from flask import Blueprint, current_app, jsonify, render_template, request
+from flask import Blueprint, Response, current_app, g, jsonify, render_template, request
+
+from .encoding import COLUMNS_MIMETYPE, encode_json, vehicle_columns
+from .lines import FILTER_FIELDS, Filters, matcher
+from .metrics import CONTENT_TYPE, REQUEST_SECONDS, render as render_metrics
+from .osrm import parse_point
+from .stream import vehicle_stream
+from .upstream import UpstreamUnavailable
 
 if TYPE_CHECKING:
+    from .aircraft import AircraftFeed, AircraftRouteCache
     from .captcha import CaptchaManager
     from .config import Config
+    from .encoding import EncodedBody, ResponseCache
+    from .osrm import RouteCache
     from .tracker import BusTracker
 
 bp = Blueprint("main", __name__)
 
+# Aircraft data older than this many feed intervals is flagged as stale.
+AIRCRAFT_STALE_INTERVALS = 3
+
 
 def get_tracker() -> BusTracker:
     return current_app.config["tracker"]
@@ -26,6 +42,95 @@ def get_config() -> Config:
     return current_app.config["app_config"]
 
 
+def get_responses() -> ResponseCache:
+    return current_app.config["responses"]
+
+
+def get_aircraft_feed() -> AircraftFeed | None:
+    return current_app.config["aircraft"]
+
+
+def get_aircraft_routes_cache() -> AircraftRouteCache | None:
+    return current_app.config["aircraft_routes"]
+
+
+def get_route_cache() -> RouteCache | None:
+    return current_app.config["routes"]
+
+
+def check_quotas(session_token: str | None) -> Response | None:
+    # Per-browser limits, separate from the global upstream budget.
+    for quota, key in (
+        (current_app.config["client_quota"], request.remote_addr or ""),
+        (current_app.config["session_quota"], session_token),
+    ):
+        if quota is not None and key and not quota.check(key):
+            retry_after = quota.retry_after()
+            response = jsonify({"error": "Too many requests", "retry_after": retry_after})
+            response.status_code = 429
+            response.headers["Retry-After"] = str(retry_after)
+            return response
+    return None
+
+
+def wants_columns() -> bool:
+    # Plain JSON unless the client prefers the columnar format outright.
+    return request.accept_mimetypes.best_match(["application/json", COLUMNS_MIMETYPE]) == COLUMNS_MIMETYPE
+
+
+def parse_filters() -> Filters:
+    # ?line=1&line=1A&operator=FBRI: any of a field's values, all fields given.
+    filters = {}
+    for field in FILTER_FIELDS:
+        values = [value for value in request.args.getlist(field) if value.strip()]
+        if values:
+            filters[field] = values
+    return filters
+
+
+def unavailable_response(error: UpstreamUnavailable) -> Response:
+    retry_after = max(1, round(error.retry_after))
+    response = jsonify({"error": "Bus data temporarily unavailable", "retry_after": retry_after})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+def encoded_response(encoded: EncodedBody, headers: dict | None = None) -> Response:
+    # The ETag names the coding served, so a 304 only ever confirms the
+    # representation the client actually holds.
+    body, content_encoding = encoded.select(request.accept_encodings)
+    etag = encoded.etag_for(content_encoding)
+    headers = {
+        "ETag": f'"{etag}"',
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+        **(headers or {}),
+    }
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+    return Response(body, mimetype=encoded.mimetype, headers=headers)
+
+
+@bp.before_app_request
+def start_timer():
+    g.started = time.perf_counter()
+
+
+@bp.after_app_request
+def record_latency(response: Response) -> Response:
+    # Labelled by URL rule, not path, so bounds and ids don't multiply series.
+    if "started" in g:
+        rule = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - g.started, rule, request.method, str(response.status_code)
+        )
+    return response
+
+
 @bp.route("/")
 def index():
     config = get_config()
@@ -48,6 +153,7 @@ def index():
             "realtime_zoom_threshold": config.realtime_zoom_threshold,
             "osrm_url": config.osrm_url,
             "routing_zoom_threshold": config.routing_zoom_threshold,
+            "route_batch_max_legs": config.route_batch_max_legs,
             "max_requests_per_hour": config.max_requests_per_hour,
             "cap_enabled": captcha.enabled,
             "cap_frontend_interval_ms": config.cap_frontend_interval_ms,
@@ -56,6 +162,8 @@ def index():
             "cap_assets_url": cap_public_url,
             "aircraft_url": config.aircraft_url,
             "aircraft_refresh_ms": config.aircraft_refresh_ms,
+            "stream_enabled": config.stream_enabled,
+            "clusters_enabled": config.poll_region is not None,
         },
     )
 
@@ -69,39 +177,77 @@ def health():
         "status": "healthy",
         "timestamp": datetime.now(timezone.utc).isoformat(),
         **tracker.get_stats(),
+        **get_responses().get_stats(),
+        **(route_cache.get_stats() if (route_cache := get_route_cache()) else {}),
+        **(aircraft_routes.get_stats() if (aircraft_routes := get_aircraft_routes_cache()) else {}),
     })
 
+@bp.route("/metrics")
+def get_metrics():
+    config = get_config()
+    if not config.metrics_enabled:
+        return jsonify({"error": "Metrics not enabled"}), 404
+    if config.metrics_token and not hmac.compare_digest(
+        request.headers.get("Authorization", ""), f"Bearer {config.metrics_token}"
+    ):
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(render_metrics(), content_type=CONTENT_TYPE, headers={"Cache-Control": "no-store"})
+
+
 @bp.route("/api/aircraft")
 def get_aircraft():
-    config = current_app.config["app_config"]
-    
-    if not config.aircraft_url:
+    feed = get_aircraft_feed()
+
+    if feed is None:
         return jsonify({"error": "Aircraft not configured"}), 404
-    
-    try:
-        resp = requests.get(config.aircraft_url, timeout=10)
-        return jsonify(resp.json())
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+
+    snapshot = feed.snapshot
+    if snapshot is None:
+        return jsonify({"error": "Aircraft feed unavailable"}), 503
+
+    bounds = None
+    if "west" in request.args:
+        try:
+            bounds = tuple(float(request.args[k]) for k in ("west", "south", "east", "north"))
+        except (KeyError, ValueError):
+            return jsonify({"error": "Invalid bounds"}), 400
+
+    # Unfiltered is the feed as tar1090 sent it; filtered keeps its other
+    # top-level fields. Per-viewport bodies have their own cache.
+    encoded = current_app.config["aircraft_responses"].get_or_encode(
+        ("aircraft", snapshot.version, bounds),
+        lambda: encode_json({**snapshot.data, "aircraft": snapshot.within(bounds)} if bounds else snapshot.data),
+    )
+    headers = {}
+    age = feed.age_seconds()
+    if age is not None:
+        headers["X-Data-Age"] = str(int(age))
+        # The last good snapshot is kept while the feed fails; say so.
+        if age > feed.interval_seconds * AIRCRAFT_STALE_INTERVALS:
+            headers["X-Data-Stale"] = "true"
+    return encoded_response(encoded, headers)
 
 
 @bp.route("/api/aircraft/routes", methods=["POST"])
 def get_aircraft_routes():
-    config = current_app.config["app_config"]
-    
-    if not config.aircraft_route_url:
+    aircraft_routes = get_aircraft_routes_cache()
+
+    if aircraft_routes is None:
         return jsonify({"error": "Aircraft routes not configured"}), 404
-    
+
+    data = request.get_json(silent=True) or {}
+
+    # Deduplicated by callsign; only the fields the route service uses go upstream.
+    planes: dict[str, dict] = {}
     try:
-        resp = requests.post(
-            config.aircraft_route_url,
-            json=request.get_json(),
-            headers={"Content-Type": "application/json"},
-            timeout=10
-        )
-        return jsonify(resp.json())
-    except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        for plane in data.get("planes", []):
+            callsign = plane["callsign"].strip()
+            if callsign:
+                planes[callsign] = {"callsign": callsign, "lat": float(plane["lat"]), "lng": float(plane["lng"])}
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return jsonify({"error": "Invalid planes"}), 400
+
+    return jsonify(aircraft_routes.get_routes(list(planes.values())))
 
 @bp.route("/api/buses")
 def get_buses():
@@ -111,10 +257,13 @@ def get_buses():
     captcha = current_app.config["captcha"]
     config = current_app.config["app_config"]
     rate_limiter = current_app.config["rate_limiter"]
+    session_token = request.headers.get("X-Session-Token")
 
-    if captcha.enabled:
-        session_token = request.headers.get("X-Session-Token")
+    limited = check_quotas(session_token)
+    if limited is not None:
+        return limited
 
+    if captcha.enabled:
         # Must have valid session
         if not captcha.validate_token(session_token):
             return jsonify({"cap_required": True, "reason": "session"}), 403
@@ -136,26 +285,226 @@ def get_buses():
     except (TypeError, ValueError):
         return jsonify({"error": "Invalid bounds"}), 400
 
+    try:
+        since = int(request.args["since"]) if "since" in request.args else None
+    except ValueError:
+        return jsonify({"error": "Invalid since"}), 400
+
     bounds = (west, south, east, north)
+    filters = parse_filters()
 
     try:
-        vehicles = tracker.get_bus_data(bounds, rate_limiter=rate_limiter, captcha=captcha)
+        view = tracker.get_view(bounds, rate_limiter=rate_limiter, captcha=captcha)
     except RateLimitExceeded:
         return jsonify({"error": "Rate limit exceeded", "retry_after": 3600}), 429
+    except UpstreamUnavailable as e:
+        return unavailable_response(e)
+
+    match = matcher(filters) if filters else None
+    delta = tracker.get_changes(bounds, since, match) if since is not None else None
+    filter_key = tuple((field, tuple(sorted(values))) for field, values in filters.items())
+
+    # The body depends only on the vehicles, so it is encoded and compressed
+    # once per data version and format. Per-client counters travel in headers.
+    columns = wants_columns()
+    mimetype = COLUMNS_MIMETYPE if columns else "application/json"
+
+    def vehicle_payload(vehicles):
+        return vehicle_columns(vehicles) if columns else [v.to_dict() for v in vehicles]
+
+    if delta is not None:
+        encoded = get_responses().get_or_encode(
+            ("delta", columns, bounds, filter_key, since, delta.version),
+            lambda: encode_json({
+                "version": delta.version,
+                "delta": True,
+                "vehicles": vehicle_payload(delta.vehicles),
+                "removed": delta.removed,
+            }, mimetype),
+        )
+    elif filters:
+        # Answered from the line indexes, which the view above just refreshed,
+        # so the result only changes when the view's data does.
+        encoded = get_responses().get_or_encode(
+            ("buses", columns, view.key, filter_key) if view.key is not None else None,
+            lambda: encode_json({
+                "version": view.version,
+                "vehicles": vehicle_payload(tracker.find_vehicles(filters, bounds)),
+            }, mimetype),
+        )
+    else:
+        encoded = get_responses().get_or_encode(
+            ("buses", columns, view.key) if view.key is not None else None,
+            lambda: encode_json({
+                "version": view.version,
+                "vehicles": vehicle_payload(view.vehicles),
+            }, mimetype),
+        )
+    headers = {
+        "X-RateLimit-Limit": str(config.max_requests_per_hour),
+        "Vary": "Accept, Accept-Encoding",
+    }
+    age = view.age_seconds()
+    if age is not None:
+        headers["X-Data-Age"] = str(int(age))
+        if age > tracker.fresh_seconds:
+            headers["X-Data-Stale"] = "true"
+    if rate_limiter:
+        headers["X-RateLimit-Remaining"] = str(rate_limiter.remaining())
+    if captcha.enabled:
+        headers["X-Cap-Count"] = str(captcha.get_vehicle_count())
+        headers["X-Cap-Threshold"] = str(config.cap_challenge_interval)
 
-    return jsonify({
-       "vehicles": vehicles,
-       "vehicle_count": captcha.get_vehicle_count() if captcha.enabled else 0,
-       "cap_threshold": config.cap_challenge_interval if captcha.enabled else None,
-       "rate_remaining": rate_limiter.remaining() if rate_limiter else None,
-       "rate_limit": config.max_requests_per_hour
-    })
+    return encoded_response(encoded, headers)
+
+@bp.route("/api/clusters")
+def get_clusters():
+    tracker = current_app.config["tracker"]
+
+    if tracker is None or tracker.clusters is None:
+        return jsonify({"error": "Clusters need POLL_REGION"}), 404
+
+    try:
+        zoom = int(request.args["zoom"])
+        bounds = tuple(float(request.args[k]) for k in ("west", "south", "east", "north"))
+    except (KeyError, ValueError):
+        return jsonify({"error": "Invalid zoom or bounds"}), 400
+
+    zoom = tracker.clusters.clamp_zoom(zoom)
+    version = tracker.registry.version
+
+    def build():
+        clusters = tracker.get_clusters(zoom, bounds)
+        return encode_json({
+            "version": version,
+            "zoom": zoom,
+            "clusters": clusters,
+            "vehicle_count": sum(c["count"] for c in clusters),
+        })
+
+    # Keyed on the grid cells the bbox covers, so small pans share a body.
+    cells = tracker.clusters.cells(zoom, bounds)
+    encoded = current_app.config["cluster_responses"].get_or_encode(("clusters", zoom, cells, version), build)
+    return encoded_response(encoded)
+
+@bp.route("/api/lines")
+def get_lines():
+    tracker = get_tracker()
+    operator = request.args.get("operator") or None
+    version = tracker.registry.version
+
+    def build():
+        lines = tracker.get_lines(operator)
+        return encode_json({
+            "version": version,
+            "lines": lines,
+            "vehicle_count": sum(line["vehicles"] for line in lines),
+        })
+
+    encoded = get_responses().get_or_encode(("lines", operator, version), build)
+    return encoded_response(encoded)
+
+@bp.route("/api/buses/stream")
+def stream_buses():
+    tracker = current_app.config["tracker"]
+    captcha = current_app.config["captcha"]
+    config = current_app.config["app_config"]
+    rate_limiter = current_app.config["rate_limiter"]
+    slots = current_app.config["stream_slots"]
+
+    if not config.stream_enabled:
+        return jsonify({"error": "Streaming not enabled"}), 404
+
+    # EventSource can't set headers, so the session token comes as a param.
+    session_token = request.args.get("token")
+    limited = check_quotas(session_token)
+    if limited is not None:
+        return limited
+
+    if captcha.enabled and not captcha.validate_token(session_token):
+        return jsonify({"cap_required": True, "reason": "session"}), 403
+
+    try:
+        bounds = tuple(float(request.args[k]) for k in ("west", "south", "east", "north"))
+    except (KeyError, ValueError):
+        return jsonify({"error": "Invalid bounds"}), 400
+
+    # Browsers send the last event id when they reconnect, so resume from it.
+    try:
+        last_id = request.headers.get("Last-Event-ID") or request.args.get("since")
+        since = int(last_id) if last_id else None
+    except ValueError:
+        since = None
+
+    if not slots.acquire(blocking=False):
+        return jsonify({"error": "Too many streams", "retry_after": 30}), 503
+
+    response = Response(
+        vehicle_stream(tracker, config, bounds, since, rate_limiter, captcha, session_token),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+    response.call_on_close(slots.release)
+    return response
+
+def parse_time(value: str) -> float:
+    # Epoch seconds or ISO 8601; naive times are taken as UTC.
+    try:
+        return float(value)
+    except ValueError:
+        parsed = datetime.fromisoformat(value)
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=timezone.utc)
+        return parsed.timestamp()
+
+
+@bp.route("/api/history")
+def get_history():
+    tracker = get_tracker()
+    config = get_config()
+
+    if tracker is None or tracker.history is None:
+        return jsonify({"error": "History not enabled"}), 404
+
+    session_token = request.headers.get("X-Session-Token")
+    limited = check_quotas(session_token)
+    if limited is not None:
+        return limited
+
+    captcha = get_captcha()
+    if captcha.enabled and not captcha.validate_token(session_token):
+        return jsonify({"cap_required": True, "reason": "session"}), 403
+
+    try:
+        bounds = tuple(float(request.args[k]) for k in ("west", "south", "east", "north"))
+        start = parse_time(request.args["start"])
+        end = parse_time(request.args["end"]) if "end" in request.args else datetime.now(timezone.utc).timestamp()
+    except (KeyError, ValueError):
+        return jsonify({"error": "Invalid bounds or time range"}), 400
+    # NaN slips past every comparison below and would scan all of history.
+    if not all(math.isfinite(x) for x in (*bounds, start, end)):
+        return jsonify({"error": "Invalid bounds or time range"}), 400
+
+    if end < start or end - start > config.history_max_query_seconds:
+        return jsonify({
+            "error": "Invalid time range",
+            "max_seconds": config.history_max_query_seconds,
+        }), 400
+
+    positions = tracker.history.query(
+        bounds, start, end, request.args.get("vehicle_id"), request.args.get("line")
+    )
+    # One JSON object per line, written as they are read off disk.
+    return Response(
+        (json.dumps(p, separators=(",", ":")) + "\n" for p in positions),
+        mimetype="application/x-ndjson",
+    )
 
 @bp.route("/api/route")
 def get_route():
-    config = current_app.config["app_config"]
+    route_cache = get_route_cache()
 
-    if not config.osrm_url:
+    if route_cache is None:
         return jsonify({"error": "Routing not configured"}), 404
 
     start = request.args.get("start")
@@ -165,12 +514,37 @@ def get_route():
         return jsonify({"error": "Missing start or end"}), 400
 
     try:
-        url = f"{config.osrm_url}/route/v1/driving/{start};{end}?geometries=geojson"
-        resp = requests.get(url, timeout=5)
-        return jsonify(resp.json())
+        start_point, end_point = parse_point(start), parse_point(end)
+    except ValueError:
+        return jsonify({"error": "Invalid start or end"}), 400
+
+    try:
+        return jsonify(route_cache.get_route(start_point, end_point))
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@bp.route("/api/routes", methods=["POST"])
+def get_routes():
+    route_cache = get_route_cache()
+
+    if route_cache is None:
+        return jsonify({"error": "Routing not configured"}), 404
+
+    data = request.get_json(silent=True) or {}
+    legs = data.get("legs")
+
+    if not isinstance(legs, list) or not legs:
+        return jsonify({"error": "Missing legs"}), 400
+    if len(legs) > get_config().route_batch_max_legs:
+        return jsonify({"error": "Too many legs"}), 400
+
+    try:
+        points = [(parse_point(leg["start"]), parse_point(leg["end"])) for leg in legs]
+    except (KeyError, TypeError, AttributeError, ValueError):
+        return jsonify({"error": "Invalid start or end"}), 400
+
+    return jsonify({"routes": route_cache.get_routes(points)})
+
 @bp.route("/api/cap/verify", methods=["POST"])
 def verify_cap():
     captcha = current_app.config["captcha"]
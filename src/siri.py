@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import io
+import logging
+import sys
+import time
+from datetime import datetime
+from typing import IO
+
+import defusedxml.ElementTree as ET
+from defusedxml import DefusedXmlException
+
+from .models import Vehicle
+
+logger = logging.getLogger(__name__)
+
+SIRI_NS = "http://www.siri.org.uk/siri"
+
+# Fixed paths per the SIRI-VM 2.0 schema, so each field is a handful of
+# direct child lookups rather than a descendant search over the activity.
+_VEHICLE_ACTIVITY = f"{{{SIRI_NS}}}VehicleActivity"
+_JOURNEY = f"{{{SIRI_NS}}}MonitoredVehicleJourney"
+_LOCATION = f"{{{SIRI_NS}}}VehicleLocation"
+_LATITUDE = f"{{{SIRI_NS}}}Latitude"
+_LONGITUDE = f"{{{SIRI_NS}}}Longitude"
+_VEHICLE_REF = f"{{{SIRI_NS}}}VehicleRef"
+_LINE_REF = f"{{{SIRI_NS}}}LineRef"
+_OPERATOR_REF = f"{{{SIRI_NS}}}OperatorRef"
+_DESTINATION_NAME = f"{{{SIRI_NS}}}DestinationName"
+_RECORDED_AT_TIME = f"{{{SIRI_NS}}}RecordedAtTime"
+_BEARING = f"{{{SIRI_NS}}}Bearing"
+
+_SIRI = f"{{{SIRI_NS}}}Siri"
+
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class SiriParseError(ValueError):
+    pass
+
+
+class ResponseStream:
+    # Minimal file-like wrapper so iterparse can pull a requests response
+    # body in chunks; iter_content keeps transport errors as requests exceptions.
+    # Counts what it reads and how long it waited, so parse time can be told
+    # apart from network time.
+    def __init__(self, response, chunk_size: int = READ_CHUNK_BYTES):
+        self._chunks = response.iter_content(chunk_size)
+        self.bytes_read = 0
+        self.read_seconds = 0.0
+
+    def read(self, size: int = -1) -> bytes:
+        start = time.perf_counter()
+        chunk = next(self._chunks, b"")
+        self.read_seconds += time.perf_counter() - start
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def parse_siri_vm(source: IO[bytes] | bytes | str) -> list[Vehicle]:
+    # Raises SiriParseError for anything that isn't a complete SIRI document,
+    # so an error page or truncated body is never mistaken for no vehicles.
+    if isinstance(source, str):
+        source = source.encode("utf-8")
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+
+    vehicles: list[Vehicle] = []
+    elem = None
+    try:
+        for _, elem in ET.iterparse(source, events=("end",)):
+            if elem.tag != _VEHICLE_ACTIVITY:
+                continue
+            vehicle = _parse_vehicle_activity(elem)
+            if vehicle is not None:
+                vehicles.append(vehicle)
+            # Drop the subtree as soon as it is consumed; only an empty
+            # shell per activity stays attached to the delivery.
+            elem.clear()
+    except (ET.ParseError, DefusedXmlException) as e:
+        raise SiriParseError(f"XML parse error: {e}") from e
+
+    # The last element to end is the document root.
+    if elem is None or elem.tag != _SIRI:
+        raise SiriParseError(f"Not a SIRI document: {elem.tag if elem is not None else 'empty'}")
+    return vehicles
+
+
+def _parse_vehicle_activity(activity) -> Vehicle | None:
+    journey = activity.find(_JOURNEY)
+    if journey is None:
+        return None
+
+    vehicle_ref = journey.find(_VEHICLE_REF)
+    location = journey.find(_LOCATION)
+    if vehicle_ref is None or location is None:
+        return None
+
+    lat = location.findtext(_LATITUDE)
+    lon = location.findtext(_LONGITUDE)
+    if not lat or not lon:
+        return None
+
+    # Lines, operators and destinations repeat across thousands of vehicles;
+    # interning keeps one copy of each string per process.
+    try:
+        return Vehicle(
+            vehicle_id=vehicle_ref.text or "Unknown",
+            latitude=float(lat),
+            longitude=float(lon),
+            line=sys.intern(journey.findtext(_LINE_REF) or "Unknown"),
+            operator=sys.intern(journey.findtext(_OPERATOR_REF) or "Unknown"),
+            destination=sys.intern(journey.findtext(_DESTINATION_NAME) or "Unknown"),
+            recorded_at=_parse_time(activity.findtext(_RECORDED_AT_TIME)),
+            heading=_parse_float(journey.findtext(_BEARING)),
+        )
+    except ValueError as e:
+        logger.warning(f"Invalid coordinate: {e}")
+        return None
+
+
+def _parse_time(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def _parse_float(value: str | None) -> float | None:
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import heapq
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Iterable
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from .models import Vehicle
+
+if TYPE_CHECKING:
+    from .config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class StateBackend:
+    # Cache entries, counters, rate limit counters and leases that must agree
+    # across every worker. `shared` is False when nothing outside this
+    # process can see the state, so callers can skip work that only pays
+    # off between processes.
+    shared = False
+
+    def get(self, key: str) -> bytes | None:
+        raise NotImplementedError
+
+    def get_many(self, keys: list[str]) -> list[bytes | None]:
+        return [self.get(key) for key in keys]
+
+    def set(self, key: str, value: bytes, ttl_seconds: float | None = None) -> None:
+        raise NotImplementedError
+
+    def set_many(self, items: dict[str, bytes], ttl_seconds: float | None = None) -> None:
+        for key, value in items.items():
+            self.set(key, value, ttl_seconds)
+
+    def delete(self, key: str) -> None:
+        raise NotImplementedError
+
+    def incr(self, key: str, amount: int = 1, ttl_seconds: float | None = None) -> int:
+        # `ttl_seconds` applies when the counter is created.
+        raise NotImplementedError
+
+    def add(self, key: str, value: bytes, ttl_seconds: float) -> bool:
+        # Set only if absent; True when this call created the key.
+        raise NotImplementedError
+
+    def acquire_lease(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        # Take the lease if it is free, or extend it if `owner` already holds it.
+        raise NotImplementedError
+
+
+
+class MemoryBackend(StateBackend):
+    def __init__(self):
+        self._values: dict[str, tuple[float | None, bytes]] = {}
+        # (expires_at, key) in expiry order, so purging touches only keys
+        # that are actually due. Entries whose key has since been rewritten
+        # with a new expiry are skipped when they surface.
+        self._expiry: list[tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            return self._get(key, time.monotonic())
+
+    def set(self, key: str, value: bytes, ttl_seconds: float | None = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._put(key, value, now + ttl_seconds if ttl_seconds else None)
+            self._purge(now)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1, ttl_seconds: float | None = None) -> int:
+        now = time.monotonic()
+        with self._lock:
+            current = self._get(key, now)
+            if current is None:
+                expires = now + ttl_seconds if ttl_seconds else None
+            else:
+                expires = self._values[key][0]
+            value = int(current or 0) + amount
+            self._put(key, str(value).encode(), expires)
+            self._purge(now)
+            return value
+
+    def add(self, key: str, value: bytes, ttl_seconds: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            if self._get(key, now) is not None:
+                return False
+            self._put(key, value, now + ttl_seconds)
+            self._purge(now)
+            return True
+
+    def acquire_lease(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            holder = self._get(key, now)
+            if holder is not None and holder != owner.encode():
+                return False
+            self._put(key, owner.encode(), now + ttl_seconds)
+            return True
+
+    def _get(self, key: str, now: float) -> bytes | None:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= now:
+            del self._values[key]
+            return None
+        return entry[1]
+
+    def _put(self, key: str, value: bytes, expires: float | None) -> None:
+        previous = self._values.get(key)
+        self._values[key] = (expires, value)
+        if expires is not None and (previous is None or previous[0] != expires):
+            heapq.heappush(self._expiry, (expires, key))
+
+    def _purge(self, now: float) -> None:
+        expiry = self._expiry
+        while expiry and expiry[0][0] <= now:
+            expires, key = heapq.heappop(expiry)
+            entry = self._values.get(key)
+            if entry is not None and entry[0] == expires:
+                del self._values[key]
+
+
+# Redis has no native "set unless held by someone else", so it runs as a
+# script to stay atomic across clients.
+_LEASE_SCRIPT = """
+local holder = redis.call('GET', KEYS[1])
+if holder and holder ~= ARGV[1] then return 0 end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return 1
+"""
+
+
+class RedisBackend(StateBackend):
+    shared = True
+
+    def __init__(self, url: str, prefix: str = "busmap:", client=None):
+        # `client` stands in for a connection made from `url`, e.g. fakeredis.
+        self.prefix = prefix
+        self._redis = client if client is not None else redis.Redis.from_url(url)
+        self._lease = self._redis.register_script(_LEASE_SCRIPT)
+
+    def get(self, key: str) -> bytes | None:
+        return self._redis.get(self.prefix + key)
+
+    def get_many(self, keys: list[str]) -> list[bytes | None]:
+        if not keys:
+            return []
+        return self._redis.mget([self.prefix + key for key in keys])
+
+    def set(self, key: str, value: bytes, ttl_seconds: float | None = None) -> None:
+        self._redis.set(self.prefix + key, value, px=_millis(ttl_seconds))
+
+    def set_many(self, items: dict[str, bytes], ttl_seconds: float | None = None) -> None:
+        pipe = self._redis.pipeline(transaction=False)
+        for key, value in items.items():
+            pipe.set(self.prefix + key, value, px=_millis(ttl_seconds))
+        pipe.execute()
+
+    def delete(self, key: str) -> None:
+        self._redis.delete(self.prefix + key)
+
+    def incr(self, key: str, amount: int = 1, ttl_seconds: float | None = None) -> int:
+        if not ttl_seconds:
+            return self._redis.incrby(self.prefix + key, amount)
+        pipe = self._redis.pipeline()
+        pipe.incrby(self.prefix + key, amount)
+        pipe.pexpire(self.prefix + key, _millis(ttl_seconds), nx=True)
+        return pipe.execute()[0]
+
+    def add(self, key: str, value: bytes, ttl_seconds: float) -> bool:
+        return bool(self._redis.set(self.prefix + key, value, px=_millis(ttl_seconds), nx=True))
+
+    def acquire_lease(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        return bool(self._lease(keys=[self.prefix + key], args=[owner, _millis(ttl_seconds)]))
+
+
+def _millis(seconds: float | None) -> int | None:
+    return max(1, int(seconds * 1000)) if seconds else None
+
+
+def make_backend(config: Config) -> StateBackend:
+    if config.state_backend == "memory":
+        return MemoryBackend()
+    if config.state_backend == "redis":
+        if redis is None:
+            raise RuntimeError("STATE_BACKEND=redis but redis is not installed (pip install redis)")
+        if not config.redis_url:
+            raise RuntimeError("STATE_BACKEND=redis requires REDIS_URL")
+        logger.info("Using shared state backend (redis)")
+        return RedisBackend(config.redis_url)
+    raise RuntimeError(f"Unknown STATE_BACKEND: {config.state_backend}")
+
+
+# Vehicles travel between processes as compact JSON rows; the field order
+# is fixed, so a row is a plain list rather than a dict per vehicle.
+def encode_vehicles(timestamp: datetime, vehicles: Iterable[Vehicle]) -> bytes:
+    return json.dumps({
+        "timestamp": timestamp.timestamp(),
+        "vehicles": [
+            [
+                v.vehicle_id, v.latitude, v.longitude, v.line, v.operator, v.destination,
+                v.timestamp.timestamp(), v.recorded_at.timestamp() if v.recorded_at else None, v.speed, v.heading,
+            ]
+            for v in vehicles
+        ],
+    }, separators=(",", ":")).encode()
+
+
+def decode_vehicles(blob: bytes) -> tuple[datetime, list[Vehicle]]:
+    data = json.loads(blob)
+    vehicles = [
+        Vehicle(
+            vid, lat, lon, sys.intern(line), sys.intern(op), sys.intern(dest),
+            datetime.fromtimestamp(ts, timezone.utc),
+            datetime.fromtimestamp(recorded, timezone.utc) if recorded is not None else None,
+            speed, heading,
+        )
+        for vid, lat, lon, line, op, dest, ts, recorded, speed, heading in data["vehicles"]
+    ]
+    return datetime.fromtimestamp(data["timestamp"], timezone.utc), vehicles
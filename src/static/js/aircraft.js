@@ -219,9 +219,16 @@ const formatAircraftPopup = (ac, routeInfo = null) => {
     </div>`
 };
 
-const fetchAircraft = async () => {
+const fetchAircraft = async (bounds) => {
+    const params = new URLSearchParams({
+        west: bounds.getWest().toFixed(4),
+        south: bounds.getSouth().toFixed(4),
+        east: bounds.getEast().toFixed(4),
+        north: bounds.getNorth().toFixed(4)
+    });
+
     try {
-        const response = await fetch('/api/aircraft');
+        const response = await fetch(`/api/aircraft?${params}`);
         if (!response.ok) throw new Error(`HTTP ${response.status}`);
         const data = await response.json();
         return data.aircraft || [];
@@ -301,11 +308,11 @@ const renderAircraft = async () => {
     if (!map || !aircraftLayer || !isEnabled) return;
 
     const bounds = map.getBounds();
-    const aircraft = await fetchAircraft();
+    // The server only returns aircraft inside the requested bounds
+    const aircraft = await fetchAircraft(bounds);
     const seen = new Set();
 
-    const inViewAircraft = aircraft.filter(ac => ac.lat && ac.lon && bounds.contains([ac.lat, ac.lon]));
-    await fetchRoutes(inViewAircraft);
+    await fetchRoutes(aircraft);
 
     for (const ac of aircraft) {
         if (!ac.lat || !ac.lon) continue;
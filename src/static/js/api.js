@@ -1,49 +1,41 @@
-import { logApi } from './ui.js';
-import { tileCache, pendingTiles, getTileBounds, evictOldTiles } from './cache.js';
-import { updateCacheVis } from './cache-vis.js';
-import { getMap } from './map.js';
-
-export const fetchTile = async (tile) => {
-    const map = getMap();
-    const bounds = getTileBounds(tile.x, tile.y);
-    const params = new URLSearchParams({
-        west: bounds.west,
-        south: bounds.south,
-        east: bounds.east,
-        north: bounds.north
-    });
-
-    pendingTiles.add(tile.key);
-    updateCacheVis(map);
-
-    logApi(`→ Request tile ${tile.x},${tile.y}`, 'request');
-    const start = Date.now();
-
-    try {
-        const response = await fetch(`/api/buses?${params}`);
-        if (!response.ok) throw new Error(`HTTP ${response.status}`);
-
-        const data = await response.json();
-        const elapsed = Date.now() - start;
-
-        if (data.cap_required) {
-            const err = new Error('CAP_REQUIRED');
-            err.capData = data;
-            throw err;
-        }
-
-        tileCache.set(tile.key, {
-            vehicles: data.vehicles,
-            timestamp: Date.now()
-        });
-        evictOldTiles();
-
-        const capInfo = data.cap_threshold ? ` (${data.vehicle_count}/${data.cap_threshold})` : '';
-        logApi(`← Response: ${data.vehicles.length} vehicles${capInfo} (${elapsed}ms)`, 'response');
+// Compact vehicle lists for /api/buses: one array per field, strings
+// dictionary-encoded, coordinates as fixed-point deltas and times as
+// seconds from a base. Asked for via Accept; the server falls back to
+// plain JSON for anyone who doesn't.
+export const COLUMNS_MIMETYPE = 'application/vnd.busmap.columns+json';
+
+export const BUSES_ACCEPT = `${COLUMNS_MIMETYPE}, application/json;q=0.5`;
+
+const toIso = (base, offset) => offset === null ? null : new Date((base + offset) * 1000).toISOString();
+
+export const decodeColumns = (c) => {
+    const vehicles = new Array(c.count);
+    let lat = 0;
+    let lon = 0;
+    for (let i = 0; i < c.count; i++) {
+        lat += c.latitude[i];
+        lon += c.longitude[i];
+        vehicles[i] = {
+            vehicle_id: c.vehicle_id[i],
+            latitude: lat / c.scale,
+            longitude: lon / c.scale,
+            line: c.strings[c.line[i]],
+            operator: c.strings[c.operator[i]],
+            destination: c.strings[c.destination[i]],
+            timestamp: toIso(c.time_base, c.timestamp[i]),
+            recorded_at: toIso(c.time_base, c.recorded_at[i]),
+            speed: c.speed[i] === null ? null : c.speed[i] / 10,
+            heading: c.heading[i]
+        };
+    }
+    return vehicles;
+};
 
-        return { count: data.vehicles.length, vehicleCount: data.vehicle_count, capThreshold: data.cap_threshold };
-    } finally {
-        pendingTiles.delete(tile.key);
-        updateCacheVis(map);
+// Parses a /api/buses response in whichever format the server chose.
+export const readBuses = async (response) => {
+    const data = await response.json();
+    if ((response.headers.get('Content-Type') || '').startsWith(COLUMNS_MIMETYPE)) {
+        data.vehicles = decodeColumns(data.vehicles);
     }
+    return data;
 };
@@ -15,5 +15,7 @@ export const REALTIME_CACHE_TTL_MS = 5000;
 export const REALTIME_ZOOM_THRESHOLD = 16;
 export const CAP_INTERVAL_MS = 10 * 60 * 1000;
 export const MAX_LOG_ENTRIES = 50;
+export const DEAD_RECKONING_INTERVAL_MS = 1000;
+export const DEAD_RECKONING_MAX_MS = 60 * 1000;
 
 export const BUS_ICON = '🚌';
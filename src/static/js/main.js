@@ -1,14 +1,18 @@
 import { DEBOUNCE_MS, MIN_ZOOM_FOR_FETCH } from './config.js';
 import { getIsLoading, setLoading, showError, showInfoPopup, logApi, updateLastUpdate } from './ui.js';
 import { loadCapScript, isCapPending, checkFrontendCapRequired, showCapModal, resetCapTime, getSessionToken } from './captcha.js';
-import { initMap, getMap, renderVehicles, isAnimating, setCurrentBounds, setCurrentZoom, getCurrentZoom } from './map.js';
+import { initMap, getMap, renderVehicles, removeVehicles, getVehicleIds, renderClusters, clearClusters, isAnimating, setCurrentBounds, setCurrentZoom, getCurrentZoom } from './map.js';
 import { initRouting } from './routing.js';
 import { initAircraft, toggleAircraft, isAircraftEnabled, setAircraftEnabled } from './aircraft.js';
+import { isStreamSupported, isStreamOpen, openStream, closeStream } from './stream.js';
+import { BUSES_ACCEPT, readBuses } from './api.js';
 
 let debounceTimer = null;
 let refreshInterval = null;
 
 let lastFetch = { time: 0, key: null };
+// Server data version for the current viewport; lets us ask for changes only.
+let lastVersion = { key: null, version: null };
 
 const getQuantizedBounds = (map, config) => {
     const size = config.tile_size_degrees;
@@ -25,6 +29,111 @@ const getQuantizedBounds = (map, config) => {
 
 const getBoundsKey = (b) => `${b.west.toFixed(6)},${b.south.toFixed(6)},${b.east.toFixed(6)},${b.north.toFixed(6)}`;
 
+// After the server refuses a stream, poll for a while before trying again.
+const STREAM_RETRY_MS = 60000;
+let streamRetryAt = 0;
+let streamBuffer = null;
+let streamFlushTimer = null;
+
+const flushStreamBuffer = () => {
+    if (!streamBuffer) return;
+
+    // Let running animations finish rather than starting a second one on
+    // the same marker; updates that arrive meanwhile are merged.
+    if (isAnimating() || document.hidden) {
+        if (!streamFlushTimer) {
+            streamFlushTimer = setTimeout(() => {
+                streamFlushTimer = null;
+                flushStreamBuffer();
+            }, 250);
+        }
+        return;
+    }
+
+    const { vehicles, removed, replace } = streamBuffer;
+    streamBuffer = null;
+    // After a snapshot, whatever it (and later deltas) didn't mention is gone.
+    if (replace) {
+        for (const id of getVehicleIds()) {
+            if (!vehicles.has(id)) removed.add(id);
+        }
+    }
+
+    renderVehicles([...vehicles.values()], getMap().getBounds());
+    removeVehicles([...removed]);
+
+    updateLastUpdate(`Updated ${new Date().toLocaleTimeString()}`);
+    logApi(`⇠ ${vehicles.size} changed, ${removed.size} removed (push)`, 'response');
+};
+
+const queueStreamUpdate = (data) => {
+    // A snapshot (first event, or after a reconnect) is the whole set, so it
+    // replaces anything buffered rather than merging with it.
+    if (!streamBuffer || !data.delta) {
+        streamBuffer = { vehicles: new Map(), removed: new Set(), replace: !data.delta };
+    }
+    for (const v of data.vehicles) {
+        streamBuffer.vehicles.set(v.vehicle_id, v);
+        streamBuffer.removed.delete(v.vehicle_id);
+    }
+    for (const id of data.removed || []) {
+        streamBuffer.vehicles.delete(id);
+        streamBuffer.removed.add(id);
+    }
+    flushStreamBuffer();
+};
+
+const startStream = (config, qBounds, boundsKey) => {
+    if (isStreamOpen(boundsKey)) return;
+
+    logApi(`⇄ Subscribe viewport`, 'request');
+    openStream(qBounds, boundsKey, getSessionToken(), {
+        onData: queueStreamUpdate,
+        onCapRequired: async (data) => {
+            logApi(`CAPTCHA required (${data.reason})`, 'skipped');
+            await showCapModal(config, data.reason);
+            resetCapTime();
+            updateBuses(config);
+        },
+        onRateLimited: () => {
+            showError('Rate limit exceeded');
+            streamRetryAt = Date.now() + STREAM_RETRY_MS;
+        },
+        onUnavailable: (data) => {
+            showError('Bus data temporarily unavailable');
+            streamRetryAt = Date.now() + data.retry_after * 1000;
+        },
+        onClosed: () => {
+            logApi('Stream unavailable, polling instead', 'skipped');
+            streamRetryAt = Date.now() + STREAM_RETRY_MS;
+            updateBuses(config);
+        }
+    });
+};
+
+const updateClusters = async (zoom) => {
+    const bounds = getMap().getBounds();
+    const params = new URLSearchParams({
+        zoom,
+        west: bounds.getWest().toFixed(4),
+        south: bounds.getSouth().toFixed(4),
+        east: bounds.getEast().toFixed(4),
+        north: bounds.getNorth().toFixed(4)
+    });
+
+    try {
+        const response = await fetch(`/api/clusters?${params}`);
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const data = await response.json();
+        renderClusters(data.clusters);
+        logApi(`← ${data.clusters.length} clusters, ${data.vehicle_count} vehicles (z${data.zoom})`, 'response');
+    } catch (error) {
+        console.warn('Cluster fetch error:', error);
+    }
+};
+
+const canStream = (config) => config.stream_enabled && isStreamSupported() && Date.now() >= streamRetryAt;
+
 let scenicMode = false;
 const SCENIC_REFRESH_MS = 20000;
 
@@ -51,16 +160,23 @@ const updateBuses = async (config, force = false) => {
 
     const zoom = getCurrentZoom();
     if (zoom < MIN_ZOOM_FOR_FETCH) {
-        updateLastUpdate('Zoom in to update');
-        logApi(`Skipped: zoom ${zoom} < ${MIN_ZOOM_FOR_FETCH}`, 'skipped');
+        closeStream();
+        updateLastUpdate('Zoom in for live buses');
+        if (config.clusters_enabled) await updateClusters(zoom);
         return;
     }
+    clearClusters();
 
     const qBounds = getQuantizedBounds(map, config);
     const boundsKey = getBoundsKey(qBounds);
     const now = Date.now();
     const ttl = zoom >= config.realtime_zoom_threshold ? config.realtime_cache_ttl_ms : config.cache_ttl_ms;
 
+    if (!force && canStream(config)) {
+        startStream(config, qBounds, boundsKey);
+        return;
+    }
+
     if (!force && lastFetch.key === boundsKey && (now - lastFetch.time) < ttl) {
         logApi(`Cache hit (${Math.round((now - lastFetch.time) / 1000)}s old)`, 'skipped');
         return;
@@ -75,10 +191,14 @@ const updateBuses = async (config, force = false) => {
             east: qBounds.east.toFixed(6),
             north: qBounds.north.toFixed(6)
         });
+        const isDelta = !force && lastVersion.key === boundsKey && lastVersion.version !== null;
+        if (isDelta) {
+            params.set('since', lastVersion.version);
+        }
 
         logApi(`→ Request viewport`, 'request');
         const start = Date.now();
-        const headers = {};
+        const headers = { 'Accept': BUSES_ACCEPT };
         const token = getSessionToken();
         if (token) {
             headers['X-Session-Token'] = token;
@@ -97,29 +217,55 @@ const updateBuses = async (config, force = false) => {
             }
         }
 
+        if (response.status === 503) {
+            // Upstream is down and there is nothing recent enough to serve;
+            // keep what's on the map and let the next refresh try again.
+            const data = await response.json();
+            logApi(`Bus data unavailable, retry in ${data.retry_after}s`, 'skipped');
+            showError('Bus data temporarily unavailable');
+            return;
+        }
+
         if (!response.ok) throw new Error(`HTTP ${response.status}`);
 
-        const data = await response.json();
+        const data = await readBuses(response);
 
-        if (data.rate_remaining !== null) {
-           document.getElementById('rate-remaining').textContent = `${data.rate_remaining}`;
-        }
+        // Counters ride in headers so the body stays cacheable (ETag/304).
+        const rateRemaining = response.headers.get('X-RateLimit-Remaining');
+        const capCount = response.headers.get('X-Cap-Count');
+        const capThreshold = response.headers.get('X-Cap-Threshold');
 
-        if (data.vehicles.length > 500 && data.vehicles.length < 1000) {
-            showInfoPopup(`Woah, cool! ${data.vehicles.length} buses!`, () => {});
+        if (rateRemaining !== null) {
+           document.getElementById('rate-remaining').textContent = `${rateRemaining}`;
         }
 
-        if (data.vehicles.length < 500 && scenicMode) { scenicMode = false; logApi("! Fast Refresh enabled")};
-        if (data.vehicles.length > 1000 && !scenicMode) { scenicMode = true; logApi("! Scenic Mode enabled (20s background refresh)")};
+        if (!data.delta) {
+            if (data.vehicles.length > 500 && data.vehicles.length < 1000) {
+                showInfoPopup(`Woah, cool! ${data.vehicles.length} buses!`, () => {});
+            }
+
+            if (data.vehicles.length < 500 && scenicMode) { scenicMode = false; logApi("! Fast Refresh enabled")};
+            if (data.vehicles.length > 1000 && !scenicMode) { scenicMode = true; logApi("! Scenic Mode enabled (20s background refresh)")};
+        }
 
         const elapsed = Date.now() - start;
         lastFetch = { time: Date.now(), key: boundsKey };
+        lastVersion = { key: boundsKey, version: data.version ?? null };
 
         renderVehicles(data.vehicles, map.getBounds());
+        if (data.delta) {
+            removeVehicles(data.removed);
+        }
 
-        updateLastUpdate(`Updated ${new Date().toLocaleTimeString()}`);
-        const capInfo = data.cap_threshold ? ` [srv:${data.vehicle_count}/${data.cap_threshold}]` : '';
-        logApi(`← ${data.vehicles.length} vehicles${capInfo} (${elapsed}ms)`, 'response');
+        // Served from an older copy while the server couldn't refresh it.
+        const dataAge = response.headers.get('X-Data-Age');
+        const staleInfo = response.headers.get('X-Data-Stale') ? ` (data ${Math.round(dataAge / 60)} min old)` : '';
+        updateLastUpdate(`Updated ${new Date().toLocaleTimeString()}${staleInfo}`);
+        const capInfo = capThreshold ? ` [srv:${capCount}/${capThreshold}]` : '';
+        const summary = data.delta
+            ? `Δ ${data.vehicles.length} changed, ${data.removed.length} removed`
+            : `${data.vehicles.length} vehicles`;
+        logApi(`← ${summary}${capInfo} (${elapsed}ms)`, 'response');
     } catch (error) {
         console.error('Error:', error);
         showError(`Failed to load: ${error.message}`);
@@ -287,6 +433,7 @@ export const init = (config) => {
     document.addEventListener('visibilitychange', () => {
         if (document.hidden) {
             stopAutoRefresh();
+            closeStream();
         } else {
             updateBuses(config);
             startAutoRefresh(config);
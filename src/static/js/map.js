@@ -1,10 +1,14 @@
-import { OPERATOR_COLORS, DEFAULT_OPERATOR_COLOR, ICON_SIZE, ICON_ANCHOR, BUS_ICON } from './config.js';
+import {
+    OPERATOR_COLORS, DEFAULT_OPERATOR_COLOR, ICON_SIZE, ICON_ANCHOR, BUS_ICON,
+    DEAD_RECKONING_INTERVAL_MS, DEAD_RECKONING_MAX_MS
+} from './config.js';
 import { escapeHtml } from './ui.js';
-import { getRoute, animateAlongRoute } from './routing.js';
+import { getRoutes, animateAlongRoute } from './routing.js';
 
 let config = null;
 let map = null;
 let busMarkers = null;
+let clusterLayer = null;
 let currentZoom = 0;
 let currentBounds = null;
 
@@ -59,9 +63,13 @@ export const initMap = (cfg) => {
 
     map.addLayer(busMarkers);
 
+    clusterLayer = L.layerGroup().addTo(map);
+
     setCurrentZoom(Math.floor(map.getZoom()));
     setCurrentBounds(map.getBounds());
 
+    setInterval(deadReckon, DEAD_RECKONING_INTERVAL_MS);
+
     return map;
 };
 
@@ -89,9 +97,34 @@ const formatPopup = (v) => `
     <div class="popup-dest">→ ${escapeHtml(formatDestination(v.destination))}</div>
     <div class="popup-details">
         Vehicle: ${escapeHtml(v.vehicle_id)}<br>
-        Updated: ${new Date(v.timestamp).toLocaleTimeString()}
+        ${v.speed != null ? `Speed: ${Math.round(v.speed * 3.6)} km/h<br>` : ''}
+        Updated: ${new Date(v.recorded_at || v.timestamp).toLocaleTimeString()}
     </div>`;
 
+// Between refreshes, move idle markers on from their last report along the
+// speed and heading the server derived for them. Capped, so a bus that has
+// stopped reporting drifts a bounded distance rather than indefinitely.
+const METRES_PER_DEGREE = 111320;
+
+const deadReckon = () => {
+    if (document.hidden) return;
+    const now = Date.now();
+    for (const [id, marker] of visibleMarkers) {
+        const v = vehicleData.get(id);
+        if (!v || !v.speed || v.heading == null || animatingIds.has(id) || marker._animationPaused) continue;
+
+        const elapsed = Math.min(now - Date.parse(v.recorded_at || v.timestamp), DEAD_RECKONING_MAX_MS);
+        if (!(elapsed > 0)) continue;
+
+        const metres = v.speed * elapsed / 1000;
+        const radians = v.heading * Math.PI / 180;
+        const lat = v.latitude + metres * Math.cos(radians) / METRES_PER_DEGREE;
+        const lng = v.longitude + metres * Math.sin(radians) /
+            (METRES_PER_DEGREE * Math.cos(v.latitude * Math.PI / 180));
+        marker.setLatLng([lat, lng]);
+    }
+};
+
 export const isAnimating = () => {
     return animatingIds.size > 0;
 };
@@ -99,8 +132,10 @@ export const isAnimating = () => {
 export const renderVehicles = async (vehicles, bounds) => {
     try {
         const updatedIds = new Set();
-        // Technically dont need vehicleData now - marker used
+        const routedMoves = [];
+        const previous = new Map();
         for (const v of vehicles) {
+            previous.set(v.vehicle_id, vehicleData.get(v.vehicle_id));
             vehicleData.set(v.vehicle_id, v);
             updatedIds.add(v.vehicle_id);
         }
@@ -114,8 +149,12 @@ export const renderVehicles = async (vehicles, bounds) => {
                 if (marker) {
                     const pos = marker.getLatLng()
 
+                    // Compare reports rather than the marker, which dead
+                    // reckoning may have carried past an unchanged report.
                     // 0.0001 degrees is about 10 metres;
-                    const moved = Math.abs(pos.lat - v.latitude) > 0.0001 || Math.abs(pos.lng - v.longitude) > 0.0001;
+                    const last = previous.get(id);
+                    const from = last ? { lat: last.latitude, lng: last.longitude } : pos;
+                    const moved = Math.abs(from.lat - v.latitude) > 0.0001 || Math.abs(from.lng - v.longitude) > 0.0001;
                     if (moved) {
                         const now = Date.now();
                         const lastTime = lastUpdateTime.get(id);
@@ -134,14 +173,8 @@ export const renderVehicles = async (vehicles, bounds) => {
                         animatingIds.add(id);
 
                         if (useRouting) {
-                            const route = await getRoute(pos, [v.latitude, v.longitude]);
-                            if (route && route.coords?.length > 1) {
-                                const routedAnimDuration = Math.max(duration, route.duration);
-                                animateAlongRoute(marker, route.coords, routedAnimDuration, () => { animatingIds.delete(id); });
-                            } else {
-                                const straightLine = [[pos.lng, pos.lat], [v.longitude, v.latitude]];
-                                animateAlongRoute(marker, straightLine, duration, () => animatingIds.delete(id));
-                            }
+                            // Resolved together once every vehicle has been seen
+                            routedMoves.push({ id, marker, duration, from: pos, to: [v.latitude, v.longitude] });
                         } else {
                             const straightLine = [[pos.lng, pos.lat], [v.longitude, v.latitude]];
                             animateAlongRoute(marker, straightLine, duration, () => animatingIds.delete(id));
@@ -180,6 +213,18 @@ export const renderVehicles = async (vehicles, bounds) => {
             }
         }
 
+        const routes = await getRoutes(routedMoves);
+        routedMoves.forEach(({ id, marker, duration, from, to }, i) => {
+            const route = routes[i];
+            if (route && route.coords?.length > 1) {
+                const routedAnimDuration = Math.max(duration, route.duration);
+                animateAlongRoute(marker, route.coords, routedAnimDuration, () => { animatingIds.delete(id); });
+            } else {
+                const straightLine = [[from.lng, from.lat], [to[1], to[0]]];
+                animateAlongRoute(marker, straightLine, duration, () => animatingIds.delete(id));
+            }
+        });
+
         for (const [id, marker] of visibleMarkers) {
             if (!bounds.contains(marker.getLatLng()) && !animatingIds.has(id)) {
                 busMarkers.removeLayer(marker);
@@ -192,3 +237,58 @@ export const renderVehicles = async (vehicles, bounds) => {
 
     document.getElementById('stats').textContent = visibleMarkers.size;
 };
+
+export const getVehicleIds = () => [...vehicleData.keys()];
+
+export const removeVehicles = (ids) => {
+    for (const id of ids) {
+        const marker = visibleMarkers.get(id);
+        if (marker) {
+            busMarkers.removeLayer(marker);
+            visibleMarkers.delete(id);
+        }
+        vehicleData.delete(id);
+        lastUpdateTime.delete(id);
+    }
+
+    document.getElementById('stats').textContent = visibleMarkers.size;
+};
+
+const clusterSizeClass = (count) => {
+    if (count < 10) return 'marker-cluster-small';
+    if (count < 100) return 'marker-cluster-medium';
+    return 'marker-cluster-large';
+};
+
+const formatClusterPopup = (c) => {
+    const lines = c.lines.map(([line, n]) => `${escapeHtml(line)} (${n})`).join(', ');
+    const operators = c.operators.map(([op, n]) => `${escapeHtml(op)} (${n})`).join(', ');
+    return `
+    <div class="popup-header">
+        <span class="popup-line">${c.count} buses</span>
+    </div>
+    <div class="popup-details">
+        Lines: ${lines}<br>
+        Operators: ${operators}
+    </div>`;
+};
+
+// Server-side aggregates for views too wide to fetch vehicles for. Styled
+// with markercluster's own classes so they match client-side clusters.
+export const renderClusters = (clusters) => {
+    clusterLayer.clearLayers();
+    for (const c of clusters) {
+        const icon = L.divIcon({
+            className: `marker-cluster ${clusterSizeClass(c.count)}`,
+            html: `<div><span>${c.count}</span></div>`,
+            iconSize: [40, 40]
+        });
+        L.marker([c.latitude, c.longitude], { icon })
+            .bindPopup(formatClusterPopup(c))
+            .addTo(clusterLayer);
+    }
+};
+
+export const clearClusters = () => {
+    clusterLayer?.clearLayers();
+};
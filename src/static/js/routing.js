@@ -5,6 +5,18 @@ export const initRouting = (cfg) => {
     config = cfg;
 };
 
+const toRoute = (data) => {
+    if (data?.code === 'Ok' && data.routes?.[0]?.geometry?.coordinates) {
+        return {
+            coords: data.routes[0].geometry.coordinates,
+            duration: data.routes[0].duration * 1000,
+            distance: data.routes[0].distance,
+            roadName: data.waypoints?.[1]?.name || null
+        };
+    }
+    return null;
+};
+
 export const getRoute = async (from, to) => {
     if (!config?.osrm_url) return null;
 
@@ -12,20 +24,46 @@ export const getRoute = async (from, to) => {
         const start = `${from.lng},${from.lat}`;
         const end = `${to[1]},${to[0]}`;
         const resp = await fetch(`/api/route?start=${start}&end=${end}`);
-        const data = await resp.json();
+        return toRoute(await resp.json());
+    } catch (e) {
+        console.warn('Routing failed:', e);
+    }
+    return null;
+};
 
-        if (data.code === 'Ok' && data.routes?.[0]?.geometry?.coordinates) {
-            return {
-                coords: data.routes[0].geometry.coordinates,
-                duration: data.routes[0].duration * 1000,
-                distance: data.routes[0].distance,
-                roadName: data.waypoints?.[1]?.name || null
-            };
+const postRoutes = async (legs) => {
+    try {
+        const resp = await fetch('/api/routes', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                legs: legs.map(({ from, to }) => ({
+                    start: `${from.lng},${from.lat}`,
+                    end: `${to[1]},${to[0]}`
+                }))
+            })
+        });
+        const data = await resp.json();
+        if (Array.isArray(data.routes)) {
+            return data.routes.map(toRoute);
         }
     } catch (e) {
         console.warn('Routing failed:', e);
     }
-    return null;
+    return legs.map(() => null);
+};
+
+// As few requests as the server's per-request leg limit allows; results
+// line up with `legs`, null where no route was found.
+export const getRoutes = async (legs) => {
+    if (!config?.osrm_url || legs.length === 0) return legs.map(() => null);
+
+    const size = config.route_batch_max_legs || 200;
+    const batches = [];
+    for (let i = 0; i < legs.length; i += size) {
+        batches.push(postRoutes(legs.slice(i, i + size)));
+    }
+    return (await Promise.all(batches)).flat();
 };
 
 export const animateAlongRoute = (marker, coords, duration, onComplete) => {
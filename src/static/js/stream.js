@@ -0,0 +1,60 @@
+let source = null;
+let sourceKey = null;
+
+export const isStreamSupported = () => typeof EventSource !== 'undefined';
+
+export const isStreamOpen = (key) => source !== null && sourceKey === key && source.readyState !== EventSource.CLOSED;
+
+export const closeStream = () => {
+    if (source) {
+        source.close();
+        source = null;
+        sourceKey = null;
+    }
+};
+
+export const openStream = (bounds, key, token, handlers) => {
+    closeStream();
+
+    const params = new URLSearchParams({
+        west: bounds.west.toFixed(6),
+        south: bounds.south.toFixed(6),
+        east: bounds.east.toFixed(6),
+        north: bounds.north.toFixed(6)
+    });
+    // EventSource can't send headers, so the session token goes in the URL.
+    if (token) {
+        params.set('token', token);
+    }
+
+    const stream = new EventSource(`/api/buses/stream?${params}`);
+    source = stream;
+    sourceKey = key;
+
+    stream.addEventListener('snapshot', (e) => handlers.onData(JSON.parse(e.data)));
+    stream.addEventListener('delta', (e) => handlers.onData(JSON.parse(e.data)));
+
+    stream.addEventListener('cap_required', (e) => {
+        closeStream();
+        handlers.onCapRequired(JSON.parse(e.data));
+    });
+
+    stream.addEventListener('rate_limited', (e) => {
+        closeStream();
+        handlers.onRateLimited(JSON.parse(e.data));
+    });
+
+    stream.addEventListener('unavailable', (e) => {
+        closeStream();
+        handlers.onUnavailable(JSON.parse(e.data));
+    });
+
+    // Dropped connections reconnect on their own (resuming from the last
+    // event id); CLOSED means the server refused us outright.
+    stream.onerror = () => {
+        if (stream.readyState === EventSource.CLOSED && source === stream) {
+            closeStream();
+            handlers.onClosed();
+        }
+    };
+};
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import json
+import logging
+import time
+from typing import TYPE_CHECKING, Iterator
+
+from .captcha import RateLimitExceeded
+from .upstream import UpstreamUnavailable
+
+if TYPE_CHECKING:
+    from .captcha import CaptchaManager, RateLimiter
+    from .config import Config
+    from .tiles import BoundingBox
+    from .tracker import BusTracker
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 15
+# Refresh just after the cache entry expires rather than right on the edge.
+REFRESH_SLACK_SECONDS = 0.5
+
+
+def sse_event(event: str, payload: dict, event_id: int | None = None) -> str:
+    lines = [f"event: {event}"]
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"data: {json.dumps(payload, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
+
+
+def vehicle_stream(
+    tracker: BusTracker,
+    config: Config,
+    bounds: BoundingBox,
+    since: int | None,
+    rate_limiter: RateLimiter | None,
+    captcha: CaptchaManager,
+    session_token: str | None,
+) -> Iterator[str]:
+    # Clients reconnect on their own, so a stream is only held for
+    # stream_max_seconds before we let it go.
+    started = time.monotonic()
+    refresh_every = max(1, config.cache_ttl_seconds) + REFRESH_SLACK_SECONDS
+    next_refresh = started + refresh_every
+
+    delta = tracker.get_changes(bounds, since) if since is not None else None
+    version = -1
+    last_sent = 0.0
+
+    while time.monotonic() - started < config.stream_max_seconds:
+        if delta is None:
+            # First event, or we fell behind the change log: send everything.
+            try:
+                view = tracker.get_view(bounds, rate_limiter=rate_limiter, captcha=captcha)
+            except RateLimitExceeded:
+                yield sse_event("rate_limited", {"retry_after": 3600})
+                return
+            except UpstreamUnavailable as e:
+                yield sse_event("unavailable", {"retry_after": max(1, round(e.retry_after))})
+                return
+            version = view.version
+            yield sse_event(
+                "snapshot",
+                {"version": version, "vehicles": [v.to_dict() for v in view.vehicles]},
+                version,
+            )
+            last_sent = time.monotonic()
+        elif delta.vehicles or delta.removed or version < 0:
+            version = delta.version
+            # Polling fetches nothing per client, so Cap counts what is
+            # delivered; tile fetches below are counted as they happen.
+            if tracker.polling:
+                captcha.add_vehicles(len(delta.vehicles))
+            yield sse_event("delta", _delta_payload(delta), version)
+            last_sent = time.monotonic()
+        else:
+            version = delta.version
+            if time.monotonic() - last_sent >= KEEPALIVE_SECONDS:
+                yield ": keepalive\n\n"
+                last_sent = time.monotonic()
+
+        if tracker.polling:
+            wait = KEEPALIVE_SECONDS
+        else:
+            wait = max(0.0, min(KEEPALIVE_SECONDS, next_refresh - time.monotonic()))
+        tracker.registry.wait_for_change(version, wait)
+
+        if captcha.enabled and not captcha.validate_token(session_token):
+            yield sse_event("cap_required", {"reason": "session"})
+            return
+        if captcha.check_required():
+            captcha.invalidate_token(session_token)
+            yield sse_event("cap_required", {"reason": "usage"})
+            return
+
+        # Nobody else may be asking for these tiles, so keep them fresh
+        # ourselves; the tracker coalesces this with any concurrent fetch.
+        if not tracker.polling and time.monotonic() >= next_refresh:
+            next_refresh = time.monotonic() + refresh_every
+            try:
+                tracker.get_view(bounds, rate_limiter=rate_limiter, captcha=captcha)
+            except RateLimitExceeded:
+                yield sse_event("rate_limited", {"retry_after": 3600})
+                return
+            except UpstreamUnavailable:
+                # What we last sent stays current until upstream is back.
+                pass
+
+        delta = tracker.get_changes(bounds, version)
+
+
+def _delta_payload(delta) -> dict:
+    return {
+        "version": delta.version,
+        "delta": True,
+        "vehicles": [v.to_dict() for v in delta.vehicles],
+        "removed": delta.removed,
+    }
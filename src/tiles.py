@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import math
+
+Tile = tuple[int, int]
+BoundingBox = tuple[float, float, float, float]
+
+# Client bounds are multiples of the tile size, which rarely divide exactly
+# in floating point (51.5 / 0.01 == 5149.999...).
+_EPSILON = 1e-9
+
+
+def tile_of(longitude: float, latitude: float, size: float) -> Tile:
+    return (math.floor(longitude / size + _EPSILON), math.floor(latitude / size + _EPSILON))
+
+
+def tile_range(bounding_box: BoundingBox, size: float) -> tuple[int, int, int, int]:
+    west, south, east, north = bounding_box
+    x0, y0 = tile_of(west, south, size)
+    x1 = max(x0, math.ceil(east / size - _EPSILON) - 1)
+    y1 = max(y0, math.ceil(north / size - _EPSILON) - 1)
+    return x0, y0, x1, y1
+
+
+def tile_count(bounding_box: BoundingBox, size: float) -> int:
+    x0, y0, x1, y1 = tile_range(bounding_box, size)
+    return (x1 - x0 + 1) * (y1 - y0 + 1)
+
+
+def tiles_for(bounding_box: BoundingBox, size: float) -> list[Tile]:
+    x0, y0, x1, y1 = tile_range(bounding_box, size)
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+
+def tiles_bbox(tiles: list[Tile], size: float) -> BoundingBox:
+    xs = [x for x, _ in tiles]
+    ys = [y for _, y in tiles]
+    return (
+        round(min(xs) * size, 6),
+        round(min(ys) * size, 6),
+        round((max(xs) + 1) * size, 6),
+        round((max(ys) + 1) * size, 6),
+    )
+
+
+def contains(bounding_box: BoundingBox, longitude: float, latitude: float) -> bool:
+    west, south, east, north = bounding_box
+    return west <= longitude <= east and south <= latitude <= north
+
+
+EARTH_RADIUS_METRES = 6_371_000
+
+
+def distance_metres(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    # Equirectangular approximation; well within GPS noise over the few
+    # hundred metres between consecutive sightings.
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return math.hypot(x, y) * EARTH_RADIUS_METRES
+
+
+def bearing_degrees(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    x = math.radians(lon2 - lon1) * math.cos(math.radians((lat1 + lat2) / 2))
+    y = math.radians(lat2 - lat1)
+    return math.degrees(math.atan2(x, y)) % 360
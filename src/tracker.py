@@ -1,134 +1,587 @@
 from __future__ import annotations
 
+import atexit
 import logging
 import threading
-from datetime import datetime, timezone
-from typing import TYPE_CHECKING
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Callable
 
-import defusedxml.ElementTree as ET
 import requests
 
-from .config import BBOX_CACHE_KEY_PRECISION, Config
-from .models import CacheEntry, Vehicle
+from .clusters import ClusterIndex
+from .columns import VehicleColumns
+from .config import Config
+from .history import HistoryStore
+from .lines import Filters, LineIndex
+from .metrics import (
+    CACHE_EVICTIONS, CACHE_LOOKUPS, PARSE_SECONDS, PREFETCHED_TILES, UPSTREAM_BYTES, UPSTREAM_ERRORS,
+    UPSTREAM_SECONDS,
+)
+from .models import CacheEntry, Snapshot, Vehicle, VehicleView
+from .persist import SavedGroup, SnapshotWriter, read_snapshots, worker_path, write_snapshot
+from .poller import RegionPoller, TilePrefetcher
+from .registry import Delta, VehicleRegistry
+from .siri import ResponseStream, SiriParseError, parse_siri_vm
+from .state import StateBackend, decode_vehicles, encode_vehicles, make_backend
+from .tiles import BoundingBox, Tile, tile_count, tile_of, tiles_bbox, tiles_for
+from .upstream import CircuitBreaker, UpstreamUnavailable, make_session
 
 if TYPE_CHECKING:
-    from xml.etree.ElementTree import Element
+    from .captcha import RateLimiter
 
 logger = logging.getLogger(__name__)
 
+# How often a worker checks whether tiles claimed by another have landed.
+SHARED_POLL_SECONDS = 0.1
+# Threads refreshing stale tiles behind the responses that served them.
+REFRESH_WORKERS = 4
+# How often the prefetcher looks for tiles about to expire, and the side of
+# the square blocks of tiles it refreshes with one upstream request.
+PREFETCH_INTERVAL_SECONDS = 1
+PREFETCH_BLOCK_TILES = 4
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.tiles: dict[Tile, CacheEntry] | None = None
+        self.error: Exception | None = None
 
-class BusTracker:
-    SIRI_NS = {"siri": "http://www.siri.org.uk/siri"}
 
-    def __init__(self, api_key: str, config: Config | None = None):
+class BusTracker:
+    def __init__(self, api_key: str, config: Config | None = None, state: StateBackend | None = None):
         self.api_key = api_key
         self.config = config or Config()
-        self._cache: dict[str, CacheEntry] = {}
+        # Second-level tile cache and cross-process fetch claims when the
+        # backend is shared; the in-process OrderedDict stays the first level.
+        self.state = state or make_backend(self.config)
+        self._cache: OrderedDict[Tile, CacheEntry] = OrderedDict()
+        self._inflight: dict[Tile, _Flight] = {}
         self._lock = threading.Lock()
-        self._session = requests.Session()
-        self._session.headers.update({
-            "User-Agent": "BusTracker/0.8 (+https://adamjames.me; contact: adam@<domain>)"
-        })
+        self._snapshot: Snapshot | None = None
+        self.registry = VehicleRegistry(
+            self.config.tile_size_degrees,
+            self.config.registry_max_age_seconds,
+            self.config.delta_log_max_entries,
+        )
+        # Without POLL_REGION the registry only knows recently viewed tiles,
+        # which makes for a mostly empty overview.
+        self.clusters = ClusterIndex(
+            self.config.cluster_index_min_zoom,
+            self.config.cluster_index_max_zoom,
+            self.config.cluster_radius,
+        ) if self.config.poll_region is not None else None
+        if self.clusters is not None:
+            self.registry.add_listener(self.clusters)
+        self.lines = LineIndex()
+        self.registry.add_listener(self.lines)
+        self.history = HistoryStore(
+            self.config.history_path,
+            self.config.history_partition_seconds,
+            self.config.history_retention_seconds,
+        ) if self.config.history_path else None
+        if self.history is not None:
+            self.registry.add_listener(self.history)
+        self._poller: RegionPoller | None = None
+        self._prefetcher: TilePrefetcher | None = None
+        self._writer: SnapshotWriter | None = None
+        self._session = make_session(self.config.upstream_pool_size)
+        self.breaker = CircuitBreaker(
+            "bods",
+            self.config.upstream_failure_threshold,
+            self.config.upstream_backoff_seconds,
+            self.config.upstream_backoff_max_seconds,
+        )
+        self._refresher = ThreadPoolExecutor(REFRESH_WORKERS, thread_name_prefix="tile-refresh")
 
     def get_stats(self) -> dict:
         with self._lock:
-            return {
+            stats = {
                 "cache_entries": len(self._cache),
-                "cache_max": self.config.cache_max_entries,
+                "cache_max_tiles": self.config.cache_max_tiles,
             }
+        stats.update(self.breaker.get_stats())
+        stats["tracked_vehicles"] = len(self.registry)
+        stats["tracked_lines"] = len(self.lines)
+        stats["version"] = self.registry.version
+        snapshot = self._snapshot
+        if self._poller is not None:
+            stats["snapshot_vehicles"] = len(snapshot.vehicles) if snapshot else 0
+            stats["snapshot_age_seconds"] = round(snapshot.age_seconds(), 1) if snapshot else None
+        return stats
+
+    @property
+    def polling(self) -> bool:
+        return self._poller is not None
+
+    @property
+    def fresh_seconds(self) -> float:
+        # How old served data may be before it counts as stale.
+        return self.config.poll_interval_seconds * 2 if self.polling else self.config.cache_ttl_seconds
+
+    def start_poller(self, rate_limiter: RateLimiter | None = None) -> None:
+        if self._poller is not None or self.config.poll_region is None:
+            return
+        self._poller = RegionPoller(
+            self, self.config.poll_region, self.config.poll_interval_seconds, rate_limiter
+        )
+        # A snapshot restored from disk counts as the latest poll.
+        snapshot = self._snapshot
+        delay = self.config.poll_interval_seconds - snapshot.age_seconds() if snapshot else 0.0
+        self._poller.start(max(0.0, delay))
+
+    def start_prefetch(self, budget: RateLimiter, rate_limiter: RateLimiter | None = None) -> None:
+        # Polling serves everything from one snapshot, so there are no tiles to warm.
+        if self._prefetcher is not None or self.config.poll_region is not None:
+            return
+        self._prefetcher = TilePrefetcher(self, PREFETCH_INTERVAL_SECONDS, budget, rate_limiter)
+        self._prefetcher.start(PREFETCH_INTERVAL_SECONDS)
+
+    def stop_prefetch(self) -> None:
+        if self._prefetcher is not None:
+            self._prefetcher.stop()
+            self._prefetcher = None
 
-    def _make_cache_key(self, bbox: tuple[float, float, float, float]) -> str:
-        return ",".join(f"{x:.{BBOX_CACHE_KEY_PRECISION}f}" for x in bbox)
+    def stop_poller(self) -> None:
+        if self._poller is not None:
+            self._poller.stop()
+            self._poller = None
 
-    def _evict_if_needed(self) -> None:
-        while len(self._cache) > self.config.cache_max_entries:
-            oldest_key = min(self._cache, key=lambda k: self._cache[k].timestamp)
-            del self._cache[oldest_key]
+    def publish_snapshot(self, area: BoundingBox, vehicles: list[Vehicle], timestamp: datetime | None = None) -> None:
+        version = self.registry.ingest(area, vehicles)
+        # Snapshots are immutable, so readers never need the lock - they just
+        # pick up whichever reference was current when they asked.
+        self._snapshot = Snapshot(timestamp or datetime.now(timezone.utc), VehicleColumns(vehicles), version)
 
-    def get_bus_data(self, bounding_box: tuple[float, float, float, float], rate_limiter=None, captcha=None) -> list[dict]:
-        cache_key = self._make_cache_key(bounding_box)
+    def start_snapshots(self) -> None:
+        path = self.config.snapshot_path
+        if self._writer is not None or not path:
+            return
+        self.restore_state(path)
+        self._writer = SnapshotWriter(self, path, self.config.snapshot_interval_seconds)
+        self._writer.start(self.config.snapshot_interval_seconds)
+        atexit.register(self.save_state, path)
 
+    def save_state(self, path: str) -> None:
         with self._lock:
-            entry = self._cache.get(cache_key)
-            if entry and entry.is_fresh(self.config.cache_ttl_seconds):
-                return [v.to_dict() for v in entry.vehicles]
+            groups = [SavedGroup(tile, None, entry.timestamp, entry.vehicles) for tile, entry in self._cache.items()]
+        snapshot = self._snapshot
+        if snapshot is not None and self.config.poll_region is not None:
+            groups.append(SavedGroup(None, self.config.poll_region, snapshot.timestamp, list(snapshot.vehicles)))
+        try:
+            count = write_snapshot(worker_path(path), self.config.tile_size_degrees, groups)
+            logger.debug(f"Saved {count} vehicles to {worker_path(path)}")
+        except OSError as e:
+            logger.error(f"Could not save snapshot to {worker_path(path)}: {e}")
 
-        vehicles = self._fetch_vehicles(bounding_box, rate_limiter)
+    def restore_state(self, path: str) -> None:
+        # Only what is still within TTL comes back; anything older would be
+        # refetched on first use anyway.
+        ttl = self.config.cache_ttl_seconds
+        oldest = datetime.now(timezone.utc) - timedelta(seconds=max(ttl, self.config.poll_interval_seconds))
+        groups = read_snapshots(path, self.config.tile_size_degrees, oldest)
 
-        if captcha:
-            captcha.add_vehicles(len(vehicles))
+        size = self.config.tile_size_degrees
+        tiles = 0
+        for group in groups:
+            entry = CacheEntry(group.fetched_at, group.vehicles)
+            if group.tile is not None and entry.is_fresh(ttl):
+                entry.version = self.registry.ingest(tiles_bbox([group.tile], size), group.vehicles)
+                with self._lock:
+                    self._store_tile(group.tile, entry)
+                tiles += 1
+            elif group.area is not None and group.area == self.config.poll_region:
+                if entry.is_fresh(self.config.poll_interval_seconds):
+                    self.publish_snapshot(group.area, group.vehicles, group.fetched_at)
+        if groups:
+            logger.info(f"Restored {tiles} tiles from {path}" + (" and the region snapshot" if self._snapshot else ""))
+
+    def get_changes(
+        self, bounding_box: BoundingBox, since: int, match: Callable[[Vehicle], bool] | None = None
+    ) -> Delta | None:
+        return self.registry.changes_since(since, bounding_box, match)
+
+    def get_clusters(self, zoom: int, bounding_box: BoundingBox) -> list[dict]:
+        # Served from the region poller's data; wide views never go upstream.
+        if self.clusters is None:
+            return []
+        return self.clusters.query(zoom, bounding_box)
+
+    def find_vehicles(self, filters: Filters, bounding_box: BoundingBox | None = None) -> list[Vehicle]:
+        # Everything the registry holds, so call get_view first for fresh data.
+        return self.lines.find(filters, bounding_box)
+
+    def get_lines(self, operator: str | None = None) -> list[dict]:
+        return self.lines.lines(operator)
+
+    def _store_tile(self, tile: Tile, entry: CacheEntry) -> None:
+        # Caller holds the lock. The OrderedDict runs least recently used
+        # first, so eviction is a popitem rather than a scan.
+        self._cache[tile] = entry
+        self._cache.move_to_end(tile)
+        while len(self._cache) > self.config.cache_max_tiles:
+            self._cache.popitem(last=False)
+            CACHE_EVICTIONS.inc("tiles")
+
+    def get_bus_data(self, bounding_box: BoundingBox, rate_limiter=None, captcha=None) -> list[dict]:
+        return [v.to_dict() for v in self.get_vehicles(bounding_box, rate_limiter, captcha)]
+
+    def get_vehicles(self, bounding_box: BoundingBox, rate_limiter=None, captcha=None) -> list[Vehicle]:
+        return self.get_view(bounding_box, rate_limiter, captcha).vehicles
+
+    def get_view(self, bounding_box: BoundingBox, rate_limiter=None, captcha=None) -> VehicleView:
+        if self.polling:
+            snapshot = self._snapshot
+            if snapshot is None:
+                return VehicleView(bounding_box, None, [])
+            view = VehicleView(
+                bounding_box, (bounding_box, snapshot.timestamp), [snapshot.vehicles], snapshot.version,
+                snapshot.timestamp,
+            )
+            # Nothing is fetched per request here, so Cap counts what is served.
+            if captcha:
+                captcha.add_vehicles(len(view.vehicles))
+            return view
+
+        size = self.config.tile_size_degrees
+        if tile_count(bounding_box, size) > self.config.cache_max_tiles_per_request:
+            # Too wide to be worth tiling; go straight to upstream uncached.
+            vehicles = self._fetch_vehicles(bounding_box, rate_limiter)
+            version = self.registry.ingest(bounding_box, vehicles)
+            if captcha:
+                captcha.add_vehicles(len(vehicles))
+            return VehicleView(bounding_box, None, [vehicles], version, datetime.now(timezone.utc))
+
+        tiles = tiles_for(bounding_box, size)
+        ttl = self.config.cache_ttl_seconds
+        stale_ttl = ttl + self.config.cache_stale_grace_seconds
+
+        found: dict[Tile, CacheEntry] = {}
+        waiting: list[tuple[Tile, _Flight, CacheEntry | None]] = []
+        claimed: list[Tile] = []
+        # Entries past the stale grace, kept in case upstream is down.
+        expired: dict[Tile, CacheEntry] = {}
+        stale: list[Tile] = []
+        flight: _Flight | None = None
+        refresh: _Flight | None = None
 
         with self._lock:
-            self._cache[cache_key] = CacheEntry(datetime.now(timezone.utc), vehicles)
-            self._evict_if_needed()
+            for tile in tiles:
+                entry = self._cache.get(tile)
+                if entry and entry.is_fresh(ttl):
+                    self._cache.move_to_end(tile)
+                    entry.hits += 1
+                    found[tile] = entry
+                    CACHE_LOOKUPS.inc("tiles", "hit")
+                    continue
 
-        return [v.to_dict() for v in vehicles]
+                other = self._inflight.get(tile)
+                if entry and entry.is_fresh(stale_ttl):
+                    # Serve what we had and refresh it behind this response,
+                    # unless someone already is or upstream is known to be down.
+                    self._cache.move_to_end(tile)
+                    entry.hits += 1
+                    found[tile] = entry
+                    CACHE_LOOKUPS.inc("tiles", "stale")
+                    if other is None and not self.breaker.open:
+                        stale.append(tile)
+                    continue
 
-    def _fetch_vehicles(self, bounding_box: tuple[float, float, float, float], rate_limiter=None) -> list[Vehicle]:
-        if rate_limiter and not rate_limiter.check():
-            from .captcha import RateLimitExceeded
-            raise RateLimitExceeded("Rate limit exceeded")
+                if other is not None:
+                    waiting.append((tile, other, entry))
+                    CACHE_LOOKUPS.inc("tiles", "wait")
+                    continue
 
-        url = f"{self.config.api_base}/datafeed"
-        params = {
-            "api_key": self.api_key,
-            "boundingBox": ",".join(str(x) for x in bounding_box),
-        }
+                if entry:
+                    expired[tile] = entry
+                claimed.append(tile)
+                CACHE_LOOKUPS.inc("tiles", "miss")
+
+            if claimed:
+                flight = _Flight()
+                for tile in claimed:
+                    self._inflight[tile] = flight
+            if stale:
+                refresh = _Flight()
+                for tile in stale:
+                    self._inflight[tile] = refresh
+
+        if refresh is not None:
+            self._refresher.submit(self._refresh_tiles, stale, refresh, rate_limiter, captcha)
 
+        if flight is not None:
+            try:
+                fetched = self._fetch_tiles(claimed, flight, rate_limiter)
+            except UpstreamUnavailable:
+                # While BODS is down an old entry still beats failing the whole
+                # view; its age marks the response stale. A tile we have
+                # nothing for at all would leave a hole, so that still fails.
+                if any(tile not in expired for tile in claimed):
+                    raise
+                found.update((tile, expired[tile]) for tile in claimed)
+            else:
+                found.update(fetched)
+                if captcha:
+                    captcha.add_vehicles(sum(len(e.vehicles) for e in fetched.values()))
+
+        for tile, other, entry in waiting:
+            try:
+                found_entry = self._wait_for_flight(tile, other, entry)
+            except UpstreamUnavailable:
+                if entry is None:
+                    raise
+                found_entry = entry
+            if found_entry is not None:
+                found[tile] = found_entry
+
+        if not found:
+            # Every tile was someone else's fetch, here or in another worker,
+            # and none of them landed in time.
+            raise UpstreamUnavailable("Timed out waiting for tiles being fetched", self.breaker.retry_after())
+
+        ordered = sorted(found.items())
+        key = (bounding_box, tuple((tile, entry.timestamp) for tile, entry in ordered))
+        return VehicleView(
+            bounding_box,
+            key,
+            [entry.vehicles for _, entry in ordered],
+            min(entry.version for _, entry in ordered),
+            min(entry.timestamp for _, entry in ordered),
+        )
+
+    def due_for_prefetch(self) -> list[list[Tile]]:
+        # Tiles served at least prefetch_min_hits times and within the last
+        # prefetch_lead of their TTL, grouped into blocks that each cost one
+        # upstream request, busiest block first.
+        ttl = self.config.cache_ttl_seconds
+        due_at = ttl * (1 - self.config.prefetch_lead)
+        now = datetime.now(timezone.utc)
+        blocks: dict[Tile, list[Tile]] = {}
+        demand: dict[Tile, int] = {}
+        with self._lock:
+            for tile, entry in self._cache.items():
+                if entry.hits < self.config.prefetch_min_hits or tile in self._inflight:
+                    continue
+                if (now - entry.timestamp).total_seconds() < due_at:
+                    continue
+                block = (tile[0] // PREFETCH_BLOCK_TILES, tile[1] // PREFETCH_BLOCK_TILES)
+                blocks.setdefault(block, []).append(tile)
+                demand[block] = demand.get(block, 0) + entry.hits
+        return [blocks[block] for block in sorted(blocks, key=demand.__getitem__, reverse=True)]
+
+    def prefetch_tiles(self, tiles: list[Tile], budget: RateLimiter, rate_limiter=None) -> bool:
+        # Claims the tiles now, so the next round doesn't pick them again,
+        # and fetches them on the refresh pool. The budget is only charged
+        # for a fetch that is submitted; False once it is spent.
+        with self._lock:
+            tiles = [tile for tile in tiles if tile not in self._inflight]
+            if not tiles:
+                return True
+            flight = _Flight()
+            for tile in tiles:
+                self._inflight[tile] = flight
+        if not budget.check():
+            # Anyone who joined the claim meanwhile keeps the entry they had.
+            with self._lock:
+                for tile in tiles:
+                    self._inflight.pop(tile, None)
+            flight.tiles = {}
+            flight.done.set()
+            PREFETCHED_TILES.inc("over_budget", amount=len(tiles))
+            return False
+        self._refresher.submit(self._prefetch, tiles, flight, rate_limiter)
+        return True
+
+    def _prefetch(self, tiles: list[Tile], flight: _Flight, rate_limiter=None) -> None:
+        # A copy another worker refreshed counts, but not the same soon-to-expire one.
+        fresh_seconds = self.config.cache_ttl_seconds * (1 - self.config.prefetch_lead)
         try:
-            response = self._session.get(
-                url, params=params, timeout=self.config.request_timeout
-            )
-            response.raise_for_status()
-            vehicles = self._parse_siri_vm(response.text)
-            logger.info(f"Fetched {len(vehicles)} vehicles")
-            return vehicles
-        except requests.Timeout:
-            logger.warning("API request timed out")
-            return []
-        except requests.RequestException as e:
-            logger.error(f"API request failed: {e}")
-            return []
+            fetched = self._fetch_tiles(tiles, flight, rate_limiter, fresh_seconds)
+        except Exception as e:
+            logger.warning(f"Prefetch of {len(tiles)} tiles failed: {e}")
+            return
+        PREFETCHED_TILES.inc("refreshed", amount=len(fetched))
 
-    def _parse_siri_vm(self, xml_content: str) -> list[Vehicle]:
+    def _refresh_tiles(self, tiles: list[Tile], flight: _Flight, rate_limiter=None, captcha=None) -> None:
         try:
-            root = ET.fromstring(xml_content)
-        except ET.ParseError as e:
-            logger.error(f"XML parse error: {e}")
-            return []
+            fetched = self._fetch_tiles(tiles, flight, rate_limiter)
+        except Exception as e:
+            # The stale entries stay in place and keep being served.
+            logger.warning(f"Background refresh of {len(tiles)} tiles failed: {e}")
+            return
+        if captcha:
+            captcha.add_vehicles(sum(len(e.vehicles) for e in fetched.values()))
 
-        return [
-            v
-            for activity in root.findall(".//siri:VehicleActivity", self.SIRI_NS)
-            if (v := self._parse_vehicle_activity(activity))
-        ]
+    def _fetch_tiles(
+        self, claimed: list[Tile], flight: _Flight, rate_limiter=None, shared_fresh_seconds: float | None = None
+    ) -> dict[Tile, CacheEntry]:
+        remote: list[Tile] = []
+        try:
+            tiles: dict[Tile, CacheEntry] = {}
+            missing = claimed
+            if self.state.shared:
+                tiles.update(self._load_shared_tiles(claimed, shared_fresh_seconds))
+                missing = [tile for tile in claimed if tile not in tiles]
+                missing, remote = self._claim_shared_tiles(missing)
+            if missing:
+                tiles.update(self._fetch_span(missing, rate_limiter))
+            if remote:
+                tiles.update(self._wait_for_shared_tiles(remote))
+            flight.tiles = tiles
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                for tile, entry in (flight.tiles or {}).items():
+                    self._store_tile(tile, entry)
+                for tile in claimed:
+                    self._inflight.pop(tile, None)
+            flight.done.set()
+
+        return {tile: flight.tiles[tile] for tile in claimed if tile in flight.tiles}
 
-    def _parse_vehicle_activity(self, activity: Element) -> Vehicle | None:
-        ns = self.SIRI_NS
+    def _fetch_span(self, tiles: list[Tile], rate_limiter=None) -> dict[Tile, CacheEntry]:
+        size = self.config.tile_size_degrees
+        # One upstream request for the rectangle spanning every claimed tile.
+        # Tiles inside it that we didn't claim get refreshed too, for free.
+        x0 = min(x for x, _ in tiles)
+        y0 = min(y for _, y in tiles)
+        x1 = max(x for x, _ in tiles)
+        y1 = max(y for _, y in tiles)
+        span = [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+        try:
+            area = tiles_bbox(tiles, size)
+            vehicles = self._fetch_vehicles(area, rate_limiter)
+            version = self.registry.ingest(area, vehicles)
+            now = datetime.now(timezone.utc)
+            by_tile: dict[Tile, list[Vehicle]] = {tile: [] for tile in span}
+            for v in vehicles:
+                bucket = by_tile.get(tile_of(v.longitude, v.latitude, size))
+                if bucket is not None:
+                    bucket.append(v)
 
-        vehicle_ref = activity.find(".//siri:VehicleRef", ns)
-        location = activity.find(".//siri:VehicleLocation", ns)
-        if vehicle_ref is None or location is None:
-            return None
+            if self.state.shared:
+                self.state.set_many(
+                    {self._tile_key(tile): encode_vehicles(now, vs) for tile, vs in by_tile.items()},
+                    self.config.cache_ttl_seconds + self.config.cache_stale_grace_seconds,
+                )
+        finally:
+            if self.state.shared:
+                for tile in tiles:
+                    self.state.delete(self._claim_key(tile))
+        return {tile: CacheEntry(now, vs, version) for tile, vs in by_tile.items()}
 
-        lat_elem = location.find("siri:Latitude", ns)
-        lon_elem = location.find("siri:Longitude", ns)
-        if not all(e is not None and e.text for e in (lat_elem, lon_elem)):
-            return None
+    def _tile_key(self, tile: Tile) -> str:
+        return f"tile:{self.config.tile_size_degrees}:{tile[0]}:{tile[1]}"
 
-        def get_text(xpath: str, default: str = "Unknown") -> str:
-            elem = activity.find(xpath, ns)
-            return elem.text if elem is not None and elem.text else default
+    def _claim_key(self, tile: Tile) -> str:
+        return f"claim:{self.config.tile_size_degrees}:{tile[0]}:{tile[1]}"
 
+    def _load_shared_tiles(self, tiles: list[Tile], fresh_seconds: float | None = None) -> dict[Tile, CacheEntry]:
+        # Another worker may have fetched these since our own copy went stale.
+        found: dict[Tile, CacheEntry] = {}
+        blobs = self.state.get_many([self._tile_key(tile) for tile in tiles])
+        for tile, blob in zip(tiles, blobs):
+            if blob is None:
+                continue
+            timestamp, vehicles = decode_vehicles(blob)
+            entry = CacheEntry(timestamp, vehicles)
+            if entry.is_fresh(self.config.cache_ttl_seconds if fresh_seconds is None else fresh_seconds):
+                found[tile] = entry
+        if found:
+            # One registry update for the lot, each tile only answering for
+            # its own area. Ingest swaps in copies carrying motion, so hand
+            # them back to the entries that will be cached.
+            size = self.config.tile_size_degrees
+            combined = [v for entry in found.values() for v in entry.vehicles]
+            version = self.registry.ingest([tiles_bbox([tile], size) for tile in found], combined)
+            start = 0
+            for entry in found.values():
+                end = start + len(entry.vehicles)
+                entry.vehicles = combined[start:end]
+                entry.version = version
+                start = end
+        CACHE_LOOKUPS.inc("shared_tiles", "hit", amount=len(found))
+        CACHE_LOOKUPS.inc("shared_tiles", "miss", amount=len(tiles) - len(found))
+        return found
+
+    def _claim_shared_tiles(self, tiles: list[Tile]) -> tuple[list[Tile], list[Tile]]:
+        # Per-tile claims extend single-flight across processes: tiles we win
+        # are fetched here, the rest are being fetched by someone else.
+        mine: list[Tile] = []
+        theirs: list[Tile] = []
+        ttl = self.config.request_timeout * 2
+        for tile in tiles:
+            (mine if self.state.add(self._claim_key(tile), b"1", ttl) else theirs).append(tile)
+        return mine, theirs
+
+    def _wait_for_shared_tiles(self, tiles: list[Tile]) -> dict[Tile, CacheEntry]:
+        deadline = time.monotonic() + self.config.request_timeout * 2
+        found: dict[Tile, CacheEntry] = {}
+        pending = list(tiles)
+        while pending and time.monotonic() < deadline:
+            time.sleep(SHARED_POLL_SECONDS)
+            found.update(self._load_shared_tiles(pending))
+            pending = [tile for tile in pending if tile not in found]
+        if pending:
+            logger.warning(f"Timed out waiting for {len(pending)} tiles fetched elsewhere")
+        return found
+
+    def _wait_for_flight(self, tile: Tile, flight: _Flight, entry: CacheEntry | None) -> CacheEntry | None:
+        # The leader's request is bounded by request_timeout; allow for the
+        # rate limiter check and parsing on top of that.
+        if not flight.done.wait(self.config.request_timeout * 2):
+            logger.warning("Timed out waiting for in-flight fetch")
+            return entry
+        if flight.error is not None:
+            raise flight.error
+        return flight.tiles.get(tile, entry)
+
+    def _fetch_vehicles(self, bounding_box: BoundingBox, rate_limiter=None) -> list[Vehicle]:
+        # Raises rather than returning nothing, so a failed fetch is never
+        # cached as an empty area.
+        if not self.breaker.allow(self.config.request_timeout):
+            raise UpstreamUnavailable("BODS unavailable, backing off", self.breaker.retry_after())
+        if rate_limiter and not rate_limiter.check():
+            from .captcha import RateLimitExceeded
+            # Hand back the probe, if that is what we were granted.
+            self.breaker.release()
+            raise RateLimitExceeded("Rate limit exceeded")
+
+        url = f"{self.config.api_base}/datafeed"
+        params = {
+            "api_key": self.api_key,
+            "boundingBox": ",".join(str(x) for x in bounding_box),
+        }
+
+        start = time.perf_counter()
         try:
-            return Vehicle(
-                vehicle_id=vehicle_ref.text or "Unknown",
-                latitude=float(lat_elem.text),
-                longitude=float(lon_elem.text),
-                line=get_text(".//siri:LineRef"),
-                operator=get_text(".//siri:OperatorRef"),
-                destination=get_text(".//siri:DestinationName"),
-            )
-        except ValueError as e:
-            logger.warning(f"Invalid coordinate: {e}")
-            return None
+            with self._session.get(
+                url, params=params, timeout=self.config.request_timeout, stream=True
+            ) as response:
+                waited = time.perf_counter() - start
+                response.raise_for_status()
+                body = ResponseStream(response)
+                parse_start = time.perf_counter()
+                vehicles = parse_siri_vm(body)
+                # The body is read as it is parsed; split the two apart.
+                PARSE_SECONDS.observe(time.perf_counter() - parse_start - body.read_seconds)
+                UPSTREAM_SECONDS.observe(waited + body.read_seconds, "bods")
+                UPSTREAM_BYTES.inc("bods", amount=body.bytes_read)
+        except (requests.RequestException, SiriParseError) as e:
+            UPSTREAM_ERRORS.inc("bods")
+            self.breaker.record_failure()
+            if isinstance(e, requests.Timeout):
+                logger.warning("API request timed out")
+            else:
+                logger.error(f"API request failed: {e}")
+            raise UpstreamUnavailable(f"BODS request failed: {e}", self.breaker.retry_after()) from e
+
+        self.breaker.record_success()
+        logger.info(f"Fetched {len(vehicles)} vehicles")
+        return vehicles
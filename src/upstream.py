@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+USER_AGENT = "BusTracker/0.8 (+https://adamjames.me; contact: adam@<domain>)"
+
+
+def make_session(pool_size: int) -> requests.Session:
+    # One keep-alive pool per upstream host, sized so every server thread
+    # can hold a connection without queueing behind the others.
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({"User-Agent": USER_AGENT})
+    return session
+
+
+class UpstreamUnavailable(Exception):
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    # Closed: requests go through. After `failure_threshold` consecutive
+    # failures it opens and refuses them outright for a backoff that doubles
+    # with each further failure, jittered so workers don't retry in step.
+    # Once the backoff has passed, one request is let through as a probe;
+    # its outcome closes the breaker or opens it again for longer.
+    def __init__(self, name: str, failure_threshold: int, backoff_seconds: float, max_backoff_seconds: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self._failures = 0
+        self._open_until = 0.0
+        self._probe_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def open(self) -> bool:
+        return self._failures >= self.failure_threshold and time.monotonic() < self._open_until
+
+    def allow(self, probe_seconds: float) -> bool:
+        # `probe_seconds` bounds how long a probe may take before another
+        # caller is allowed to try in its place.
+        now = time.monotonic()
+        with self._lock:
+            if self._failures < self.failure_threshold:
+                return True
+            if now < self._open_until or now < self._probe_until:
+                return False
+            self._probe_until = now + probe_seconds
+            return True
+
+    def release(self) -> None:
+        # The caller granted a probe never made the request; let the next one try.
+        with self._lock:
+            self._probe_until = 0.0
+
+    def retry_after(self) -> float:
+        return max(0.0, self._open_until - time.monotonic())
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._failures >= self.failure_threshold:
+                logger.info(f"{self.name} recovered")
+            self._failures = 0
+            self._probe_until = 0.0
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probe_until = 0.0
+            excess = self._failures - self.failure_threshold
+            if excess < 0:
+                return
+            backoff = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** min(excess, 32))
+            backoff *= random.uniform(0.5, 1.0)
+            self._open_until = time.monotonic() + backoff
+            logger.warning(f"{self.name} failing, backing off for {backoff:.1f}s")
+
+    def get_stats(self) -> dict:
+        return {
+            f"{self.name}_breaker_open": self.open,
+            f"{self.name}_consecutive_failures": self._failures,
+        }
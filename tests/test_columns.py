@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import json
+import shutil
+import subprocess
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+from src.app import create_app
+from src.config import Config
+from src.encoding import COLUMNS_MIMETYPE
+from src.models import Vehicle
+from src.state import MemoryBackend
+from src.tracker import BusTracker
+
+API_JS = Path(__file__).parent.parent / "src" / "static" / "js" / "api.js"
+AREA = (-0.2, 51.4, 0.2, 51.7)
+URL = "/api/buses?west=-0.2&south=51.4&east=0.2&north=51.7"
+
+# Loads api.js as a module, decodes the columns body on stdin and prints
+# the vehicles, as the browser does.
+DECODE = """
+const source = require('fs').readFileSync(process.argv[1], 'utf8');
+import('data:text/javascript,' + encodeURIComponent(source)).then(({ decodeColumns }) => {
+    const body = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+    process.stdout.write(JSON.stringify(decodeColumns(body.vehicles)));
+});
+"""
+
+
+def _decode(body: bytes) -> list[dict]:
+    result = subprocess.run(
+        ["node", "-e", DECODE, str(API_JS)], input=body, capture_output=True, check=True, timeout=30
+    )
+    return json.loads(result.stdout)
+
+
+def _epoch(value: str | None) -> float | None:
+    return None if value is None else datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+@pytest.mark.skipif(shutil.which("node") is None, reason="needs node")
+def test_columns_decode_to_the_json_vehicles():
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    vehicles = [
+        Vehicle("east", 51.512345, 0.123456, "12", "OP", "Dest", now, now - timedelta(seconds=20), 4.6, 359.0),
+        Vehicle("west", 51.654321, -0.198765, "N12", "Other", "Elsewhere", now - timedelta(seconds=40)),
+        Vehicle("middle", 51.45, -0.000001, "12", "OP", "Dest", now, None, 0.0, None),
+        Vehicle("still", 51.5, 0.05, "7", "OP", "Dest", now, now, None, 90.0),
+    ]
+    config = Config(
+        poll_region=AREA,
+        snapshot_path="",
+        history_path="",
+        state_backend="memory",
+        prefetch_budget=0,
+        osrm_url="",
+        aircraft_url="",
+    )
+    tracker = BusTracker("test", config, MemoryBackend())
+    tracker.publish_snapshot(AREA, vehicles)
+    client = create_app(tracker, config).test_client()
+
+    plain = client.get(URL, headers={"Accept": "application/json"})
+    packed = client.get(URL, headers={"Accept": COLUMNS_MIMETYPE})
+    assert plain.mimetype == "application/json"
+    assert packed.mimetype == COLUMNS_MIMETYPE
+
+    expected = plain.get_json()["vehicles"]
+    decoded = _decode(packed.data)
+
+    # Columns come sorted by longitude, so the deltas between them stay short.
+    assert [v["longitude"] for v in decoded] == sorted(v["longitude"] for v in decoded)
+    assert len(decoded) == len(expected)
+    by_id = {v["vehicle_id"]: v for v in expected}
+    for got in decoded:
+        want = by_id[got["vehicle_id"]]
+        assert got["latitude"] == pytest.approx(want["latitude"], abs=1e-6)
+        assert got["longitude"] == pytest.approx(want["longitude"], abs=1e-6)
+        for field in ("line", "operator", "destination", "speed", "heading"):
+            assert got[field] == want[field], field
+        for field in ("timestamp", "recorded_at"):
+            assert _epoch(got[field]) == _epoch(want[field]), field
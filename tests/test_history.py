@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+import os
+from datetime import datetime, timezone
+
+from src.history import _ROW, BLOCK_ROWS, HistoryStore
+from src.models import Vehicle
+
+PARTITION = 3600
+NORTH_AREA = (-0.2, 51.6, 0.0, 51.7)
+SOUTH_AREA = (-0.2, 51.3, 0.0, 51.4)
+
+
+def _store(path) -> HistoryStore:
+    return HistoryStore(str(path), PARTITION, 7 * 24 * 3600)
+
+
+def _write(store: HistoryStore, vehicles: list[Vehicle]) -> None:
+    for v in vehicles:
+        store.on_upsert(None, v)
+    store.poll_once()
+
+
+def _positions(count: int, lat: float, at: datetime, prefix: str = "bus") -> list[Vehicle]:
+    return [
+        Vehicle(f"{prefix}{i}", lat, -0.1 + i * 1e-5, "1", "OP", "Dest", at, at)
+        for i in range(count)
+    ]
+
+
+def _window(at: datetime) -> tuple[float, float]:
+    start = at.timestamp() // PARTITION * PARTITION
+    return start, start + PARTITION - 1
+
+
+def test_query_skips_blocks_outside_the_zone_map(tmp_path):
+    at = datetime.now(timezone.utc).replace(microsecond=0)
+    store = _store(tmp_path)
+    _write(store, _positions(BLOCK_ROWS, 51.65, at))
+    _write(store, _positions(BLOCK_ROWS, 51.35, at))
+    store.stop()
+    start, end = _window(at)
+
+    # Rewrite the second block's rows to lie in the north area. Its zone map
+    # still says south, so a query that honours it never reads them.
+    (rows,) = [name for name in os.listdir(tmp_path) if name.endswith(".rows")]
+    with open(tmp_path / rows, "rb+") as f:
+        first_block = f.read(BLOCK_ROWS * _ROW.size)
+        f.write(first_block)
+
+    assert len(list(store.query(NORTH_AREA, start, end))) == BLOCK_ROWS
+    assert list(store.query(SOUTH_AREA, start, end)) == []
+    assert list(store.query(NORTH_AREA, end + 1, end + PARTITION)) == []
+
+
+def test_query_filters_by_vehicle_and_line(tmp_path):
+    at = datetime.now(timezone.utc).replace(microsecond=0)
+    store = _store(tmp_path)
+    _write(store, _positions(10, 51.65, at))
+    start, end = _window(at)
+
+    found = list(store.query(NORTH_AREA, start, end, vehicle_id="bus3"))
+    assert [p["vehicle_id"] for p in found] == ["bus3"]
+    assert list(store.query(NORTH_AREA, start, end, line="missing")) == []
+    store.stop()
+
+
+def test_reopening_a_torn_partition(tmp_path):
+    at = datetime.now(timezone.utc).replace(microsecond=0)
+    store = _store(tmp_path)
+    _write(store, _positions(10, 51.65, at))
+    store.stop()
+
+    # A crash mid-append leaves half a row and half a string behind.
+    names = os.listdir(tmp_path)
+    (rows,) = [name for name in names if name.endswith(".rows")]
+    (strings,) = [name for name in names if name.endswith(".str")]
+    with open(tmp_path / rows, "ab") as f:
+        f.write(b"\xff" * (_ROW.size // 2))
+    with open(tmp_path / strings, "a", encoding="utf-8") as f:
+        f.write('"torn')
+
+    store = _store(tmp_path)
+    _write(store, _positions(5, 51.65, at, prefix="late"))
+    start, end = _window(at)
+
+    found = list(store.query(NORTH_AREA, start, end))
+    assert len(found) == 15
+    assert sorted(p["vehicle_id"] for p in found)[:5] == [f"bus{i}" for i in range(5)]
+    assert {p["vehicle_id"] for p in found if p["vehicle_id"].startswith("late")} == {f"late{i}" for i in range(5)}
+    assert os.path.getsize(tmp_path / rows) == 15 * _ROW.size
+    store.stop()
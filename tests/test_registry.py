@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+from src.config import Config
+from src.models import Vehicle
+from src.registry import VehicleRegistry
+from src.state import MemoryBackend
+from src.tracker import BusTracker
+
+# Registry tiles are 0.1 degrees; AREA is a whole number of them.
+AREA = (-0.2, 51.4, 0.2, 51.7)
+
+
+def _bus(vehicle_id: str, lat: float, lon: float, line: str = "1") -> Vehicle:
+    return Vehicle(vehicle_id, lat, lon, line, "OP", "Dest")
+
+
+def _registry(log_max_entries: int = 1000) -> VehicleRegistry:
+    return VehicleRegistry(0.1, 600, log_max_entries)
+
+
+def test_delta_reports_added_vehicles():
+    registry = _registry()
+    since = registry.ingest(AREA, [_bus("a", 51.5, -0.1)])
+    registry.ingest(AREA, [_bus("a", 51.5, -0.1), _bus("b", 51.55, 0.05)])
+
+    delta = registry.changes_since(since, AREA)
+    assert [v.vehicle_id for v in delta.vehicles] == ["b"]
+    assert delta.removed == []
+
+
+def test_delta_reports_moves_and_moves_out_of_view():
+    registry = _registry()
+    since = registry.ingest(AREA, [_bus("a", 51.5, -0.1), _bus("b", 51.5, 0.1)])
+    registry.ingest(AREA, [_bus("a", 51.51, -0.1), _bus("b", 51.5, 0.15)])
+
+    view = (-0.2, 51.4, 0.12, 51.7)
+    delta = registry.changes_since(since, view)
+    assert [(v.vehicle_id, v.latitude) for v in delta.vehicles] == [("a", 51.51)]
+    assert delta.removed == ["b"]
+
+
+def test_delta_reports_removed_vehicles():
+    registry = _registry()
+    since = registry.ingest(AREA, [_bus("a", 51.5, -0.1), _bus("b", 51.55, 0.05)])
+    registry.ingest(AREA, [_bus("a", 51.5, -0.1)])
+
+    delta = registry.changes_since(since, AREA)
+    assert delta.vehicles == []
+    assert delta.removed == ["b"]
+
+
+def test_delta_skips_changes_outside_the_filter():
+    registry = _registry()
+    since = registry.ingest(AREA, [_bus("a", 51.5, -0.1, "1"), _bus("b", 51.5, 0.1, "2")])
+    registry.ingest(AREA, [_bus("a", 51.51, -0.1, "1"), _bus("b", 51.51, 0.1, "1")])
+
+    delta = registry.changes_since(since, AREA, lambda v: v.line == "2")
+    assert delta.vehicles == []
+    assert delta.removed == ["b"]
+
+
+def test_delta_too_old_or_from_the_future_is_none():
+    registry = _registry(log_max_entries=2)
+    first = registry.ingest(AREA, [_bus("a", 51.5, -0.1)])
+    registry.ingest(AREA, [_bus("a", 51.5, -0.1), _bus("b", 51.5, 0.1)])
+    latest = registry.ingest(AREA, [_bus("a", 51.5, -0.1), _bus("b", 51.5, 0.1), _bus("c", 51.6, 0.1)])
+
+    # The log only holds the last two changes, so the first cursor is lost.
+    assert registry.changes_since(first - 1, AREA) is None
+    assert registry.changes_since(latest + 1, AREA) is None
+    assert registry.changes_since(latest, AREA).vehicles == []
+
+
+def test_unaligned_fetch_keeps_vehicles_outside_it():
+    registry = _registry()
+    registry.ingest(AREA, [_bus("a", 51.55, -0.05), _bus("b", 51.55, 0.05)])
+    # Cuts through the tile holding "a" without covering "a" itself.
+    since = registry.ingest((-0.04, 51.5, 0.1, 51.6), [_bus("b", 51.55, 0.05)])
+
+    assert len(registry) == 2
+    assert registry.changes_since(since - 1, AREA).removed == []
+
+
+def test_buses_since_falls_back_to_a_full_response():
+    from src.app import create_app
+
+    config = Config(
+        poll_region=AREA,
+        snapshot_path="",
+        history_path="",
+        state_backend="memory",
+        prefetch_budget=0,
+        osrm_url="",
+        aircraft_url="",
+    )
+    tracker = BusTracker("test", config, MemoryBackend())
+    tracker.publish_snapshot(AREA, [_bus("a", 51.5, -0.1)])
+    since = tracker.registry.version
+    tracker.publish_snapshot(AREA, [_bus("a", 51.5, -0.1), _bus("b", 51.55, 0.05)])
+    client = create_app(tracker, config).test_client()
+    url = "/api/buses?west=-0.2&south=51.4&east=0.2&north=51.7"
+
+    delta = client.get(f"{url}&since={since}").get_json()
+    assert delta["delta"] is True
+    assert [v["vehicle_id"] for v in delta["vehicles"]] == ["b"]
+
+    # A cursor the registry can't answer gets everything instead.
+    full = client.get(f"{url}&since={since + 100}").get_json()
+    assert "delta" not in full
+    assert sorted(v["vehicle_id"] for v in full["vehicles"]) == ["a", "b"]
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import threading
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from src.config import Config
+from src.models import Vehicle
+from src.state import MemoryBackend, RedisBackend, decode_vehicles, encode_vehicles
+from src.tracker import BusTracker
+
+fakeredis = pytest.importorskip("fakeredis")
+
+# The StateBackend contract, run against the in-process backend and against
+# RedisBackend on fakeredis. TTLs are kept short and waited out for real.
+TTL = 0.2
+
+
+def _redis(server=None) -> RedisBackend:
+    return RedisBackend("", client=fakeredis.FakeRedis(server=server or fakeredis.FakeServer()))
+
+
+@pytest.fixture(params=["memory", "redis"])
+def backend(request):
+    return MemoryBackend() if request.param == "memory" else _redis()
+
+
+def test_get_set_delete(backend):
+    assert backend.get("a") is None
+    backend.set("a", b"1")
+    assert backend.get("a") == b"1"
+    backend.delete("a")
+    assert backend.get("a") is None
+
+
+def test_set_ttl(backend):
+    backend.set("a", b"1", TTL)
+    backend.set("b", b"2")
+    assert backend.get("a") == b"1"
+    time.sleep(TTL * 1.5)
+    assert backend.get("a") is None
+    assert backend.get("b") == b"2"
+
+
+def test_get_many_set_many(backend):
+    backend.set_many({"a": b"1", "b": b"2"}, TTL)
+    assert backend.get_many(["a", "missing", "b"]) == [b"1", None, b"2"]
+    assert backend.get_many([]) == []
+    time.sleep(TTL * 1.5)
+    assert backend.get_many(["a", "b"]) == [None, None]
+
+
+def test_incr(backend):
+    assert backend.incr("n") == 1
+    assert backend.incr("n", 4) == 5
+    assert backend.incr("n", -2) == 3
+    assert int(backend.get("n")) == 3
+
+
+def test_incr_ttl_set_on_create_only(backend):
+    backend.incr("n", 1, TTL)
+    time.sleep(TTL * 0.6)
+    # A later increment must not push the expiry back.
+    backend.incr("n", 1, TTL)
+    time.sleep(TTL * 0.6)
+    assert backend.get("n") is None
+    assert backend.incr("n", 1, TTL) == 1
+
+
+def test_add(backend):
+    assert backend.add("claim", b"1", TTL)
+    assert not backend.add("claim", b"2", TTL)
+    assert backend.get("claim") == b"1"
+    time.sleep(TTL * 1.5)
+    assert backend.add("claim", b"3", TTL)
+
+
+def test_lease_acquire_and_renew(backend):
+    assert backend.acquire_lease("lease", "a", TTL)
+    assert not backend.acquire_lease("lease", "b", TTL)
+    # The holder renews, which keeps it past the first expiry.
+    time.sleep(TTL * 0.6)
+    assert backend.acquire_lease("lease", "a", TTL)
+    time.sleep(TTL * 0.6)
+    assert not backend.acquire_lease("lease", "b", TTL)
+    # Once it lapses anyone may take it.
+    time.sleep(TTL * 1.5)
+    assert backend.acquire_lease("lease", "b", TTL)
+
+
+def test_vehicles_round_trip():
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    vehicles = [
+        Vehicle("1", 51.5, -0.1, "12", "OP", "Dest", now, now, 4.5, 90.0),
+        Vehicle("2", 51.6, -0.2, "13", "OP", "Elsewhere", now),
+    ]
+    timestamp, decoded = decode_vehicles(encode_vehicles(now, vehicles))
+    assert timestamp == now
+    assert decoded == vehicles
+
+
+def _tracker(server) -> BusTracker:
+    config = Config(
+        poll_region=None,
+        snapshot_path="",
+        history_path="",
+        state_backend="redis",
+        tile_size_degrees=0.1,
+        cache_ttl_seconds=60,
+        request_timeout=2,
+        prefetch_budget=0,
+    )
+    return BusTracker("test", config, _redis(server))
+
+
+def test_claim_and_wait_across_trackers():
+    # Two workers ask for the same tiles at once: one claims and fetches,
+    # the other waits for its result in the shared cache.
+    server = fakeredis.FakeServer()
+    trackers = [_tracker(server), _tracker(server)]
+    bounds = (-2.58, 51.42, -2.52, 51.48)
+    calls = []
+
+    def fetch(area, rate_limiter=None):
+        calls.append(area)
+        time.sleep(0.3)
+        return [Vehicle("bus", 51.45, -2.55, "1", "OP", "Dest")]
+
+    for tracker in trackers:
+        tracker._fetch_vehicles = fetch
+
+    views = [None, None]
+
+    def ask(i):
+        views[i] = trackers[i].get_view(bounds)
+
+    threads = [threading.Thread(target=ask, args=(i,)) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    for view in views:
+        assert [v.vehicle_id for v in view.vehicles] == ["bus"]
+    # Both registries learnt about the vehicle, one by fetching, one from the shared cache.
+    assert [len(t.registry) for t in trackers] == [1, 1]
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+from datetime import timedelta
+
+import pytest
+
+from src import upstream
+from src.config import Config
+from src.models import Vehicle
+from src.state import MemoryBackend
+from src.tracker import BusTracker
+from src.upstream import CircuitBreaker, UpstreamUnavailable
+
+BACKOFF = 2.0
+PROBE = 5.0
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(upstream.time, "monotonic", clock)
+    # No jitter, so every backoff is its full length.
+    monkeypatch.setattr(upstream.random, "uniform", lambda a, b: b)
+    return clock
+
+
+def _breaker() -> CircuitBreaker:
+    return CircuitBreaker("test", 3, BACKOFF, 60)
+
+
+def _trip(breaker: CircuitBreaker) -> None:
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow(PROBE)
+        breaker.record_failure()
+
+
+def test_opens_after_consecutive_failures(clock):
+    breaker = _breaker()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert not breaker.open
+    breaker.record_success()
+
+    _trip(breaker)
+    assert breaker.open
+    assert not breaker.allow(PROBE)
+    assert breaker.retry_after() == BACKOFF
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    clock.now += BACKOFF
+
+    assert not breaker.open
+    assert breaker.allow(PROBE)
+    # Everyone else waits on the probe, until it has taken too long.
+    assert not breaker.allow(PROBE)
+    clock.now += PROBE
+    assert breaker.allow(PROBE)
+
+    breaker.record_success()
+    assert breaker.allow(PROBE)
+    assert breaker.allow(PROBE)
+
+
+def test_released_probe_goes_to_the_next_caller(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    clock.now += BACKOFF
+
+    assert breaker.allow(PROBE)
+    breaker.release()
+    assert breaker.allow(PROBE)
+
+
+def test_backoff_doubles_on_failed_probes(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    for expected in (BACKOFF * 2, BACKOFF * 4, BACKOFF * 8):
+        clock.now += breaker.retry_after()
+        assert breaker.allow(PROBE)
+        breaker.record_failure()
+        assert breaker.open
+        assert breaker.retry_after() == expected
+
+
+def test_backoff_is_capped(clock):
+    breaker = CircuitBreaker("test", 1, BACKOFF, 10)
+    for _ in range(10):
+        breaker.record_failure()
+    assert breaker.retry_after() == 10
+
+
+def _tracker() -> BusTracker:
+    config = Config(
+        poll_region=None,
+        snapshot_path="",
+        history_path="",
+        state_backend="memory",
+        tile_size_degrees=0.1,
+        cache_ttl_seconds=60,
+        cache_stale_grace_seconds=30,
+        prefetch_budget=0,
+    )
+    return BusTracker("test", config, MemoryBackend())
+
+
+def _expire(tracker: BusTracker, seconds: float) -> None:
+    for entry in tracker._cache.values():
+        entry.timestamp -= timedelta(seconds=seconds)
+
+
+def _down(area, rate_limiter=None):
+    raise UpstreamUnavailable("BODS unavailable, backing off", 30)
+
+
+def test_view_falls_back_to_expired_entries_while_upstream_is_down():
+    tracker = _tracker()
+    bounds = (-0.2, 51.4, 0.0, 51.6)
+    tracker._fetch_vehicles = lambda area, rate_limiter=None: [Vehicle("bus", 51.5, -0.1, "1", "OP", "Dest")]
+    tracker.get_view(bounds)
+
+    _expire(tracker, 600)
+    tracker._fetch_vehicles = _down
+    view = tracker.get_view(bounds)
+    assert [v.vehicle_id for v in view.vehicles] == ["bus"]
+    assert view.age_seconds() >= 600
+
+
+def test_view_fails_when_a_tile_has_no_data_at_all():
+    tracker = _tracker()
+    tracker._fetch_vehicles = lambda area, rate_limiter=None: [Vehicle("bus", 51.5, -0.1, "1", "OP", "Dest")]
+    tracker.get_view((-0.2, 51.4, 0.0, 51.6))
+
+    _expire(tracker, 600)
+    tracker._fetch_vehicles = _down
+    with pytest.raises(UpstreamUnavailable):
+        tracker.get_view((-0.2, 51.4, 0.2, 51.6))